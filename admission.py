@@ -0,0 +1,167 @@
+"""
+FMPConnect — Controle de admissão para chamadas ao upstream
+
+Uma rajada de perguntas não pode prender todas as threads do Flask em
+chamadas longas ao Gemini (as páginas estáticas param de carregar junto).
+
+  - PortaoConcorrencia: no máximo N chamadas simultâneas ao upstream, com
+    fila de espera limitada e tempo máximo na fila; excedeu, 503 rápido
+  - LimitadorPorCliente: token bucket por cliente; estourou, 429 rápido
+    (LimiteDoCliente: diz respeito só a quem pediu, não a quem espera junto)
+
+Nos dois casos o erro carrega um `retry_after` para o cabeçalho Retry-After.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class Rejeitado(Exception):
+    """Requisição recusada pelo controle de admissão."""
+
+    def __init__(self, status: int, retry_after: int, motivo: str):
+        super().__init__(motivo)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class LimiteDoCliente(Rejeitado):
+    """429 do token bucket de um cliente."""
+
+
+class _Vaga:
+    """Vaga ocupada no portão; `liberar` pode ser chamado mais de uma vez."""
+
+    __slots__ = ("_portao", "_liberada")
+
+    def __init__(self, portao):
+        self._portao = portao
+        self._liberada = False
+
+    def liberar(self):
+        with self._portao._cond:
+            if self._liberada:
+                return
+            self._liberada = True
+            self._portao.em_uso -= 1
+            self._portao._cond.notify()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.liberar()
+
+
+class PortaoConcorrencia:
+    """Semáforo com fila de espera limitada e tempo máximo de espera."""
+
+    def __init__(self, max_concorrentes: int = 8, max_fila: int = 16, max_espera: float = 5.0):
+        self.max_concorrentes = max_concorrentes
+        self.max_fila = max_fila
+        self.max_espera = max_espera
+        self.em_uso = 0
+        self.na_fila = 0
+        self.admitidas = 0
+        self.rejeitadas_fila_cheia = 0
+        self.rejeitadas_tempo_espera = 0
+        self._esperas = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+        self._cond = threading.Condition()
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self.max_espera))
+
+    def adquirir(self) -> _Vaga:
+        """Ocupa uma vaga (esperando na fila se preciso) ou levanta Rejeitado(503)."""
+        with self._cond:
+            # Quem chega não fura a fila
+            if self.em_uso < self.max_concorrentes and self.na_fila == 0:
+                self.em_uso += 1
+                self.admitidas += 1
+                return _Vaga(self)
+            if self.na_fila >= self.max_fila:
+                self.rejeitadas_fila_cheia += 1
+                raise Rejeitado(503, self._retry_after(), "Fila de atendimento cheia")
+
+            self.na_fila += 1
+            inicio = time.monotonic()
+            try:
+                admitido = self._cond.wait_for(
+                    lambda: self.em_uso < self.max_concorrentes, timeout=self.max_espera)
+            finally:
+                self.na_fila -= 1
+            espera = time.monotonic() - inicio
+            self._esperas += 1
+            self._espera_total += espera
+            self._espera_max = max(self._espera_max, espera)
+            if not admitido:
+                self.rejeitadas_tempo_espera += 1
+                raise Rejeitado(503, self._retry_after(), "Tempo máximo na fila esgotado")
+            self.em_uso += 1
+            self.admitidas += 1
+            return _Vaga(self)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "em_uso": self.em_uso,
+                "na_fila": self.na_fila,
+                "max_concorrentes": self.max_concorrentes,
+                "max_fila": self.max_fila,
+                "max_espera_s": self.max_espera,
+                "admitidas": self.admitidas,
+                "rejeitadas_fila_cheia": self.rejeitadas_fila_cheia,
+                "rejeitadas_tempo_espera": self.rejeitadas_tempo_espera,
+                "espera_media_ms": round(self._espera_total * 1000 / self._esperas, 1) if self._esperas else 0.0,
+                "espera_max_ms": round(self._espera_max * 1000, 1),
+            }
+
+
+class LimitadorPorCliente:
+    """
+    Token bucket por cliente: `por_minuto` fichas repostas por minuto, até
+    `rajada` acumuladas. Guarda no máximo `max_clientes` baldes (LRU).
+    `por_minuto <= 0` desliga o limite.
+    """
+
+    def __init__(self, por_minuto: float = 20, rajada: int = 10, max_clientes: int = 10000):
+        self.por_minuto = por_minuto
+        self.rajada = rajada
+        self.max_clientes = max_clientes
+        self.permitidas = 0
+        self.rejeitadas = 0
+        self._taxa = por_minuto / 60
+        self._baldes = OrderedDict()   # cliente -> (fichas, instante)
+        self._lock = threading.Lock()
+
+    def consumir(self, cliente: str):
+        """Gasta uma ficha do cliente ou levanta LimiteDoCliente (429)."""
+        if self.por_minuto <= 0:
+            return
+        with self._lock:
+            agora = time.monotonic()
+            fichas, antes = self._baldes.pop(cliente, (self.rajada, agora))
+            fichas = min(self.rajada, fichas + (agora - antes) * self._taxa)
+            if fichas < 1:
+                self._baldes[cliente] = (fichas, agora)
+                self.rejeitadas += 1
+                raise LimiteDoCliente(429, max(1, math.ceil((1 - fichas) / self._taxa)),
+                                "Muitas requisições deste cliente")
+            self._baldes[cliente] = (fichas - 1, agora)
+            while len(self._baldes) > self.max_clientes:
+                self._baldes.popitem(last=False)
+            self.permitidas += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "por_minuto": self.por_minuto,
+                "rajada": self.rajada,
+                "clientes": len(self._baldes),
+                "permitidas": self.permitidas,
+                "rejeitadas": self.rejeitadas,
+            }
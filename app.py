@@ -1,27 +1,47 @@
 import os
 import sys
 import json
-import urllib.request
-import urllib.error
-import asyncio
+import sqlite3
+import atexit
+import base64
+import concurrent.futures
+import hashlib
+import html
+import threading
+import time
 
 # Garante que prints com emoji não travem no terminal Windows (cp1252)
 if sys.stdout.encoding and sys.stdout.encoding.lower() not in ("utf-8", "utf-8-sig"):
     sys.stdout.reconfigure(encoding="utf-8", errors="replace")
     sys.stderr.reconfigure(encoding="utf-8", errors="replace")
 import edge_tts
-import tempfile
+from collections import deque
 from datetime import datetime, timezone, timedelta
 from functools import wraps
 
 import jwt as pyjwt
-from flask import Flask, jsonify, request, send_from_directory, send_file
+from flask import Flask, Response, jsonify, request, send_from_directory, send_file
 from flask_cors import CORS
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import check_password_hash, generate_password_hash
+from werkzeug.serving import is_running_from_reloader
 
+import admission
+import cache
+import conversas
 import database
+import estatisticas
+import gemini
+import history as history_mod
+import importacao
+import retrieval
 import rpa
+import sessions
+import tts_cache
+import tts_loop
+import tts_warmer
+import voz
 
 load_dotenv()
 
@@ -123,8 +143,94 @@ REGRAS DE RESPOSTA GERAL:
 3. Responda apenas sobre a FMP.
 """
 
+ACCESSIBILITY_RULES = """
+            [MODO ACESSIBILIDADE/SURDEZ ATIVO]
+            PERFIL: O usuário necessita de objetividade máxima, clareza visual e português simplificado.
+
+            REGRAS DE FORMATAÇÃO E ESTILO:
+            1. Use frases curtas (Sujeito + Verbo + Predicado).
+            2. Prefira listas (bullet points) ao invés de parágrafos longos.
+            3. Evite conectivos complexos (portanto, contudo, todavia).
+            4. Seja direto: Dê a informação imediatamente.
+            """
+
+ACCESSIBILITY_START_RULES = """
+                REGRA DE INÍCIO:
+                - Você PODE dizer "Olá. Modo acessibilidade ativado." uma única vez.
+                - Em seguida, responda a pergunta se houver, ou aguarde o comando.
+                """
+
+ACCESSIBILITY_CONTINUE_RULES = """
+                REGRA CRÍTICA - ZERO REPETIÇÃO:
+                - É ESTRITAMENTE PROIBIDO usar saudações como: "Olá", "Oi", "Tudo bem", "Sou o FMPConnect".
+                - Comece a resposta DIRETAMENTE com o dado solicitado.
+                Exemplo Correto: "O curso de ADS dura 2,5 anos."
+                """
+
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
+# Atrás de proxy reverso, remote_addr é o do proxy: com TRUSTED_PROXY_HOPS=n,
+# o IP do cliente vem do X-Forwarded-For (só os n saltos dos nossos proxies)
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", 0))
+if TRUSTED_PROXY_HOPS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=["X-Audio-Url", "X-Cache", "X-History"])
+
+
+# ──────────────────────────────────────────────
+# Instruções de sistema pré-compiladas
+# ──────────────────────────────────────────────
+
+# Regras extras por (modo, início de conversa)
+_REGRAS_MODO = {
+    ("normal", True): "",
+    ("normal", False): "",
+    ("surdez", True): ACCESSIBILITY_RULES + ACCESSIBILITY_START_RULES,
+    ("surdez", False): ACCESSIBILITY_RULES + ACCESSIBILITY_CONTINUE_RULES,
+}
+
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", 8))
+RETRIEVAL_TOKEN_BUDGET = int(os.environ.get("RETRIEVAL_TOKEN_BUDGET", 1500))
+
+# Variantes com a base completa, recompiladas só quando a versão da base de
+# conhecimento muda (usadas por /text/config)
+_instrucoes_compiladas = {"version": None, "variants": {}}
+_instrucoes_lock = threading.Lock()
+
+
+def _compilar_instrucoes():
+    base = database.build_dynamic_system_instruction(BASE_SYSTEM_INSTRUCTION)
+    return {chave: base + regras for chave, regras in _REGRAS_MODO.items()}
+
+
+def _normalizar_modo(mode):
+    """Modo do cliente reduzido a "surdez" ou "normal" (vira chave de cache e de estatística)."""
+    return "surdez" if mode == "surdez" else "normal"
+
+
+def get_system_instruction(mode="normal", is_start=True):
+    """Instrução de sistema com a base de conhecimento completa (usada por /text/config)."""
+    global _instrucoes_compiladas
+    modo = _normalizar_modo(mode)
+    version = database.get_knowledge_version()
+    cache = _instrucoes_compiladas
+    if cache["version"] != version:
+        with _instrucoes_lock:
+            cache = _instrucoes_compiladas
+            if cache["version"] != version:
+                cache = {"version": version, "variants": _compilar_instrucoes()}
+                _instrucoes_compiladas = cache
+    return cache["variants"][(modo, is_start)]
+
+
+def montar_instrucao(mode, is_start, query):
+    """
+    Partes da instrução do chat: (estática, seção de conhecimento).
+    A parte estática (base + regras do modo) não depende da pergunta; a seção
+    traz apenas os itens da base mais relevantes para `query` (retrieval.py).
+    """
+    modo = _normalizar_modo(mode)
+    secao = retrieval.montar_secao_conhecimento(query, RETRIEVAL_TOP_K, RETRIEVAL_TOKEN_BUDGET)
+    return BASE_SYSTEM_INSTRUCTION + _REGRAS_MODO[(modo, is_start)], secao
 
 
 # ──────────────────────────────────────────────
@@ -236,11 +342,174 @@ def admin_change_password():
 # Rotas de Base de Conhecimento
 # ──────────────────────────────────────────────
 
+# Índice único uq_knowledge_titulo_ativo (database.MIGRACOES)
+ERRO_TITULO_DUPLICADO = "Já existe um item ativo com este título"
+
+
+# Listagens do painel: paginação por cursor (keyset) e ETag fraca
+ADMIN_PAGE_SIZE = int(os.environ.get("ADMIN_PAGE_SIZE", 50))
+ADMIN_PAGE_MAX = 500
+
+
+def _cursor_codificar(posicao):
+    return base64.urlsafe_b64encode(json.dumps(list(posicao)).encode()).decode().rstrip("=")
+
+
+def _cursor_decodificar(cursor):
+    try:
+        valor = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        ordem, ident = valor
+        if not isinstance(ident, int):
+            raise ValueError
+        return ordem, ident
+    except (ValueError, TypeError):
+        raise ValueError("cursor inválido")
+
+
+def _parametros_pagina():
+    """(limite, posição após a qual continuar). ValueError se os parâmetros forem inválidos."""
+    limite = int(request.args.get("limit", ADMIN_PAGE_SIZE))
+    if not 1 <= limite <= ADMIN_PAGE_MAX:
+        raise ValueError(f"limit deve estar entre 1 e {ADMIN_PAGE_MAX}")
+    cursor = request.args.get("cursor")
+    return limite, _cursor_decodificar(cursor) if cursor else None
+
+
+def _resposta_versionada(gerar):
+    """
+    JSON com ETag fraca derivada da versão da base (a mesma em todos os
+    workers) e da URL pedida; se o cliente já tem essa versão
+    (If-None-Match), responde 304 sem consultar o banco.
+    A versão é lida antes da consulta: uma escrita no meio só deixa a ETag mais velha.
+    """
+    tag = f"k{database.get_knowledge_epoch()}-{database.get_knowledge_version()}-{hashlib.sha1(request.full_path.encode()).hexdigest()[:12]}"
+    if request.if_none_match.contains_weak(tag):
+        resp = Response(status=304)
+    else:
+        resp = jsonify(gerar())
+    resp.set_etag(tag, weak=True)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
 @app.route("/admin/knowledge", methods=["GET"])
 @require_auth
 def list_knowledge():
-    items = database.get_knowledge_items(active_only=False)
-    return jsonify({"items": items})
+    """
+    Query: limit (padrão ADMIN_PAGE_SIZE), cursor (next_cursor da página anterior),
+    fields (lista separada por vírgulas, ver database.CAMPOS_KNOWLEDGE), category, active (1/0).
+    """
+    try:
+        limite, apos = _parametros_pagina()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    campos = request.args.get("fields")
+    campos = tuple(c.strip() for c in campos.split(",") if c.strip()) if campos else database.CAMPOS_KNOWLEDGE_PADRAO
+    desconhecidos = [c for c in campos if c not in database.CAMPOS_KNOWLEDGE]
+    if desconhecidos:
+        return jsonify({"error": f"Campos desconhecidos: {', '.join(desconhecidos)}"}), 400
+    ativo = request.args.get("active", "")
+    if ativo not in ("", "0", "1"):
+        return jsonify({"error": "active deve ser 1, 0 ou vazio"}), 400
+
+    def gerar():
+        items, proximo = database.listar_knowledge_pagina(
+            limite, apos, campos,
+            categoria=request.args.get("category") or None,
+            ativo=None if ativo == "" else ativo == "1",
+        )
+        return {"items": items, "next_cursor": _cursor_codificar(proximo) if proximo else None}
+
+    return _resposta_versionada(gerar)
+
+
+@app.route("/admin/knowledge/stats", methods=["GET"])
+@require_auth
+def knowledge_stats():
+    """Totais por categoria e itens recentes para o dashboard."""
+    def gerar():
+        stats = database.estatisticas_knowledge()
+        stats["recentes"], _ = database.listar_knowledge_pagina(5, campos=("title", "category", "active"))
+        return stats
+
+    return _resposta_versionada(gerar)
+
+
+@app.route("/admin/knowledge/bulk", methods=["POST"])
+@require_auth
+def bulk_import_knowledge():
+    """
+    Importação em massa (upsert pelo título). Corpo: JSONL (uma linha por item)
+    ou CSV com cabeçalho; campos category, title, content e active (opcional).
+    O formato vem de ?format=jsonl|csv ou do Content-Type (text/csv = CSV).
+    """
+    formato = request.args.get("format") or ("csv" if request.mimetype == "text/csv" else "jsonl")
+    inicio = time.perf_counter()
+    try:
+        resumo = importacao.importar(request.stream, formato, request.current_user["user_id"])
+    except importacao.FormatoInvalido as e:
+        return jsonify({"error": str(e)}), 400
+    if resumo["inseridos"] or resumo["atualizados"]:
+        aquecedor_tts.avisar()
+    resumo["ms"] = round((time.perf_counter() - inicio) * 1000)
+    print(f"[BULK] {resumo['linhas']} linha(s): {resumo['inseridos']} inserido(s), "
+          f"{resumo['atualizados']} atualizado(s), {resumo['total_erros']} erro(s) em {resumo['ms']} ms")
+    return jsonify(resumo)
+
+
+@app.route("/admin/knowledge/bulk", methods=["GET"])
+@require_auth
+def bulk_export_knowledge():
+    """Exporta a base em JSONL, em stream. Query: active (1/0; vazio = todos)."""
+    ativo = request.args.get("active", "")
+    if ativo not in ("", "0", "1"):
+        return jsonify({"error": "active deve ser 1, 0 ou vazio"}), 400
+    nome = f"conhecimento-{datetime.now():%Y%m%d-%H%M}.jsonl"
+    return Response(
+        importacao.exportar_jsonl(None if ativo == "" else ativo == "1"),
+        mimetype="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{nome}"', "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/admin/knowledge/<int:item_id>", methods=["GET"])
+@require_auth
+def get_knowledge(item_id):
+    item = database.get_knowledge_item(item_id)
+    if item is None:
+        return jsonify({"error": "Item não encontrado"}), 404
+    return jsonify({"item": item})
+
+
+@app.route("/admin/knowledge/search", methods=["GET"])
+@require_auth
+def search_knowledge():
+    """
+    Busca textual (FTS5) por relevância.
+    Query: q (obrigatório), category, active (1/0; vazio = todos), limit (até 200).
+    """
+    termo = request.args.get("q", "").strip()
+    if not termo:
+        return jsonify({"error": "Informe o termo de busca (q)"}), 400
+    ativo = request.args.get("active", "")
+    if ativo not in ("", "0", "1"):
+        return jsonify({"error": "active deve ser 1, 0 ou vazio"}), 400
+    try:
+        limite = max(1, min(int(request.args.get("limit", 50)), 200))
+    except ValueError:
+        return jsonify({"error": "limit inválido"}), 400
+
+    inicio = time.perf_counter()
+    items = database.buscar_knowledge(
+        termo,
+        categoria=request.args.get("category") or None,
+        ativo=None if ativo == "" else ativo == "1",
+        limite=limite,
+    )
+    for item in items:
+        # Trecho pronto para o painel: texto escapado, termos em <mark>
+        item["snippet"] = html.escape(item["snippet"]).replace("\x02", "<mark>").replace("\x03", "</mark>")
+    return jsonify({"items": items, "ms": round((time.perf_counter() - inicio) * 1000, 1)})
 
 
 @app.route("/admin/knowledge", methods=["POST"])
@@ -254,15 +523,17 @@ def create_knowledge():
     if not category or not title or not content:
         return jsonify({"error": "Categoria, título e conteúdo são obrigatórios"}), 400
 
-    conn = database.get_db()
-    cursor = conn.execute(
-        "INSERT INTO knowledge_items (category, title, content, created_by) VALUES (?, ?, ?, ?)",
-        (category, title, content, request.current_user["user_id"])
-    )
-    item_id = cursor.lastrowid
-    conn.commit()
-    item = conn.execute("SELECT * FROM knowledge_items WHERE id=?", (item_id,)).fetchone()
-    conn.close()
+    try:
+        with database.transacao() as conn:
+            cursor = conn.execute(
+                "INSERT INTO knowledge_items (category, title, content, created_by) VALUES (?, ?, ?, ?)",
+                (category, title, content, request.current_user["user_id"])
+            )
+            item_id = cursor.lastrowid
+            item = conn.execute("SELECT * FROM knowledge_items WHERE id=?", (item_id,)).fetchone()
+    except sqlite3.IntegrityError:
+        return jsonify({"error": ERRO_TITULO_DUPLICADO}), 409
+    aquecedor_tts.avisar()
     return jsonify({"message": "Item criado com sucesso", "item": dict(item)}), 201
 
 
@@ -277,47 +548,107 @@ def update_knowledge(item_id):
     if not category or not title or not content:
         return jsonify({"error": "Categoria, título e conteúdo são obrigatórios"}), 400
 
-    conn = database.get_db()
-    existing = conn.execute("SELECT id FROM knowledge_items WHERE id=?", (item_id,)).fetchone()
-    if not existing:
-        conn.close()
-        return jsonify({"error": "Item não encontrado"}), 404
-
-    conn.execute(
-        "UPDATE knowledge_items SET category=?, title=?, content=?, updated_at=CURRENT_TIMESTAMP WHERE id=?",
-        (category, title, content, item_id)
-    )
-    conn.commit()
-    item = conn.execute("SELECT * FROM knowledge_items WHERE id=?", (item_id,)).fetchone()
-    conn.close()
+    try:
+        with database.transacao() as conn:
+            cursor = conn.execute(
+                "UPDATE knowledge_items SET category=?, title=?, content=?, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+                (category, title, content, item_id)
+            )
+            if cursor.rowcount == 0:
+                return jsonify({"error": "Item não encontrado"}), 404
+            item = conn.execute("SELECT * FROM knowledge_items WHERE id=?", (item_id,)).fetchone()
+    except sqlite3.IntegrityError:
+        return jsonify({"error": ERRO_TITULO_DUPLICADO}), 409
+    aquecedor_tts.avisar()
     return jsonify({"message": "Item atualizado", "item": dict(item)})
 
 
 @app.route("/admin/knowledge/<int:item_id>", methods=["DELETE"])
 @require_auth
 def delete_knowledge(item_id):
-    conn = database.get_db()
-    existing = conn.execute("SELECT id FROM knowledge_items WHERE id=?", (item_id,)).fetchone()
-    if not existing:
-        conn.close()
-        return jsonify({"error": "Item não encontrado"}), 404
-
-    conn.execute("UPDATE knowledge_items SET active=0 WHERE id=?", (item_id,))
-    conn.commit()
-    conn.close()
+    with database.transacao() as conn:
+        cursor = conn.execute("UPDATE knowledge_items SET active=0 WHERE id=?", (item_id,))
+        if cursor.rowcount == 0:
+            return jsonify({"error": "Item não encontrado"}), 404
     return jsonify({"message": "Item removido"})
 
 
 @app.route("/admin/knowledge/<int:item_id>/restore", methods=["POST"])
 @require_auth
 def restore_knowledge(item_id):
-    conn = database.get_db()
-    conn.execute("UPDATE knowledge_items SET active=1 WHERE id=?", (item_id,))
-    conn.commit()
-    conn.close()
+    try:
+        with database.transacao() as conn:
+            conn.execute("UPDATE knowledge_items SET active=1 WHERE id=?", (item_id,))
+    except sqlite3.IntegrityError:
+        return jsonify({"error": ERRO_TITULO_DUPLICADO}), 409
+    aquecedor_tts.avisar()
     return jsonify({"message": "Item restaurado"})
 
 
+@app.route("/admin/cache", methods=["GET"])
+@require_auth
+def cache_stats():
+    stats = {"answers": answer_cache.stats()}
+    if context_cache is not None:
+        stats["gemini_context"] = context_cache.stats()
+    stats["sessions"] = session_store.stats()
+    stats["coalescing"] = voo_chat.stats()
+    stats["tts"] = audio_cache.stats()
+    stats["tts_loop"] = loop_tts.stats()
+    stats["database"] = database.pool.stats()
+    stats["chat_log"] = registro_conversas.stats()
+    return jsonify(stats)
+
+
+@app.route("/admin/stats", methods=["GET"])
+@require_auth
+def chat_stats():
+    """
+    Uso do chat nos últimos `days` dias (1 a 30, padrão 7): totais, cache e
+    percentis de latência por modo, perguntas por hora (últimas 24 h), `top`
+    perguntas mais frequentes e categorias da base mais procuradas.
+    Lê só os resumos (estatisticas.py), não o registro bruto.
+    """
+    try:
+        dias = int(request.args.get("days", 7))
+        top = int(request.args.get("top", 20))
+    except ValueError:
+        return jsonify({"error": "days e top devem ser números inteiros"}), 400
+    if not 1 <= dias <= estatisticas.MAX_DIAS or not 1 <= top <= estatisticas.TOP_K:
+        return jsonify({"error": f"days deve estar entre 1 e {estatisticas.MAX_DIAS}, "
+                                 f"top entre 1 e {estatisticas.TOP_K}"}), 400
+    inicio = time.perf_counter()
+    resumo = estatisticas.consultar(dias, top)
+    resumo["pendentes"] = registro_conversas.stats()["na_fila"]
+    resumo["ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+    return jsonify(resumo)
+
+
+@app.route("/admin/upstream", methods=["GET"])
+@require_auth
+def upstream_stats():
+    """Métricas do controle de admissão e estado do circuit breaker do Gemini."""
+    return jsonify({
+        "concorrencia": portao_upstream.stats(),
+        "limite_por_cliente": limitador_chat.stats(),
+        "circuit_breaker": gemini_client.breaker.state,
+    })
+
+
+@app.route("/admin/tts/warm", methods=["GET"])
+@require_auth
+def tts_warm_stats():
+    """Cobertura da pré-síntese: quantas frases da base já têm áudio em cache."""
+    return jsonify(aquecedor_tts.cobertura())
+
+
+@app.route("/admin/cache/flush", methods=["POST"])
+@require_admin
+def cache_flush():
+    removidos = answer_cache.clear()
+    return jsonify({"message": f"{removidos} resposta(s) removida(s) do cache", "removidos": removidos})
+
+
 # ──────────────────────────────────────────────
 # Rotas de Gerenciamento de Usuários (admin only)
 # ──────────────────────────────────────────────
@@ -325,12 +656,21 @@ def restore_knowledge(item_id):
 @app.route("/admin/users", methods=["GET"])
 @require_admin
 def list_users():
+    """Query: limit, cursor — mesma paginação de /admin/knowledge."""
+    try:
+        limite, apos = _parametros_pagina()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    users, proximo = database.listar_usuarios_pagina(limite, apos)
     conn = database.get_db()
-    rows = conn.execute(
-        "SELECT id, username, email, name, role, created_at, active FROM users ORDER BY created_at DESC"
-    ).fetchall()
+    ativos = conn.execute("SELECT COUNT(*) FROM users WHERE active=1").fetchone()[0]
     conn.close()
-    return jsonify({"users": [dict(r) for r in rows]})
+    # Usuários não têm contador de versão: a ETag fraca é o hash do corpo
+    resp = jsonify({"users": users, "next_cursor": _cursor_codificar(proximo) if proximo else None,
+                    "ativos": ativos})
+    resp.add_etag(weak=True)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp.make_conditional(request)
 
 
 @app.route("/admin/users", methods=["POST"])
@@ -417,10 +757,8 @@ def deactivate_user(user_id):
     if user_id == request.current_user["user_id"]:
         return jsonify({"error": "Você não pode desativar sua própria conta"}), 400
 
-    conn = database.get_db()
-    conn.execute("UPDATE users SET active=0 WHERE id=?", (user_id,))
-    conn.commit()
-    conn.close()
+    with database.transacao() as conn:
+        conn.execute("UPDATE users SET active=0 WHERE id=?", (user_id,))
     return jsonify({"message": "Usuário desativado"})
 
 
@@ -428,6 +766,94 @@ def deactivate_user(user_id):
 # Rota de Text-to-Speech
 # ──────────────────────────────────────────────
 
+TTS_VOICE = "pt-BR-AntonioNeural"
+# /text/tts/stream grava uma cópia do que envia no cache de áudio (TTS_STREAM_TEE=0 desliga)
+TTS_STREAM_TEE = os.environ.get("TTS_STREAM_TEE", "1") != "0"
+
+# Áudios já sintetizados, endereçados pelo hash de (voz, texto)
+audio_cache = tts_cache.CacheAudio(
+    os.environ.get("TTS_CACHE_DIR", os.path.join(os.path.dirname(__file__), "tts_cache")),
+    max_bytes=int(os.environ.get("TTS_CACHE_MAX_BYTES", 200 * 1024 * 1024)),
+)
+
+
+# Um único event loop, numa thread própria, atende todas as sínteses
+loop_tts = tts_loop.LoopTTS(
+    max_concorrentes=int(os.environ.get("TTS_MAX_CONCURRENT", 4)),
+    timeout=float(os.environ.get("TTS_TIMEOUT", 60)),
+)
+atexit.register(loop_tts.encerrar)
+
+
+def _sintetizar(text, voice, destino):
+    loop_tts.executar(edge_tts.Communicate(text, voice).save(destino))
+
+
+# Pré-síntese das frases da base de conhecimento e das saudações fixas,
+# só quando o TTS está ocioso (TTS_WARM=0 desliga)
+TTS_WARM_PHRASES = [
+    "Oi! Como posso te ajudar?",
+    "Olá! Eu sou o FMPConnect, o assistente virtual da Faculdade Municipal de Palhoça.",
+    "Modo acessibilidade ativado.",
+]
+aquecedor_tts = tts_warmer.AquecedorTTS(
+    audio_cache,
+    sintetizar=lambda texto, destino: _sintetizar(texto, TTS_VOICE, destino),
+    voz_tts=TTS_VOICE,
+    ocupado=lambda: loop_tts.ativas > 0 or loop_tts.aguardando > 0,
+    frases_fixas=TTS_WARM_PHRASES,
+    intervalo=float(os.environ.get("TTS_WARM_INTERVAL", 2.0)),
+)
+atexit.register(aquecedor_tts.encerrar)
+
+
+def _iterar_audio(text, voice):
+    """
+    Gerador síncrono dos trechos MP3 de Communicate.stream().
+    Fechá-lo antes do fim cancela a síntese (fecha o websocket do edge-tts).
+    """
+    for chunk in loop_tts.iterar(lambda: edge_tts.Communicate(text, voice).stream()):
+        if chunk["type"] == "audio":
+            yield chunk["data"]
+
+
+# Áudio já sintetizado é imutável: a URL é o hash de (voz, texto)
+TTS_AUDIO_MAX_AGE = int(os.environ.get("TTS_AUDIO_MAX_AGE", 365 * 24 * 3600))
+
+
+def _url_audio(chave):
+    return f"/text/tts/audio/{chave}{tts_cache.EXTENSAO}"
+
+
+def _enviar_audio(caminho, chave, origem):
+    resp = send_file(caminho, mimetype="audio/mpeg", etag=chave, conditional=True)
+    resp.headers["X-Cache"] = origem
+    resp.headers["X-Audio-Url"] = _url_audio(chave)
+    return resp
+
+
+@app.route("/text/tts/audio/<chave>.mp3", methods=["GET"])
+def text_tts_audio(chave):
+    """
+    Clipe do cache de áudio por hash, para replays e seeks do <audio>:
+    If-None-Match responde 304, Range responde 206 com o trecho pedido.
+    Nunca sintetiza — 404 se o clipe não estiver (ou não estiver mais) em cache.
+    """
+    if len(chave) != 64 or any(c not in "0123456789abcdef" for c in chave):
+        return jsonify({"error": "Áudio não encontrado"}), 404
+    caminho = audio_cache.obter(chave)
+    if caminho is None:
+        return jsonify({"error": "Áudio não encontrado"}), 404
+    try:
+        resp = send_file(caminho, mimetype="audio/mpeg", etag=chave, conditional=True,
+                         max_age=TTS_AUDIO_MAX_AGE)
+    except FileNotFoundError:
+        return jsonify({"error": "Áudio não encontrado"}), 404
+    resp.headers["Cache-Control"] = f"public, max-age={TTS_AUDIO_MAX_AGE}, immutable"
+    resp.headers["X-Cache"] = "HIT"
+    return resp
+
+
 @app.route("/text/tts", methods=["POST"])
 def text_tts():
     try:
@@ -437,24 +863,97 @@ def text_tts():
         if not text:
             return jsonify({"error": "Texto vazio"}), 400
 
-        VOICE = "pt-BR-AntonioNeural"
+        chave = tts_cache.chave_audio(text, TTS_VOICE)
+        caminho = audio_cache.obter(chave)
+        if caminho is not None:
+            try:
+                return _enviar_audio(caminho, chave, "HIT")
+            except FileNotFoundError:
+                pass   # descartado pela LRU entre a consulta e o envio
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as fp:
-            temp_filename = fp.name
+        caminho = audio_cache.gravar(chave, lambda destino: _sintetizar(text, TTS_VOICE, destino))
+        return _enviar_audio(caminho, chave, "MISS")
 
-        async def generate_audio():
-            communicate = edge_tts.Communicate(text, VOICE)
-            await communicate.save(temp_filename)
+    except Exception as e:
+        print(f"[ERRO] TTS: {e}")
+        return jsonify({"error": str(e)}), 500
 
-        # Cria um loop isolado para evitar conflito com o event loop do Flask/debug
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            loop.run_until_complete(generate_audio())
-        finally:
-            loop.close()
 
-        return send_file(temp_filename, mimetype="audio/mpeg")
+@app.route("/text/tts/stream", methods=["POST"])
+def text_tts_stream():
+    """
+    Mesma entrada de /text/tts, mas envia o MP3 em trechos (chunked) à medida
+    que o edge-tts sintetiza, sem arquivo temporário no caminho da resposta.
+    Se o cliente desconectar, a síntese é cancelada.
+    """
+    try:
+        data = request.get_json()
+        text = data.get("text", "")
+
+        if not text:
+            return jsonify({"error": "Texto vazio"}), 400
+
+        chave = tts_cache.chave_audio(text, TTS_VOICE)
+        caminho = audio_cache.obter(chave)
+        if caminho is not None:
+            try:
+                return _enviar_audio(caminho, chave, "HIT")
+            except FileNotFoundError:
+                pass
+
+        trechos = _iterar_audio(text, TTS_VOICE)
+        # Cópia opcional para o cache, publicada só se o stream terminar
+        copia = audio_cache.novo_temporario() if TTS_STREAM_TEE else None
+        arquivo = open(copia, "wb") if copia else None
+        encerrado = False
+
+        def encerrar(completo=False):
+            nonlocal encerrado
+            if encerrado:
+                return
+            encerrado = True
+            trechos.close()
+            if arquivo is not None:
+                arquivo.close()
+                if completo:
+                    audio_cache.publicar(chave, copia)
+                else:
+                    audio_cache.descartar(copia)
+
+        # O primeiro trecho sai antes dos cabeçalhos: falha na síntese ainda vira 500
+        try:
+            primeiro = next(trechos, b"")
+        except Exception:
+            encerrar()
+            raise
+        if not primeiro:
+            encerrar()
+            return jsonify({"error": "Síntese não retornou áudio"}), 502
+
+        def gerar():
+            completo = False
+            try:
+                proximo = primeiro
+                while proximo:
+                    if arquivo is not None:
+                        arquivo.write(proximo)
+                    yield proximo
+                    proximo = next(trechos, b"")
+                completo = True
+            finally:
+                encerrar(completo)
+
+        resposta = Response(gerar(), mimetype="audio/mpeg", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Cache": "MISS",
+        })
+        if TTS_STREAM_TEE:
+            # Válida assim que o stream terminar e a cópia for publicada
+            resposta.headers["X-Audio-Url"] = _url_audio(chave)
+        # Resposta descartada sem ser iterada também libera a síntese e a cópia
+        resposta.call_on_close(encerrar)
+        return resposta
 
     except Exception as e:
         print(f"[ERRO] TTS: {e}")
@@ -464,7 +963,7 @@ def text_tts():
 @app.route("/text/config", methods=["GET"])
 def get_text_config():
     # Retorna apenas o modelo — a chave NUNCA é enviada ao cliente
-    dynamic_instruction = database.build_dynamic_system_instruction(BASE_SYSTEM_INSTRUCTION)
+    dynamic_instruction = get_system_instruction("normal")
     return jsonify({"model": "gemini-2.5-flash", "systemInstruction": dynamic_instruction})
 
 
@@ -472,92 +971,550 @@ def get_text_config():
 # Rota de Chat Inteligente
 # ──────────────────────────────────────────────
 
+GEMINI_MODEL = "gemini-2.5-flash"
+GEMINI_BASE_URL = os.environ.get("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+
+# Cliente único com pool keep-alive, compartilhado por todas as threads do Flask
+gemini_client = gemini.GeminiClient(
+    GEMINI_BASE_URL,
+    API_KEY,
+    pool_size=int(os.environ.get("GEMINI_POOL_SIZE", 10)),
+    connect_timeout=float(os.environ.get("GEMINI_CONNECT_TIMEOUT", 5)),
+    read_timeout=float(os.environ.get("GEMINI_READ_TIMEOUT", 30)),
+    max_retries=int(os.environ.get("GEMINI_MAX_RETRIES", 2)),
+)
+
+# Cache de contexto explícito do Gemini para a instrução estática (desligue com GEMINI_CONTEXT_CACHE=0)
+context_cache = None
+if os.environ.get("GEMINI_CONTEXT_CACHE", "1") != "0":
+    context_cache = gemini.ContextCache(
+        gemini_client,
+        GEMINI_MODEL,
+        ttl=int(os.environ.get("GEMINI_CONTEXT_CACHE_TTL", 3600)),
+        retry_after_failure=float(os.environ.get("GEMINI_CONTEXT_CACHE_RETRY", 600)),
+    )
+
+# Limites do histórico enviado ao Gemini (ver history.py)
+HISTORY_MAX_TURNS = int(os.environ.get("HISTORY_MAX_TURNS", 8))
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", 8000))
+HISTORY_SUMMARY_TOKENS = int(os.environ.get("HISTORY_SUMMARY_TOKENS", 400))
+
+# Sessões de chat no servidor (SESSION_STORE=sqlite para compartilhar entre workers)
+session_store = sessions.criar_store(
+    os.environ.get("SESSION_STORE", "memory"),
+    idle_ttl=float(os.environ.get("SESSION_IDLE_TTL", 1800)),
+    max_bytes=int(os.environ.get("SESSION_MAX_BYTES", 50 * 1024 * 1024)),
+)
+
+# Cache de respostas para perguntas de primeira mensagem (sem histórico)
+answer_cache = cache.CacheLRU(
+    max_itens=int(os.environ.get("ANSWER_CACHE_SIZE", 1000)),
+    ttl=float(os.environ.get("ANSWER_CACHE_TTL", 3600)),
+)
+
+
+# Controle de admissão: limita chamadas simultâneas ao Gemini (com fila curta)
+# e a taxa de perguntas por cliente; o excedente recebe 503/429 com Retry-After
+portao_upstream = admission.PortaoConcorrencia(
+    max_concorrentes=int(os.environ.get("UPSTREAM_MAX_CONCURRENT", 8)),
+    max_fila=int(os.environ.get("UPSTREAM_MAX_QUEUE", 16)),
+    max_espera=float(os.environ.get("UPSTREAM_MAX_WAIT", 5)),
+)
+limitador_chat = admission.LimitadorPorCliente(
+    por_minuto=float(os.environ.get("RATE_LIMIT_PER_MIN", 20)),
+    rajada=int(os.environ.get("RATE_LIMIT_BURST", 10)),
+)
+# Chave do limite: "ip" (padrão; atrás de NAT, todos os alunos do laboratório
+# dividem o mesmo balde) ou "session" (cada sessão de chat tem o seu; pedidos
+# sem session_id continuam pelo IP)
+RATE_LIMIT_KEY = os.environ.get("RATE_LIMIT_KEY", "ip")
+
+# Pedidos idênticos simultâneos (mesma chave do cache) esperam pela mesma chamada ao Gemini
+voo_chat = cache.SingleFlight()
+COALESCE_WAIT_TIMEOUT = float(os.environ.get("COALESCE_WAIT_TIMEOUT", 60))
+
+
+def _categorias_da_pergunta(prompt):
+    """Categorias dos itens que o retrieval traria para a pergunta (estatísticas de uso)."""
+    retrieval.indice.sincronizar()
+    return {item["category"] for _, item in retrieval.indice.buscar(prompt, RETRIEVAL_TOP_K)}
+
+
+# Registro das conversas (CHAT_LOG=0 desliga): vai para o SQLite em lotes, fora da
+# requisição, e cada lote atualiza os resumos do /admin/stats
+CHAT_LOG = os.environ.get("CHAT_LOG", "1") != "0"
+registro_conversas = conversas.RegistroConversas(
+    max_fila=int(os.environ.get("CHAT_LOG_QUEUE", 10000)),
+    tamanho_lote=int(os.environ.get("CHAT_LOG_BATCH", 200)),
+    intervalo=float(os.environ.get("CHAT_LOG_FLUSH_S", 1.0)),
+    resumir=lambda lote: estatisticas.resumir(lote, _categorias_da_pergunta),
+)
+atexit.register(registro_conversas.encerrar)
+
+
+class RespostaVaziaError(Exception):
+    """O Gemini respondeu sem texto (resposta vazia ou bloqueada)."""
+
+    def __init__(self, raw, relatorio):
+        super().__init__("Resposta vazia ou bloqueada pelo modelo")
+        self.raw = raw
+        self.relatorio = relatorio
+
+
+ERROS_UPSTREAM = (gemini.GeminiHTTPError, gemini.CircuitOpenError, RespostaVaziaError,
+                  cache.EsperaExpirada, admission.Rejeitado)
+
+
+def _status_upstream(e):
+    """HTTP devolvido pelo Gemini numa falha, ou None quando ele nem chegou a ser chamado."""
+    if isinstance(e, gemini.GeminiHTTPError):
+        return e.code
+    if isinstance(e, RespostaVaziaError):
+        return 200
+    return None
+
+
+def _registrar_conversa(endpoint, mode, prompt, chegada, answer="", cache_status="MISS",
+                        status=200, upstream_status=None):
+    """Enfileira o registro da conversa (não espera pelo disco)."""
+    if CHAT_LOG:
+        # O modo vira chave dos resumos: só "normal"/"surdez", nunca o texto do cliente
+        registro_conversas.registrar(endpoint, _normalizar_modo(mode), prompt, len(answer),
+                                     (time.perf_counter() - chegada) * 1000,
+                                     cache_status, status, upstream_status)
+
+
+def _chave_cache(prompt, history, mode):
+    if history:
+        return None
+    return (cache.normalizar_pergunta(prompt), mode, database.get_knowledge_version())
+
+
+def _montar_corpo_gemini(prompt, history, mode, usar_cache=True):
+    """Monta o corpo da requisição ao Gemini. Retorna (body, relatório do histórico)."""
+    # A última pergunta do histórico ajuda a recuperar contexto em perguntas de seguimento
+    anteriores = [m["content"] for m in history if m.get("role") == "user"]
+    consulta = " ".join(anteriores[-1:] + [prompt])
+    is_start = len(history) == 0
+    estatica, secao = montar_instrucao(mode, is_start, consulta)
+    temperature_setting = 0.1 if mode == "surdez" else 0.4
+
+    messages, relatorio = history_mod.preparar_historico(
+        history, prompt,
+        system_tokens=retrieval.estimar_tokens(estatica) + retrieval.estimar_tokens(secao),
+        max_turns=HISTORY_MAX_TURNS,
+        token_budget=HISTORY_TOKEN_BUDGET,
+        summary_tokens=HISTORY_SUMMARY_TOKENS,
+    )
+
+    body = {
+        "contents": messages,
+        "generationConfig": {"temperature": temperature_setting, "maxOutputTokens": 800}
+    }
+
+    cache_name = None
+    if usar_cache and context_cache is not None:
+        cache_name = context_cache.get_name(estatica, display_name=f"fmpconnect-{mode}")
+    if cache_name:
+        # A instrução estática fica no cache do Gemini; a seção recuperada
+        # para esta pergunta vai junto da pergunta atual (última mensagem), não
+        # do resumo ou do turno mais antigo que abrem o histórico
+        body["cachedContent"] = cache_name
+        if secao:
+            messages[-1]["parts"].insert(0, {"text": secao.strip()})
+    else:
+        modo = _normalizar_modo(mode)
+        texto = BASE_SYSTEM_INSTRUCTION + secao + _REGRAS_MODO[(modo, is_start)]
+        body["systemInstruction"] = {"parts": [{"text": texto}]}
+    return body, relatorio
+
+
+def _chamar_gemini(prompt, history, mode, stream=False):
+    """
+    Envia a conversa ao Gemini. Retorna (resposta, relatório do histórico);
+    `resposta` é o JSON decodificado ou, com stream=True, a resposta SSE aberta.
+    """
+    if stream:
+        enviar = lambda corpo: gemini_client.post_stream(
+            f"models/{GEMINI_MODEL}:streamGenerateContent", corpo, alt="sse")
+    else:
+        enviar = lambda corpo: gemini_client.post_json(f"models/{GEMINI_MODEL}:generateContent", corpo)
+
+    body, relatorio = _montar_corpo_gemini(prompt, history, mode)
+    try:
+        return enviar(body), relatorio
+    except gemini.GeminiHTTPError as e:
+        if "cachedContent" not in body or e.code not in (400, 403, 404):
+            raise
+        # Entrada de cache expirada/removida no servidor: esquece e repete inline
+        print(f"[CHAT] Cache de contexto rejeitado (HTTP {e.code}), repetindo em modo inline")
+        context_cache.invalidar(body["cachedContent"])
+        body, relatorio = _montar_corpo_gemini(prompt, history, mode, usar_cache=False)
+        return enviar(body), relatorio
+
+
+def _extrair_texto(resp_json):
+    """Concatena o texto do primeiro candidato de uma resposta (ou chunk) do Gemini."""
+    try:
+        candidates = resp_json.get("candidates", [])
+        if candidates:
+            parts = candidates[0].get("content", {}).get("parts", [])
+            return "".join(p.get("text", "") for p in parts)
+    except Exception:
+        pass
+    return ""
+
+
+def _log_http_error(e):
+    safe_content = e.body.encode("ascii", errors="replace").decode("ascii")
+    print(f"[ERRO] HTTP {e.code}: {safe_content[:200]}")
+
+
+def _resposta_circuito_aberto(e):
+    print(f"[ERRO] Circuit breaker do Gemini aberto — falhando rápido ({e.retry_after:.0f}s)")
+    resp = jsonify({"answer": "Erro técnico na IA.", "error": str(e)})
+    resp.headers["Retry-After"] = str(int(e.retry_after))
+    return resp, 503
+
+
+def _resposta_erro_upstream(e):
+    """Converte um erro de ERROS_UPSTREAM na resposta HTTP correspondente."""
+    if isinstance(e, gemini.CircuitOpenError):
+        return _resposta_circuito_aberto(e)
+    if isinstance(e, admission.Rejeitado):
+        print(f"[ADMISSÃO] {e} — HTTP {e.status}, Retry-After {e.retry_after}s")
+        resp = jsonify({"answer": "Muitas perguntas ao mesmo tempo. Tente novamente em instantes.",
+                        "error": str(e)})
+        resp.headers["Retry-After"] = str(e.retry_after)
+        return resp, e.status
+    if isinstance(e, RespostaVaziaError):
+        return jsonify({"error": str(e), "raw": e.raw}), 502, {
+            "X-History": history_mod.formatar_relatorio(e.relatorio)}
+    if isinstance(e, cache.EsperaExpirada):
+        print(f"[ERRO] Pedido idêntico em andamento não terminou a tempo: {e}")
+        return jsonify({"answer": "Erro técnico na IA.", "error": str(e)}), 504
+    _log_http_error(e)
+    return jsonify({"answer": "Erro técnico na IA.", "error": str(e)}), 500
+
+
+def _cliente_atual(session_id=None):
+    """Chave do limite por cliente (RATE_LIMIT_KEY); sessões inexistentes já recebem 404 antes."""
+    if RATE_LIMIT_KEY == "session" and isinstance(session_id, str) and session_id:
+        return f"sessao:{session_id}"
+    return request.remote_addr or "desconhecido"
+
+
+def _admitir_upstream(cliente):
+    """
+    Vaga no portão para uma chamada ao Gemini. Só quem chama o upstream gasta
+    ficha do limite por cliente: respostas do cache e pedidos coalescidos não pagam.
+    """
+    limitador_chat.consumir(cliente)
+    return portao_upstream.adquirir()
+
+
+def _historico_da_sessao(session_id, history):
+    """
+    Resolve o histórico de uma requisição com `session_id`.
+    Retorna (histórico, mensagens a gravar antes do novo turno) ou None se
+    a sessão não existe/expirou. Uma sessão vazia aceita o histórico do
+    cliente como semente (ex.: sessão recriada após expirar).
+    """
+    armazenado = session_store.obter(session_id)
+    if armazenado is None:
+        return None
+    if armazenado:
+        return armazenado, []
+    return history, list(history)
+
+
+def _registrar_turno(session_id, semente, prompt, answer):
+    if session_id:
+        session_store.anexar(session_id, semente + [
+            {"role": "user", "content": prompt},
+            {"role": "model", "content": answer},
+        ])
+
+
+@app.route("/text/session", methods=["POST"])
+def text_session_create():
+    """Cria uma sessão de chat; depois basta enviar `session_id` em /text/chat."""
+    return jsonify({"session_id": session_store.criar(), "idle_ttl": session_store.idle_ttl}), 201
+
+
+@app.route("/text/session/<session_id>", methods=["DELETE"])
+def text_session_delete(session_id):
+    session_store.remover(session_id)
+    return jsonify({"message": "Sessão encerrada"})
+
+
 @app.route("/text/chat", methods=["POST"])
 def text_chat():
+    chegada = time.perf_counter()
     try:
         data = request.get_json(force=True)
         prompt = data.get("prompt")
         history = data.get("history", [])
-        mode = data.get("mode", "normal")
+        mode = _normalizar_modo(data.get("mode"))
+        session_id = data.get("session_id")
+        cliente = _cliente_atual(session_id)
 
         if not prompt:
             return jsonify({"error": "Campo 'prompt' é obrigatório"}), 400
 
-        model = "gemini-2.5-flash"
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={API_KEY}"
+        semente = []
+        if session_id:
+            resolvido = _historico_da_sessao(session_id, history)
+            if resolvido is None:
+                return jsonify({"error": "Sessão expirada ou inexistente"}), 404
+            history, semente = resolvido
+
+        chave = _chave_cache(prompt, history, mode)
+        if chave is not None:
+            answer = answer_cache.get(chave)
+            if answer is not None:
+                _registrar_turno(session_id, semente, prompt, answer)
+                _registrar_conversa("chat", mode, prompt, chegada, answer, "HIT")
+                resp = jsonify({"answer": answer})
+                resp.headers["X-Cache"] = "HIT"
+                return resp
+
+        print(f"[CHAT] {GEMINI_MODEL} | Modo: {mode} | Histórico: {len(history)} msgs")
+
+        def gerar_resposta():
+            with _admitir_upstream(cliente):
+                resp_json, relatorio = _chamar_gemini(prompt, history, mode)
+            answer = _extrair_texto(resp_json)
+            if not answer:
+                raise RespostaVaziaError(resp_json, relatorio)
+            if chave is not None:
+                answer_cache.put(chave, answer)
+            return answer, relatorio
 
-        messages = []
-        for msg in history:
-            role = "user" if msg["role"] == "user" else "model"
-            messages.append({"role": role, "parts": [{"text": msg["content"]}]})
+        try:
+            if chave is not None:
+                (answer, relatorio), compartilhada = voo_chat.executar(
+                    chave, gerar_resposta, COALESCE_WAIT_TIMEOUT, so_do_lider=admission.LimiteDoCliente)
+            else:
+                (answer, relatorio), compartilhada = gerar_resposta(), False
+        except ERROS_UPSTREAM as e:
+            resposta = app.make_response(_resposta_erro_upstream(e))
+            _registrar_conversa("chat", mode, prompt, chegada,
+                                cache_status="MISS" if chave is not None else "BYPASS",
+                                status=resposta.status_code, upstream_status=_status_upstream(e))
+            return resposta
+
+        _registrar_turno(session_id, semente, prompt, answer)
+        cabecalhos = {"X-History": history_mod.formatar_relatorio(relatorio)}
+        if compartilhada:
+            cabecalhos["X-Cache"] = "COALESCED"
+            _registrar_conversa("chat", mode, prompt, chegada, answer, "COALESCED")
+        else:
+            _registrar_conversa("chat", mode, prompt, chegada, answer, "MISS" if chave is not None else "BYPASS",
+                                upstream_status=200)
+        return jsonify({"answer": answer}), 200, cabecalhos
 
-        messages.append({"role": "user", "parts": [{"text": prompt}]})
+    except Exception as e:
+        safe_e = str(e).encode("ascii", errors="replace").decode("ascii")
+        print(f"[ERRO] Critico no chat: {safe_e}")
+        return jsonify({"error": str(e)}), 500
 
-        current_system_instruction = database.build_dynamic_system_instruction(BASE_SYSTEM_INSTRUCTION)
-        temperature_setting = 0.4
 
-        if mode == "surdez":
-            temperature_setting = 0.1
-            is_start = len(history) == 0
-            accessibility_rules = """
-            [MODO ACESSIBILIDADE/SURDEZ ATIVO]
-            PERFIL: O usuário necessita de objetividade máxima, clareza visual e português simplificado.
+def _sse(payload, event=None):
+    data = json.dumps(payload, ensure_ascii=False)
+    return (f"event: {event}\n" if event else "") + f"data: {data}\n\n"
 
-            REGRAS DE FORMATAÇÃO E ESTILO:
-            1. Use frases curtas (Sujeito + Verbo + Predicado).
-            2. Prefira listas (bullet points) ao invés de parágrafos longos.
-            3. Evite conectivos complexos (portanto, contudo, todavia).
-            4. Seja direto: Dê a informação imediatamente.
-            """
-            if is_start:
-                accessibility_rules += """
-                REGRA DE INÍCIO:
-                - Você PODE dizer "Olá. Modo acessibilidade ativado." uma única vez.
-                - Em seguida, responda a pergunta se houver, ou aguarde o comando.
-                """
-            else:
-                accessibility_rules += """
-                REGRA CRÍTICA - ZERO REPETIÇÃO:
-                - É ESTRITAMENTE PROIBIDO usar saudações como: "Olá", "Oi", "Tudo bem", "Sou o FMPConnect".
-                - Comece a resposta DIRETAMENTE com o dado solicitado.
-                Exemplo Correto: "O curso de ADS dura 2,5 anos."
-                """
-            current_system_instruction += accessibility_rules
 
-        body = {
-            "contents": messages,
-            "systemInstruction": {"parts": [{"text": current_system_instruction}]},
-            "generationConfig": {"temperature": temperature_setting, "maxOutputTokens": 800}
-        }
+def _ler_linhas(resp):
+    # read1 devolve o que já chegou, sem esperar encher o buffer
+    pendente = b""
+    while True:
+        bloco = resp.read1(65536)
+        if not bloco:
+            break
+        *linhas, pendente = (pendente + bloco).split(b"\n")
+        yield from linhas
+    if pendente:
+        yield pendente
 
-        print(f"[CHAT] {model} | Modo: {mode} | Histórico: {len(history)} msgs")
 
-        jsondata = json.dumps(body).encode("utf-8")
-        req = urllib.request.Request(url, data=jsondata, method="POST")
-        req.add_header("Content-Type", "application/json; charset=utf-8")
+def _ler_eventos_sse(resp):
+    """Itera os objetos JSON de um stream SSE do Gemini (`alt=sse`)."""
+    buffer = []
+    for raw in _ler_linhas(resp):
+        line = raw.decode("utf-8").rstrip("\r")
+        if line.startswith("data:"):
+            buffer.append(line[5:].strip())
+        elif not line and buffer:
+            yield json.loads("".join(buffer))
+            buffer = []
+    if buffer:
+        yield json.loads("".join(buffer))
 
-        try:
-            with urllib.request.urlopen(req, timeout=30) as resp:
-                resp_json = json.loads(resp.read().decode("utf-8"))
-                answer = None
+
+def _abrir_stream_gemini(prompt, history, mode):
+    """
+    Abre o stream do Gemini e lê até o primeiro trecho com texto, para que
+    respostas vazias/bloqueadas virem RespostaVaziaError (502) antes de
+    começar a responder ao cliente.
+    Retorna (resposta aberta, relatório do histórico, primeiro trecho, eventos restantes).
+    """
+    resp, relatorio = _chamar_gemini(prompt, history, mode, stream=True)
+    eventos = _ler_eventos_sse(resp)
+    primeiro = ""
+    ultimo_chunk = {}
+    try:
+        for chunk in eventos:
+            ultimo_chunk = chunk
+            primeiro = _extrair_texto(chunk)
+            if primeiro:
+                break
+    except Exception:
+        resp.close()
+        raise
+    if not primeiro:
+        resp.release_conn()
+        raise RespostaVaziaError(ultimo_chunk, relatorio)
+    return resp, relatorio, primeiro, eventos
+
+
+@app.route("/text/chat/stream", methods=["POST"])
+def text_chat_stream():
+    """
+    Mesma entrada de /text/chat, mas repassa os tokens ao navegador via
+    Server-Sent Events. Eventos: `data: {"text": ...}` a cada trecho e
+    `event: done` com ttfb_ms/total_ms ao final.
+    """
+    chegada = time.perf_counter()
+    try:
+        data = request.get_json(force=True)
+        prompt = data.get("prompt")
+        history = data.get("history", [])
+        mode = _normalizar_modo(data.get("mode"))
+        session_id = data.get("session_id")
+        cliente = _cliente_atual(session_id)
+
+        if not prompt:
+            return jsonify({"error": "Campo 'prompt' é obrigatório"}), 400
+
+        semente = []
+        if session_id:
+            resolvido = _historico_da_sessao(session_id, history)
+            if resolvido is None:
+                return jsonify({"error": "Sessão expirada ou inexistente"}), 404
+            history, semente = resolvido
+
+        chave = _chave_cache(prompt, history, mode)
+        if chave is not None:
+            answer = answer_cache.get(chave)
+            if answer is not None:
+                _registrar_turno(session_id, semente, prompt, answer)
+                _registrar_conversa("stream", mode, prompt, chegada, answer, "HIT")
+                corpo = _sse({"text": answer}) + _sse({"ttfb_ms": 0, "total_ms": 0}, event="done")
+                return Response(corpo, mimetype="text/event-stream",
+                                headers={"Cache-Control": "no-cache", "X-Cache": "HIT"})
+
+        # Se um pedido idêntico já está em andamento, espera a resposta
+        # completa dele e a entrega num único evento
+        chamada = None
+        if chave is not None:
+            eh_lider, chamada = voo_chat.entrar(chave)
+            if not eh_lider:
                 try:
-                    candidates = resp_json.get("candidates", [])
-                    if candidates:
-                        parts = candidates[0].get("content", {}).get("parts", [])
-                        if parts:
-                            answer = parts[0]["text"]
-                except Exception:
-                    pass
-
-                if answer:
-                    return jsonify({"answer": answer})
-                return jsonify({"error": "Resposta vazia ou bloqueada pelo modelo", "raw": resp_json}), 502
-
-        except urllib.error.HTTPError as e:
-            error_content = e.read().decode("utf-8", errors="replace")
-            safe_content = error_content.encode("ascii", errors="replace").decode("ascii")
-            print(f"[ERRO] HTTP {e.code}: {safe_content[:200]}")
-            return jsonify({"answer": "Erro técnico na IA.", "error": str(e)}), 500
+                    answer, relatorio = voo_chat.aguardar(chamada, COALESCE_WAIT_TIMEOUT)
+                except cache.ChamadaAbandonada:
+                    chamada = None
+                except ERROS_UPSTREAM as e:
+                    resposta = app.make_response(_resposta_erro_upstream(e))
+                    _registrar_conversa("stream", mode, prompt, chegada, cache_status="COALESCED",
+                                        status=resposta.status_code, upstream_status=_status_upstream(e))
+                    return resposta
+                else:
+                    _registrar_turno(session_id, semente, prompt, answer)
+                    _registrar_conversa("stream", mode, prompt, chegada, answer, "COALESCED")
+                    corpo = _sse({"text": answer}) + _sse({"ttfb_ms": 0, "total_ms": 0}, event="done")
+                    return Response(corpo, mimetype="text/event-stream", headers={
+                        "Cache-Control": "no-cache",
+                        "X-Cache": "COALESCED",
+                        "X-History": history_mod.formatar_relatorio(relatorio),
+                    })
+
+        def encerrar_voo(resultado=None, erro=None):
+            if chamada is not None:
+                voo_chat.concluir(chave, chamada, resultado=resultado, erro=erro)
+
+        print(f"[CHAT-STREAM] {GEMINI_MODEL} | Modo: {mode} | Histórico: {len(history)} msgs")
+
+        inicio = time.perf_counter()
+        vaga = None
+        try:
+            # A vaga no portão fica ocupada enquanto o stream do upstream estiver aberto
+            vaga = _admitir_upstream(cliente)
+            resp, relatorio, primeiro, eventos = _abrir_stream_gemini(prompt, history, mode)
+        except Exception as e:
+            if vaga is not None:
+                vaga.liberar()
+            # Limite do próprio cliente não vale para quem espera: eles tentam por conta própria
+            compartilhavel = isinstance(e, ERROS_UPSTREAM) and not isinstance(e, admission.LimiteDoCliente)
+            encerrar_voo(erro=e if compartilhavel else cache.ChamadaAbandonada())
+            if isinstance(e, ERROS_UPSTREAM):
+                resposta = app.make_response(_resposta_erro_upstream(e))
+                _registrar_conversa("stream", mode, prompt, chegada,
+                                    cache_status="MISS" if chave is not None else "BYPASS",
+                                    status=resposta.status_code, upstream_status=_status_upstream(e))
+                return resposta
+            raise
+
+        ttfb_ms = (time.perf_counter() - inicio) * 1000
+
+        def gerar():
+            completo = False
+            erro = False
+            partes = [primeiro]
+            try:
+                yield _sse({"text": primeiro})
+                for chunk in eventos:
+                    texto = _extrair_texto(chunk)
+                    if texto:
+                        partes.append(texto)
+                        yield _sse({"text": texto})
+                completo = True
+                answer = "".join(partes)
+                if chave is not None:
+                    answer_cache.put(chave, answer)
+                encerrar_voo(resultado=(answer, relatorio))
+                _registrar_turno(session_id, semente, prompt, answer)
+                total_ms = (time.perf_counter() - inicio) * 1000
+                print(f"[CHAT-STREAM] TTFB: {ttfb_ms:.0f} ms | Total: {total_ms:.0f} ms")
+                yield _sse({"ttfb_ms": round(ttfb_ms), "total_ms": round(total_ms)}, event="done")
+            except Exception as e:
+                safe_e = str(e).encode("ascii", errors="replace").decode("ascii")
+                print(f"[ERRO] Stream do chat interrompido: {safe_e}")
+                erro = True
+                yield _sse({"error": str(e)}, event="error")
+            finally:
+                # Stream lido até o fim devolve a conexão ao pool; interrompido, fecha
+                if completo:
+                    resp.release_conn()
+                else:
+                    resp.close()
+                vaga.liberar()
+                # 499: o cliente desconectou antes do fim (convenção do nginx)
+                _registrar_conversa("stream", mode, prompt, chegada, "".join(partes),
+                                    "MISS" if chave is not None else "BYPASS",
+                                    200 if completo else 502 if erro else 499, upstream_status=200)
+
+        resposta = Response(gerar(), mimetype="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "Server-Timing": f"upstream-ttfb;dur={ttfb_ms:.0f}",
+            "X-Cache": "MISS" if chave is not None else "BYPASS",
+            "X-History": history_mod.formatar_relatorio(relatorio),
+        })
+        # Cliente desconectou antes do fim: quem espera faz a própria chamada
+        resposta.call_on_close(lambda: encerrar_voo(erro=cache.ChamadaAbandonada()))
+        resposta.call_on_close(vaga.liberar)
+        return resposta
 
     except Exception as e:
         safe_e = str(e).encode("ascii", errors="replace").decode("ascii")
@@ -565,6 +1522,197 @@ def text_chat():
         return jsonify({"error": str(e)}), 500
 
 
+async def _sintetizar_bytes(text, voice):
+    partes = []
+    async for chunk in edge_tts.Communicate(text, voice).stream():
+        if chunk["type"] == "audio":
+            partes.append(chunk["data"])
+    return b"".join(partes)
+
+
+def _gravar_arquivo(destino, dados):
+    """Escreve e fecha o arquivo antes de o cache de áudio publicá-lo."""
+    with open(destino, "wb") as f:
+        f.write(dados)
+
+
+def _agendar_fala(fala):
+    """Future com o MP3 da frase: do cache de áudio, ou agendado no loop de TTS."""
+    chave = tts_cache.chave_audio(fala, TTS_VOICE)
+    caminho = audio_cache.obter(chave)
+    if caminho is not None:
+        try:
+            with open(caminho, "rb") as f:
+                pronto = concurrent.futures.Future()
+                pronto.set_result(f.read())
+                return chave, pronto, False
+        except FileNotFoundError:
+            pass
+    return chave, loop_tts.agendar(_sintetizar_bytes(fala, TTS_VOICE)), True
+
+
+@app.route("/voice/turn", methods=["POST"])
+def voice_turn():
+    """
+    Turno completo do modo voz numa só requisição: mesma entrada de
+    /text/chat; a resposta do Gemini chega em stream, é dividida em frases
+    e cada frase é sintetizada em paralelo assim que fica completa.
+    Eventos SSE, nesta ordem relativa:
+      data: {"text": ...}                           trechos do texto
+      event: audio  {"seq", "text", "audio"}         MP3 (base64) de cada frase, em ordem
+      event: done   {ttfb_ms, first_audio_ms, total_ms}
+    """
+    chegada = time.perf_counter()
+    try:
+        data = request.get_json(force=True)
+        prompt = data.get("prompt")
+        history = data.get("history", [])
+        mode = _normalizar_modo(data.get("mode"))
+        session_id = data.get("session_id")
+        cliente = _cliente_atual(session_id)
+
+        if not prompt:
+            return jsonify({"error": "Campo 'prompt' é obrigatório"}), 400
+
+        semente = []
+        if session_id:
+            resolvido = _historico_da_sessao(session_id, history)
+            if resolvido is None:
+                return jsonify({"error": "Sessão expirada ou inexistente"}), 404
+            history, semente = resolvido
+
+        inicio = time.perf_counter()
+        chave = _chave_cache(prompt, history, mode)
+        answer = answer_cache.get(chave) if chave is not None else None
+        cabecalhos = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        upstream = None
+
+        if answer is not None:
+            trechos = iter([answer])
+            cabecalhos["X-Cache"] = "HIT"
+        else:
+            print(f"[VOZ] {GEMINI_MODEL} | Modo: {mode} | Histórico: {len(history)} msgs")
+            vaga = None
+            try:
+                vaga = _admitir_upstream(cliente)
+                resp, relatorio, primeiro, eventos = _abrir_stream_gemini(prompt, history, mode)
+            except ERROS_UPSTREAM as e:
+                if vaga is not None:
+                    vaga.liberar()
+                resposta = app.make_response(_resposta_erro_upstream(e))
+                _registrar_conversa("voice", mode, prompt, chegada,
+                                    cache_status="MISS" if chave is not None else "BYPASS",
+                                    status=resposta.status_code, upstream_status=_status_upstream(e))
+                return resposta
+            except Exception:
+                if vaga is not None:
+                    vaga.liberar()
+                raise
+            upstream = {"resp": resp, "vaga": vaga, "aberto": True}
+
+            def fechar_upstream(completo=False):
+                if not upstream["aberto"]:
+                    return
+                upstream["aberto"] = False
+                if completo:
+                    upstream["resp"].release_conn()
+                else:
+                    upstream["resp"].close()
+                upstream["vaga"].liberar()
+
+            def trechos_do_gemini():
+                yield primeiro
+                for chunk in eventos:
+                    texto = _extrair_texto(chunk)
+                    if texto:
+                        yield texto
+                fechar_upstream(completo=True)
+
+            trechos = trechos_do_gemini()
+            cabecalhos["X-Cache"] = "MISS" if chave is not None else "BYPASS"
+            cabecalhos["X-History"] = history_mod.formatar_relatorio(relatorio)
+
+        def gerar():
+            divisor = voz.DivisorFrases()
+            pendentes = deque()   # (seq, frase, chave, future, sintetizado_agora)
+            seq = 0
+            marcas = {}
+            partes = []
+            completo = False
+            erro = False
+
+            def agendar(frases):
+                nonlocal seq
+                for frase in frases:
+                    fala = voz.limpar_para_fala(frase)
+                    if fala:
+                        pendentes.append((seq, frase) + _agendar_fala(fala))
+                        seq += 1
+
+            def entregar(esperar):
+                # Só entrega em ordem: a frase n+1 espera a n, mesmo se ficou pronta antes
+                while pendentes and (esperar or pendentes[0][3].done()):
+                    n, frase, chave_audio, futuro, novo = pendentes.popleft()
+                    try:
+                        audio = futuro.result(loop_tts.timeout)
+                    except Exception as e:
+                        # Uma frase sem áudio não derruba o turno: o texto segue
+                        print(f"[ERRO] TTS da frase {n}: {e}")
+                        yield _sse({"seq": n, "text": frase, "error": str(e)}, event="audio")
+                        continue
+                    if novo:
+                        audio_cache.gravar(chave_audio, lambda destino: _gravar_arquivo(destino, audio))
+                    marcas.setdefault("first_audio", time.perf_counter())
+                    yield _sse({"seq": n, "text": frase,
+                                "audio": base64.b64encode(audio).decode("ascii")}, event="audio")
+
+            try:
+                for texto in trechos:
+                    marcas.setdefault("ttfb", time.perf_counter())
+                    partes.append(texto)
+                    yield _sse({"text": texto})
+                    agendar(divisor.alimentar(texto))
+                    yield from entregar(esperar=False)
+                agendar(divisor.finalizar())
+
+                resposta = "".join(partes)
+                if answer is None and chave is not None:
+                    answer_cache.put(chave, resposta)
+                _registrar_turno(session_id, semente, prompt, resposta)
+
+                yield from entregar(esperar=True)
+                ms = lambda t: round((t - inicio) * 1000)
+                print(f"[VOZ] Texto: {ms(marcas['ttfb'])} ms | 1º áudio: "
+                      f"{ms(marcas.get('first_audio', inicio))} ms | Total: {ms(time.perf_counter())} ms")
+                yield _sse({"ttfb_ms": ms(marcas["ttfb"]),
+                            "first_audio_ms": ms(marcas.get("first_audio", inicio)),
+                            "total_ms": ms(time.perf_counter())}, event="done")
+                completo = True
+            except Exception as e:
+                safe_e = str(e).encode("ascii", errors="replace").decode("ascii")
+                print(f"[ERRO] Turno de voz interrompido: {safe_e}")
+                erro = True
+                yield _sse({"error": str(e)}, event="error")
+            finally:
+                # Cliente desconectou (ou erro): cancela as sínteses que ainda não saíram
+                for _, _, _, futuro, _ in pendentes:
+                    futuro.cancel()
+                # 499: o cliente desconectou antes do fim (como no /text/chat/stream)
+                _registrar_conversa("voice", mode, prompt, chegada, "".join(partes), cabecalhos["X-Cache"],
+                                    200 if completo else 502 if erro else 499,
+                                    upstream_status=200 if upstream is not None else None)
+
+        resposta_http = Response(gerar(), mimetype="text/event-stream", headers=cabecalhos)
+        if upstream is not None:
+            resposta_http.call_on_close(fechar_upstream)
+        return resposta_http
+
+    except Exception as e:
+        safe_e = str(e).encode("ascii", errors="replace").decode("ascii")
+        print(f"[ERRO] Critico no turno de voz: {safe_e}")
+        return jsonify({"error": str(e)}), 500
+
+
 # ──────────────────────────────────────────────
 # Rotas RPA
 # ──────────────────────────────────────────────
@@ -572,15 +1720,23 @@ def text_chat():
 @app.route("/admin/rpa/scrape", methods=["POST"])
 @require_auth
 def rpa_scrape():
-    """Raspa o site da FMP e importa itens novos para a base de conhecimento."""
+    """
+    Raspa o site da FMP e importa itens novos para a base de conhecimento.
+    Páginas que falharem ou passarem de RPA_DEADLINE ficam de fora (`paginas.falhas`).
+    """
     try:
-        itens = rpa.scrape_site_fmp()
+        itens, relatorio = rpa.raspar_site_fmp()
         user_id = request.current_user.get("user_id", 1)
         resultado = rpa.importar_para_base(itens, user_id=user_id)
+        aquecedor_tts.avisar()
+        mensagem = f"{resultado['inseridos']} item(ns) importado(s), {resultado['ignorados']} ignorado(s)."
+        if relatorio["falhas"]:
+            mensagem += f" {len(relatorio['falhas'])} de {relatorio['paginas']} página(s) não responderam."
         return jsonify({
-            "message": f"{resultado['inseridos']} item(ns) importado(s), {resultado['ignorados']} ignorado(s).",
+            "message": mensagem,
             **resultado,
-            "total_encontrados": len(itens)
+            "total_encontrados": len(itens),
+            "paginas": relatorio,
         })
     except Exception as e:
         print(f"[ERRO] RPA scrape: {e}")
@@ -609,6 +1765,7 @@ def rpa_emails():
         itens = rpa.emails_para_itens_conhecimento(emails)
         user_id = request.current_user.get("user_id", 1)
         resultado = rpa.importar_para_base(itens, user_id=user_id)
+        aquecedor_tts.avisar()
 
         return jsonify({
             "message": f"{len(emails)} e-mail(s) lido(s). {resultado['inseridos']} item(ns) importado(s).",
@@ -641,6 +1798,11 @@ def serve_public(filename):
 
 if __name__ == "__main__":
     database.init_db()
+    retrieval.indice.sincronizar()
+    # Com debug=True o reloader roda este bloco também no processo pai,
+    # que só observa arquivos — o aquecedor sobe apenas no processo do servidor
+    if os.environ.get("TTS_WARM", "1") != "0" and is_running_from_reloader():
+        aquecedor_tts.iniciar()
 
     print("\n" + "=" * 50)
     print("FMPConnect Backend - Com Sistema de Admin")
@@ -0,0 +1,582 @@
+"""FMPConnect — Benchmarks de desempenho (rodam localmente, sem servidor nem rede)
+
+Uso:
+    python benchmarks.py            # todos
+    python benchmarks.py prompt     # apenas uma seção
+"""
+import os, random, sys, tempfile, time
+
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+import database
+
+PALAVRAS = ("matrícula prazo secretaria edital vestibular biblioteca empréstimo livro "
+            "estágio coordenação curso semestre calendário prova auxílio bolsa transporte "
+            "portal notas faltas declaração histórico pedagogia administração sistemas "
+            "laboratório extensão pesquisa evento palestra inscrição documento requerimento").split()
+CATEGORIAS = ["Matrícula", "Financeiro", "Estágio", "TCC", "Serviços", "Vestibular",
+              "Calendário Acadêmico", "Avisos", "Feedbacks", "Eventos"]
+PERGUNTAS = ["Como faço a matrícula?", "Qual o horário da biblioteca?",
+             "Quando abre o edital do vestibular?", "Como pedir declaração de matrícula?"]
+
+
+def sec(t):
+    print(f"\n{'='*60}\n  {t}\n{'='*60}")
+
+
+def usar_banco_temporario(n_itens, seed=42):
+    """Aponta database.DB_PATH para um banco novo com `n_itens` itens sintéticos."""
+    rnd = random.Random(seed)
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    database.DB_PATH = path
+    database.init_db()
+    conn = database.get_db()
+    conn.execute("DELETE FROM knowledge_items")
+    conn.executemany(
+        "INSERT INTO knowledge_items (category, title, content, created_by) VALUES (?, ?, ?, 1)",
+        ((rnd.choice(CATEGORIAS),
+          " ".join(rnd.choices(PALAVRAS, k=5)) + f" #{i}",
+          " ".join(rnd.choices(PALAVRAS, k=60)))
+         for i in range(n_itens)),
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def cronometrar(fn, repeticoes=1):
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        resultado = fn()
+    return (time.perf_counter() - inicio) * 1000 / repeticoes, resultado
+
+
+# ────────────────────────────────────────────────────
+def bench_prompt():
+    sec("MONTAGEM DO PROMPT — base inteira vs. retrieval (BM25 top-k)")
+    import app, retrieval
+
+    print(f"  {'itens':>7} | {'base inteira':>22} | {'índice':>9} | {'retrieval':>20}")
+    for n in (100, 10_000, 100_000):
+        path = usar_banco_temporario(n)
+        ms_full, full = cronometrar(
+            lambda: database.build_dynamic_system_instruction(app.BASE_SYSTEM_INSTRUCTION))
+        ms_idx, _ = cronometrar(retrieval.indice.sincronizar)
+        tempos, tamanhos = [], []
+        for p in PERGUNTAS:
+            ms, texto = cronometrar(lambda: "".join(app.montar_instrucao("normal", True, p)), 5)
+            tempos.append(ms)
+            tamanhos.append(len(texto.encode("utf-8")))
+        print(f"  {n:>7} | {len(full.encode('utf-8'))/1024:>9.0f} KB {ms_full:>7.1f} ms"
+              f" | {ms_idx:>6.0f} ms"
+              f" | {sum(tamanhos)/len(tamanhos)/1024:>6.1f} KB {sum(tempos)/len(tempos):>7.2f} ms")
+        os.remove(path)
+
+
+# ────────────────────────────────────────────────────
+def _servidor_tts_falso(frames=20, tamanho=4096, intervalo=0.005):
+    """
+    Substituto local do websocket do edge-tts: recebe o pedido e devolve
+    `frames` mensagens binárias. Roda num loop próprio; retorna (url, parar).
+    """
+    import asyncio, threading
+    from aiohttp import web
+
+    async def ws_handler(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.receive()
+        for _ in range(frames):
+            await ws.send_bytes(b"\xff" * tamanho)
+            await asyncio.sleep(intervalo)
+        await ws.close()
+        return ws
+
+    loop = asyncio.new_event_loop()
+    pronto = threading.Event()
+    estado = {}
+
+    async def iniciar():
+        app_ws = web.Application()
+        app_ws.router.add_get("/ws", ws_handler)
+        runner = web.AppRunner(app_ws, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        estado["runner"] = runner
+        estado["porta"] = site._server.sockets[0].getsockname()[1]
+
+    def rodar():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(iniciar())
+        pronto.set()
+        loop.run_forever()
+
+    threading.Thread(target=rodar, daemon=True).start()
+    pronto.wait()
+
+    def parar():
+        asyncio.run_coroutine_threadsafe(estado["runner"].cleanup(), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+
+    return f"http://127.0.0.1:{estado['porta']}/ws", parar
+
+
+async def _sintese_falsa(url):
+    """Mesmo padrão do edge-tts: uma ClientSession + websocket por síntese."""
+    import aiohttp
+    recebidos = 0
+    async with aiohttp.ClientSession() as sessao, sessao.ws_connect(url) as ws:
+        await ws.send_str("<speak>teste</speak>")
+        async for msg in ws:
+            if msg.type == aiohttp.WSMsgType.BINARY:
+                recebidos += len(msg.data)
+    return recebidos
+
+
+def bench_tts_loop():
+    sec("TTS — loop asyncio por requisição vs. loop persistente (websocket local)")
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    import tts_loop
+
+    pedidos, threads = 300, 16
+    persistente = tts_loop.LoopTTS(max_concorrentes=threads)
+
+    def medir(fn):
+        latencias = []
+
+        def um(_):
+            inicio = time.perf_counter()
+            fn()
+            latencias.append((time.perf_counter() - inicio) * 1000)
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(um, range(pedidos)))
+        total = time.perf_counter() - inicio
+        latencias.sort()
+        return pedidos / total, latencias[len(latencias) // 2], latencias[int(len(latencias) * 0.95)]
+
+    print(f"  {pedidos} sínteses, {threads} threads do Flask simuladas")
+    for cenario, intervalo in (("upstream com 5 ms entre trechos", 0.005),
+                               ("upstream instantâneo (só overhead)", 0)):
+        url, parar = _servidor_tts_falso(intervalo=intervalo)
+
+        def por_requisicao():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                return loop.run_until_complete(_sintese_falsa(url))
+            finally:
+                loop.close()
+
+        print(f"\n  {cenario}")
+        print(f"  {'modo':<22} | {'req/s':>7} | {'p50':>8} | {'p95':>8}")
+        for nome, fn in (("loop por requisição", por_requisicao),
+                         ("loop persistente", lambda: persistente.executar(_sintese_falsa(url)))):
+            fn()   # aquecimento
+            rps, p50, p95 = medir(fn)
+            print(f"  {nome:<22} | {rps:>7.0f} | {p50:>5.1f} ms | {p95:>5.1f} ms")
+        parar()
+
+    persistente.encerrar()
+
+
+# ────────────────────────────────────────────────────
+def bench_sqlite():
+    sec("SQLITE — conexão nova + rollback journal vs. pool + WAL (importação do RPA durante o chat)")
+    import contextlib, io, sqlite3, threading
+    import rpa
+
+    def conexao_nova():
+        # get_db() de antes do pool: conexão nova a cada chamada, journal padrão
+        conn = sqlite3.connect(database.DB_PATH)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    pool_get_db = database.get_db
+    duracao, leitores, lote = 3.0, 4, 500
+    print(f"  {leitores} leitores (8 itens por leitura) por {duracao:g}s,"
+          f" com um import de {lote} itens atrás do outro")
+    print(f"  {'modo':<24} | {'leituras/s':>10} | {'p50':>8} | {'p95':>8} | {'máx':>8} | {'erros':>5} | {'imports':>7}")
+    for nome, get_db in (("conexão nova + journal", conexao_nova), ("pool + WAL", pool_get_db)):
+        database.get_db = get_db
+        with contextlib.redirect_stdout(io.StringIO()):
+            path = usar_banco_temporario(2000)
+        parar = threading.Event()
+        tempos, erros, imports = [], [0], [0]
+
+        def leitor(seed):
+            rnd = random.Random(seed)
+            while not parar.is_set():
+                inicio = time.perf_counter()
+                try:
+                    database.get_knowledge_items_by_ids(rnd.sample(range(1, 2001), 8))
+                    tempos.append((time.perf_counter() - inicio) * 1000)
+                except sqlite3.OperationalError:
+                    erros[0] += 1
+
+        def importador():
+            n = 0
+            while not parar.is_set():
+                itens = [{"category": "Avisos", "title": f"Aviso importado {n}-{i}",
+                          "content": " ".join(random.choices(PALAVRAS, k=60))} for i in range(lote)]
+                try:
+                    rpa.importar_para_base(itens)
+                    imports[0] += 1
+                except sqlite3.OperationalError:
+                    erros[0] += 1
+                n += 1
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            threads = [threading.Thread(target=importador)]
+            threads += [threading.Thread(target=leitor, args=(i,)) for i in range(leitores)]
+            for t in threads: t.start()
+            time.sleep(duracao)
+            parar.set()
+            for t in threads: t.join()
+
+        tempos.sort()
+        p = lambda q: tempos[min(len(tempos) - 1, int(q * len(tempos)))] if tempos else 0.0
+        print(f"  {nome:<24} | {len(tempos) / duracao:>10.0f} | {p(0.5):>5.2f} ms | {p(0.95):>5.2f} ms"
+              f" | {tempos[-1] if tempos else 0:>5.0f} ms | {erros[0]:>5} | {imports[0]:>7}")
+        database.pool.fechar_todas()
+        for sufixo in ("", "-wal", "-shm"):
+            if os.path.exists(path + sufixo):
+                os.remove(path + sufixo)
+    database.get_db = pool_get_db
+
+
+# ────────────────────────────────────────────────────
+def bench_busca():
+    sec("BUSCA NO PAINEL — LIKE em todas as linhas vs. FTS5 (bm25 + snippet)")
+    import contextlib, io, itertools
+    consultas = [("palavra comum", "matrícula", None), ("duas palavras", "estágio coordenação", None),
+                 ("prefixo", "bibliot", None), ("com categoria", "bolsa", "Financeiro"),
+                 ("sem acento", "historico declaracao", None)]
+    # Texto mais próximo do real que o de usar_banco_temporario (onde toda palavra
+    # aparece em quase todo item): vocabulário grande com frequências de Zipf,
+    # e as palavras do domínio aparecendo em parte dos itens
+    rnd = random.Random(7)
+    vocabulario = [f"termo{i}" for i in range(20_000)] + PALAVRAS
+    pesos = [1 / (i + 1) for i in range(20_000)] + [0.02] * len(PALAVRAS)
+    acumulados = list(itertools.accumulate(pesos))
+
+    print(f"  {'itens':>7} | {'consulta':<15} | {'LIKE':>9} | {'FTS5 top 50':>11} | {'resultados':>10}")
+    for n in (10_000, 100_000):
+        with contextlib.redirect_stdout(io.StringIO()):
+            path = usar_banco_temporario(0)
+        conn = database.get_db()
+        conn.executemany(
+            "INSERT INTO knowledge_items (category, title, content, created_by) VALUES (?, ?, ?, 1)",
+            ((rnd.choice(CATEGORIAS),
+              " ".join(rnd.choices(vocabulario, cum_weights=acumulados, k=5)) + f" #{i}",
+              " ".join(rnd.choices(vocabulario, cum_weights=acumulados, k=60)))
+             for i in range(n)),
+        )
+        conn.commit()
+        conn.close()
+        for nome, termo, categoria in consultas:
+            def like():
+                conn = database.get_db()
+                sql = "SELECT * FROM knowledge_items WHERE 1=1"
+                params = []
+                for palavra in termo.split():
+                    sql += " AND (title LIKE ? OR content LIKE ?)"
+                    params += [f"%{palavra}%"] * 2
+                if categoria:
+                    sql += " AND category = ?"
+                    params.append(categoria)
+                linhas = conn.execute(sql, params).fetchall()
+                conn.close()
+                return linhas
+            ms_like, linhas = cronometrar(like, 3)
+            ms_fts, _ = cronometrar(lambda: database.buscar_knowledge(termo, categoria), 3)
+            print(f"  {n:>7} | {nome:<15} | {ms_like:>6.1f} ms | {ms_fts:>8.1f} ms | {len(linhas):>10}")
+        database.pool.fechar_todas()
+        for sufixo in ("", "-wal", "-shm"):
+            if os.path.exists(path + sufixo):
+                os.remove(path + sufixo)
+
+
+def bench_bulk():
+    sec("IMPORTAÇÃO EM MASSA — um INSERT + commit por item vs. importacao.importar (lotes)")
+    import contextlib, io, json
+    import importacao, retrieval
+    n = 50_000
+    amostra = 2_000
+    rnd = random.Random(11)
+    linhas = [json.dumps({"category": rnd.choice(CATEGORIAS), "title": f"Item importado {i}",
+                          "content": " ".join(rnd.choices(PALAVRAS, k=60))}, ensure_ascii=False)
+              for i in range(n)]
+    corpo = ("\n".join(linhas) + "\n").encode("utf-8")
+
+    # Caminho antigo: o que um script faria chamando a rota de criação item a item
+    caminhos = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        caminhos.append(usar_banco_temporario(0))
+    t = time.perf_counter()
+    for linha in linhas[:amostra]:
+        item = json.loads(linha)
+        with database.transacao() as conn:
+            conn.execute(
+                "INSERT INTO knowledge_items (category, title, content, created_by) VALUES (?, ?, ?, 1)",
+                (item["category"], item["title"], item["content"]),
+            )
+    por_item = (time.perf_counter() - t) / amostra
+    print(f"  item a item:   {amostra} itens em {por_item * amostra:.2f} s "
+          f"→ {n} itens ≈ {por_item * n:.1f} s ({1 / por_item:,.0f} itens/s)")
+
+    for lote in (500, 1000, 5000):
+        database.pool.fechar_todas()
+        with contextlib.redirect_stdout(io.StringIO()):
+            caminhos.append(usar_banco_temporario(0))
+        retrieval.indice.sincronizar()
+        t = time.perf_counter()
+        resumo = importacao.importar(io.BytesIO(corpo), "jsonl", 1, tamanho_lote=lote)
+        dt = time.perf_counter() - t
+        ms_sinc, _ = cronometrar(retrieval.indice.sincronizar)
+        print(f"  lotes de {lote:>4}: {resumo['inseridos']} itens em {dt:.2f} s ({n / dt:,.0f} itens/s), "
+              f"índice BM25 em dia após {ms_sinc:.0f} ms")
+
+    # Reimportar o mesmo arquivo: tudo vira UPDATE
+    t = time.perf_counter()
+    resumo = importacao.importar(io.BytesIO(corpo), "jsonl", 1)
+    print(f"  reimportação:  {resumo['atualizados']} atualizados em {time.perf_counter() - t:.2f} s")
+
+    t = time.perf_counter()
+    tamanho = sum(len(parte) for parte in importacao.exportar_jsonl())
+    # Boa parte do tempo das duas importações é a tokenização do FTS5 (gatilhos)
+    print(f"  exportação:    {tamanho / 1e6:.1f} MB em {time.perf_counter() - t:.2f} s")
+    database.pool.fechar_todas()
+    for path in caminhos:
+        for sufixo in ("", "-wal", "-shm"):
+            if os.path.exists(path + sufixo):
+                os.remove(path + sufixo)
+
+
+# ────────────────────────────────────────────────────
+def bench_chat_log():
+    sec("REGISTRO DAS CONVERSAS — INSERT na requisição vs. fila + gravação em lotes")
+    import contextlib, io, threading
+    import conversas, rpa
+
+    threads_req, por_thread = 8, 1500
+    registro = ("chat", "normal", "Como faço a rematrícula?", 420, 850.0, "MISS", 200, 200)
+    print(f"  {threads_req} threads x {por_thread} conversas, com um import do RPA atrás do outro")
+    print(f"  {'modo':<20} | {'p50':>8} | {'p99':>8} | {'máx':>9} | {'gravadas':>8} | {'descartadas':>11} | {'descarga':>8}")
+
+    def sincrono(*campos):
+        with database.transacao() as conn:
+            conn.execute(conversas._INSERT, (time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),) + campos)
+
+    for nome in ("INSERT na requisição", "fila + lotes"):
+        with contextlib.redirect_stdout(io.StringIO()):
+            path = usar_banco_temporario(500)
+        fila = conversas.RegistroConversas()
+        registrar = sincrono if nome == "INSERT na requisição" else fila.registrar
+        parar = threading.Event()
+        tempos = []
+
+        def requisicoes():
+            for _ in range(por_thread):
+                inicio = time.perf_counter()
+                registrar(*registro)
+                tempos.append((time.perf_counter() - inicio) * 1000)
+
+        def importador():
+            n = 0
+            while not parar.is_set():
+                rpa.importar_para_base([{"category": "Avisos", "title": f"Aviso {n}-{i}",
+                                         "content": " ".join(random.choices(PALAVRAS, k=60))}
+                                        for i in range(200)])
+                n += 1
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            fundo = threading.Thread(target=importador)
+            fundo.start()
+            threads = [threading.Thread(target=requisicoes) for _ in range(threads_req)]
+            for t in threads: t.start()
+            for t in threads: t.join()
+            inicio = time.perf_counter()
+            fila.descarregar(30)
+            descarga = (time.perf_counter() - inicio) * 1000
+            parar.set()
+            fundo.join()
+        fila.encerrar()
+
+        conn = database.get_db()
+        gravadas = conn.execute("SELECT COUNT(*) FROM conversation_log").fetchone()[0]
+        conn.close()
+        tempos.sort()
+        p = lambda q: tempos[min(len(tempos) - 1, int(q * len(tempos)))]
+        # Rajada sem pausa entre conversas: a fila enche enquanto o import segura a escrita
+        print(f"  {nome:<20} | {p(0.5):>5.3f} ms | {p(0.99):>5.2f} ms | {tempos[-1]:>6.1f} ms"
+              f" | {gravadas:>8} | {fila.descartados:>11} | {descarga:>5.0f} ms")
+        database.pool.fechar_todas()
+        for sufixo in ("", "-wal", "-shm"):
+            if os.path.exists(path + sufixo):
+                os.remove(path + sufixo)
+
+
+# ────────────────────────────────────────────────────
+def bench_stats():
+    sec("ESTATÍSTICAS DO CHAT — varrer conversation_log vs. resumos incrementais")
+    import contextlib, io
+    from datetime import datetime, timedelta, timezone
+    import conversas, estatisticas
+
+    rnd = random.Random(5)
+    agora = datetime.now(timezone.utc)
+    categorizar = lambda prompt: {rnd.choice(CATEGORIAS)}
+
+    def consulta_bruta(dias):
+        # O que o painel precisaria fazer sem os resumos
+        desde = (agora - timedelta(days=dias - 1)).strftime("%Y-%m-%d")
+        conn = database.get_db()
+        linhas = conn.execute(
+            "SELECT mode, COUNT(*), SUM(cache = 'HIT'), AVG(latency_ms) FROM conversation_log "
+            "WHERE created_at >= ? GROUP BY mode", (desde,)).fetchall()
+        latencias = sorted(r[0] for r in conn.execute(
+            "SELECT latency_ms FROM conversation_log WHERE created_at >= ?", (desde,)))
+        top = conn.execute(
+            "SELECT prompt, COUNT(*) AS n FROM conversation_log WHERE created_at >= ? "
+            "GROUP BY prompt ORDER BY n DESC LIMIT 20", (desde,)).fetchall()
+        conn.close()
+        return linhas, latencias[len(latencias) // 2] if latencias else 0, top
+
+    print(f"  {'histórico':>10} | {'linhas':>8} | {'resumo/lote':>11} | {'varredura 7 dias':>16} | {'/admin/stats 7 dias':>19}")
+    for dias_historico, por_dia in ((30, 1000), (365, 1000)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            path = usar_banco_temporario(0)
+        perguntas = PERGUNTAS + [f"pergunta rara {i}" for i in range(2000)]
+        tempos_lote = []
+        for d in range(dias_historico - 1, -1, -1):
+            dia = agora - timedelta(days=d)
+            lote = [((dia.replace(hour=rnd.randrange(24))).strftime("%Y-%m-%d %H:%M:%S"), "chat",
+                     rnd.choice(("normal", "normal", "surdez")),
+                     rnd.choice(PERGUNTAS) if rnd.random() < 0.6 else rnd.choice(perguntas),
+                     400, round(rnd.lognormvariate(6.5, 0.8)), rnd.choice(("HIT", "MISS")), 200, 200)
+                    for _ in range(por_dia)]
+            for i in range(0, por_dia, 200):
+                parte = lote[i:i + 200]
+                inicio = time.perf_counter()
+                gravar = estatisticas.resumir(parte, categorizar)
+                with database.transacao() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.executemany(conversas._INSERT, parte)
+                    gravar(conn)
+                tempos_lote.append((time.perf_counter() - inicio) * 1000)
+        ms_bruta, _ = cronometrar(lambda: consulta_bruta(7), 3)
+        ms_resumo, _ = cronometrar(lambda: estatisticas.consultar(7), 3)
+        print(f"  {dias_historico:>6} dias | {dias_historico * por_dia:>8} | {sum(tempos_lote) / len(tempos_lote):>8.1f} ms"
+              f" | {ms_bruta:>13.1f} ms | {ms_resumo:>16.1f} ms")
+        database.pool.fechar_todas()
+        for sufixo in ("", "-wal", "-shm"):
+            if os.path.exists(path + sufixo):
+                os.remove(path + sufixo)
+
+
+# ────────────────────────────────────────────────────
+def _site_fmp_falso(atrasos):
+    """
+    Site local com a página inicial e as de rpa.FMP_PAGINAS; `atrasos`
+    {path: segundos} simula a latência de cada página. Retorna (base, conexoes, parar).
+    """
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    import rpa
+
+    paginas = {"/": "".join(f"<article><h2>Notícia número {i} da FMP</h2><p>Resumo {i}</p>"
+                            f"<a href='/n/{i}'>ler</a></article>" for i in range(20))}
+    for path in rpa.FMP_PAGINAS:
+        paginas[path] = "".join(f"<li class='edital'><a>Edital {path[1:]} {i:02d}/2025</a></li>"
+                                for i in range(10))
+    conexoes = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def setup(self):
+            conexoes.append(1)
+            super().setup()
+        def log_message(self, *a): pass
+        def do_GET(self):
+            time.sleep(atrasos.get(self.path, 0))
+            corpo = f"<html><body>{paginas.get(self.path, '')}</body></html>".encode()
+            self.send_response(200 if self.path in paginas else 404)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            try:
+                self.wfile.write(corpo)
+            except OSError:
+                pass
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+
+    def parar():
+        servidor.shutdown()
+        servidor.server_close()
+
+    return f"http://127.0.0.1:{servidor.server_address[1]}", conexoes, parar
+
+
+def bench_rpa():
+    sec("RPA — páginas em sequência vs. sessão compartilhada em paralelo (site local)")
+    import contextlib, io
+    import requests
+    import rpa
+
+    def sequencial(base):
+        # Como era: requests.get (conexão nova) página por página, timeout de 15 s
+        paginas = 0
+        for url in [base] + [base + p for p in rpa.FMP_PAGINAS]:
+            try:
+                requests.get(url, headers=rpa._HEADERS, timeout=15).raise_for_status()
+                paginas += 1
+            except Exception:
+                pass
+        return paginas
+
+    cenarios = (
+        ("200 ms por página", {p: 0.2 for p in ["/"] + rpa.FMP_PAGINAS}, 5.0),
+        ("/avisos trava 5 s", {"/": 0.2, "/editais": 0.2, "/processo-seletivo": 0.2,
+                               "/noticias": 0.2, "/avisos": 5.0}, 1.0),
+    )
+    print(f"  {'cenário':<18} | {'sequencial':>10} | {'paralelo':>9} | {'páginas':>7} | {'itens':>5} | {'conexões (3 raspagens)':>22}")
+    for nome, atrasos, prazo in cenarios:
+        base, conexoes, parar = _site_fmp_falso(atrasos)
+        base_original = rpa.FMP_BASE
+        rpa.FMP_BASE = base
+        try:
+            ms_seq, _ = cronometrar(lambda: sequencial(base))
+            conexoes.clear()
+            with contextlib.redirect_stdout(io.StringIO()):
+                ms_par, (itens, relatorio) = cronometrar(lambda: rpa.raspar_site_fmp(prazo), 3)
+        finally:
+            rpa.FMP_BASE = base_original
+            parar()
+        ok = relatorio["paginas"] - len(relatorio["falhas"])
+        print(f"  {nome:<18} | {ms_seq:>7.0f} ms | {ms_par:>6.0f} ms | {ok:>4}/{relatorio['paginas']} | "
+              f"{len(itens):>5} | {len(conexoes):>22}")
+
+
+BENCHMARKS = {
+    "prompt": bench_prompt,
+    "tts_loop": bench_tts_loop,
+    "sqlite": bench_sqlite,
+    "busca": bench_busca,
+    "bulk": bench_bulk,
+    "chat_log": bench_chat_log,
+    "stats": bench_stats,
+    "rpa": bench_rpa,
+}
+
+if __name__ == "__main__":
+    escolhidos = sys.argv[1:] or list(BENCHMARKS)
+    for nome in escolhidos:
+        BENCHMARKS[nome]()
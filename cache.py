@@ -0,0 +1,175 @@
+"""
+FMPConnect — Cache de respostas do chat
+
+As mesmas perguntas (matrícula, SGA, biblioteca...) se repetem o dia todo.
+Perguntas de primeira mensagem são normalizadas e, junto com o modo e a
+versão da base de conhecimento, viram a chave de um cache LRU com TTL que
+fica na frente da chamada ao Gemini.
+
+Enquanto a primeira chamada para uma chave ainda está em andamento, pedidos
+idênticos esperam por ela (SingleFlight) em vez de irem ao upstream.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from retrieval import dobrar_acentos
+
+_PONTUACAO_RE = re.compile(r"[^\w\s]")
+_ESPACOS_RE = re.compile(r"\s+")
+
+
+def normalizar_pergunta(texto: str) -> str:
+    """Ignora caixa, acentos, pontuação e espaços extras."""
+    texto = _PONTUACAO_RE.sub(" ", dobrar_acentos(texto))
+    return _ESPACOS_RE.sub(" ", texto).strip()
+
+
+class CacheLRU:
+    """Cache LRU thread-safe com limite de itens, TTL e contadores de acerto."""
+
+    def __init__(self, max_itens: int = 1000, ttl: float = 3600):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._dados = OrderedDict()   # chave -> (expira_em, valor)
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            entrada = self._dados.get(chave)
+            if entrada is None or entrada[0] < time.monotonic():
+                if entrada is not None:
+                    del self._dados[chave]
+                self.misses += 1
+                return None
+            self._dados.move_to_end(chave)
+            self.hits += 1
+            return entrada[1]
+
+    def put(self, chave, valor):
+        with self._lock:
+            self._dados[chave] = (time.monotonic() + self.ttl, valor)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.max_itens:
+                self._dados.popitem(last=False)
+
+    def clear(self) -> int:
+        with self._lock:
+            removidos = len(self._dados)
+            self._dados.clear()
+            return removidos
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "itens": len(self._dados),
+                "max_itens": self.max_itens,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+class EsperaExpirada(Exception):
+    """A chamada compartilhada não terminou dentro do tempo de espera."""
+
+
+class ChamadaAbandonada(Exception):
+    """O líder desistiu sem resultado (ex.: o cliente dele desconectou)."""
+
+
+class _Chamada:
+    __slots__ = ("evento", "resultado", "erro")
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.erro = None
+
+
+class SingleFlight:
+    """
+    Coalescência de chamadas idênticas em andamento: a primeira requisição
+    com uma chave vira líder e faz a chamada ao upstream; as que chegam
+    enquanto ela está em andamento esperam e recebem o mesmo resultado
+    (ou a mesma exceção).
+    """
+
+    def __init__(self):
+        self.lideres = 0
+        self.coalescidas = 0
+        self.timeouts = 0
+        self.erros = 0
+        self._chamadas = {}
+        self._lock = threading.Lock()
+
+    def entrar(self, chave) -> tuple[bool, _Chamada]:
+        """Retorna (é_líder, chamada). O líder DEVE chamar `concluir`."""
+        with self._lock:
+            chamada = self._chamadas.get(chave)
+            if chamada is not None:
+                self.coalescidas += 1
+                return False, chamada
+            chamada = _Chamada()
+            self._chamadas[chave] = chamada
+            self.lideres += 1
+            return True, chamada
+
+    def concluir(self, chave, chamada: _Chamada, resultado=None, erro: BaseException | None = None):
+        """Publica o resultado para quem espera. Chamadas repetidas são ignoradas."""
+        with self._lock:
+            if chamada.evento.is_set():
+                return
+            if self._chamadas.get(chave) is chamada:
+                del self._chamadas[chave]
+            if erro is not None:
+                self.erros += 1
+            chamada.resultado = resultado
+            chamada.erro = erro
+            chamada.evento.set()
+
+    def aguardar(self, chamada: _Chamada, timeout: float):
+        if not chamada.evento.wait(timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise EsperaExpirada(f"Sem resposta após {timeout:g}s")
+        if chamada.erro is not None:
+            raise chamada.erro
+        return chamada.resultado
+
+    def executar(self, chave, fn, timeout: float, so_do_lider=()):
+        """
+        Executa `fn()` uma única vez por chave entre chamadas concorrentes.
+        Retorna (resultado, compartilhado). Se o líder abandonar a chamada,
+        quem esperava executa `fn()` por conta própria — também quando `fn()`
+        falha com uma exceção de `so_do_lider` (ex.: o limite do próprio cliente).
+        """
+        eh_lider, chamada = self.entrar(chave)
+        if not eh_lider:
+            try:
+                return self.aguardar(chamada, timeout), True
+            except ChamadaAbandonada:
+                return fn(), False
+        try:
+            resultado = fn()
+        except BaseException as exc:
+            self.concluir(chave, chamada, erro=ChamadaAbandonada() if isinstance(exc, so_do_lider) else exc)
+            raise
+        self.concluir(chave, chamada, resultado=resultado)
+        return resultado, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "em_andamento": len(self._chamadas),
+                "lideres": self.lideres,
+                "chamadas_economizadas": self.coalescidas,
+                "timeouts": self.timeouts,
+                "erros": self.erros,
+            }
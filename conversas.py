@@ -0,0 +1,159 @@
+"""
+FMPConnect — Registro das conversas do chat
+
+Cada pergunta respondida por /text/chat e /text/chat/stream vira uma linha
+em conversation_log (pergunta, modo, tamanho da resposta, latência, cache,
+status devolvido e status do Gemini), para sabermos o que os alunos
+perguntam e ajustar a base e os caches.
+
+  - registrar() só coloca o registro numa fila em memória: a requisição
+    nunca espera pelo disco
+  - uma thread grava a fila em lotes, um executemany por transação, quando
+    junta `tamanho_lote` registros ou a cada `intervalo` segundos
+  - fila cheia descarta o registro novo e conta em `descartados`
+  - `resumir(lote)`, se informado, monta resumos do lote (estatisticas.py)
+    fora da transação e devolve a função que os grava junto com o lote
+  - encerrar() grava o que ainda estiver na fila (registrado no atexit)
+"""
+
+import threading
+import time
+from collections import deque
+
+import database
+
+# Perguntas muito longas são cortadas no registro
+MAX_PROMPT = 2000
+
+_INSERT = """INSERT INTO conversation_log
+             (created_at, endpoint, mode, prompt, answer_chars, latency_ms, cache, status, upstream_status)
+             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+
+class RegistroConversas:
+    """Fila limitada de registros, gravada no SQLite em lotes por uma thread própria."""
+
+    def __init__(self, max_fila: int = 10000, tamanho_lote: int = 200, intervalo: float = 1.0, resumir=None):
+        self.max_fila = max_fila
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.resumir = resumir              # resumir(lote) -> gravar(conn)
+        self.recebidos = 0
+        self.gravados = 0
+        self.descartados = 0
+        self.falhas = 0
+        self.falhas_resumo = 0
+        self.lotes = 0
+        self._fila = deque()
+        self._gravando = 0                  # registros retirados da fila e ainda não gravados
+        self._cond = threading.Condition()
+        self._parar = False
+        self._urgente = False
+        self._thread = None
+
+    def registrar(self, endpoint: str, mode: str, prompt: str, answer_chars: int, latency_ms: float,
+                  cache: str, status: int, upstream_status: int | None = None) -> bool:
+        """Enfileira um registro. Retorna False se a fila estava cheia (registro descartado)."""
+        registro = (
+            time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()), endpoint, mode,
+            (prompt or "")[:MAX_PROMPT], answer_chars, round(latency_ms), cache, status, upstream_status,
+        )
+        with self._cond:
+            if self._parar:
+                return False
+            if len(self._fila) >= self.max_fila:
+                self.descartados += 1
+                return False
+            self._fila.append(registro)
+            self.recebidos += 1
+            if self._thread is None:
+                # Começa na primeira conversa: só o processo que atende requisições grava
+                self._thread = threading.Thread(target=self._rodar, name="chat-log", daemon=True)
+                self._thread.start()
+            if len(self._fila) >= self.tamanho_lote:
+                self._cond.notify_all()
+        return True
+
+    def _rodar(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._parar or self._urgente or len(self._fila) >= self.tamanho_lote,
+                    timeout=self.intervalo,
+                )
+                lote = [self._fila.popleft() for _ in range(min(len(self._fila), self.tamanho_lote))]
+                self._gravando = len(lote)
+                if not self._fila:
+                    self._urgente = False
+                terminar = self._parar and not self._fila
+            if lote:
+                self._gravar(lote)
+            with self._cond:
+                self._gravando = 0
+                self._cond.notify_all()
+            if terminar:
+                return
+
+    def _gravar(self, lote):
+        gravar_resumo = None
+        if self.resumir is not None:
+            try:
+                gravar_resumo = self.resumir(lote)
+            except Exception as e:
+                self.falhas_resumo += len(lote)
+                print(f"[LOG] Falha ao resumir {len(lote)} registro(s) de conversa: {e}")
+        try:
+            with database.transacao() as conn:
+                # IMMEDIATE: os resumos leem e regravam linhas; com vários workers
+                # a trava de escrita precisa vir antes da leitura
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(_INSERT, lote)
+                if gravar_resumo is not None:
+                    # Falha nos resumos não pode levar o registro bruto junto
+                    conn.execute("SAVEPOINT resumos")
+                    try:
+                        gravar_resumo(conn)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO resumos")
+                        self.falhas_resumo += len(lote)
+                        print(f"[LOG] Falha ao gravar os resumos de {len(lote)} conversa(s): {e}")
+                    conn.execute("RELEASE resumos")
+            self.gravados += len(lote)
+            self.lotes += 1
+        except Exception as e:
+            # Sem nova tentativa: um banco travado não pode acumular memória sem fim
+            self.falhas += len(lote)
+            print(f"[LOG] Falha ao gravar {len(lote)} registro(s) de conversa: {e}")
+
+    def descarregar(self, timeout: float = 5.0) -> bool:
+        """Grava já o que está na fila e espera terminar. Retorna False se o tempo acabar."""
+        with self._cond:
+            if self._thread is None:
+                return not self._fila
+            self._urgente = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._fila and not self._gravando, timeout)
+
+    def encerrar(self, timeout: float = 5.0):
+        """Para de aceitar registros, grava o que falta e espera a thread (até `timeout`)."""
+        with self._cond:
+            self._parar = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            na_fila = len(self._fila) + self._gravando
+        return {
+            "recebidos": self.recebidos,
+            "gravados": self.gravados,
+            "na_fila": na_fila,
+            "descartados": self.descartados,
+            "falhas": self.falhas,
+            "falhas_resumo": self.falhas_resumo,
+            "lotes": self.lotes,
+            "max_fila": self.max_fila,
+            "ativo": self._thread is not None and self._thread.is_alive(),
+        }
@@ -1,14 +1,130 @@
 import sqlite3
 import os
+import re
+import threading
+from contextlib import contextmanager
 from werkzeug.security import generate_password_hash
 
-DB_PATH = os.path.join(os.path.dirname(__file__), 'fmpconnect.db')
+DB_PATH = os.environ.get("DB_PATH", os.path.join(os.path.dirname(__file__), 'fmpconnect.db'))
+
+# Pool de conexões: o servidor do Flask cria uma thread por requisição, então
+# uma conexão por thread quase nunca seria reaproveitada. As conexões ociosas
+# ficam numa pilha compartilhada; cada uma é usada por uma thread de cada vez.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", 5000))
+DB_CACHE_KB = int(os.environ.get("DB_CACHE_KB", 8192))
+DB_MMAP_BYTES = int(os.environ.get("DB_MMAP_BYTES", 64 * 1024 * 1024))
+
+
+class ConexaoPool:
+    """
+    Conexão emprestada do pool. Repassa tudo para a sqlite3.Connection;
+    `close()` desfaz o que não foi commitado e devolve a conexão ao pool.
+    """
+
+    def __init__(self, pool, conn, caminho):
+        self._pool = pool
+        self._conn = conn
+        self._caminho = caminho
+
+    def __getattr__(self, nome):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError("Conexão já devolvida ao pool")
+        return getattr(self._conn, nome)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.devolver(conn, self._caminho)
+
+
+class PoolConexoes:
+    """Conexões SQLite reaproveitáveis, já em WAL e com os PRAGMAs ajustados."""
+
+    def __init__(self, tamanho: int = 8):
+        self.tamanho = tamanho
+        self.abertas = 0
+        self.reutilizadas = 0
+        self._ociosas = []              # [(caminho, conexão)]
+        self._lock = threading.Lock()
+
+    def _abrir(self, caminho):
+        conn = sqlite3.connect(caminho, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # WAL: leitores não esperam o escritor (ex.: importação do RPA durante o chat)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_KB}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_BYTES}")
+        with self._lock:
+            self.abertas += 1
+        return conn
+
+    def emprestar(self) -> ConexaoPool:
+        caminho = DB_PATH
+        with self._lock:
+            while self._ociosas:
+                dono, conn = self._ociosas.pop()
+                if dono == caminho:
+                    self.reutilizadas += 1
+                    return ConexaoPool(self, conn, caminho)
+                conn.close()            # DB_PATH mudou (benchmarks, testes)
+        return ConexaoPool(self, self._abrir(caminho), caminho)
+
+    def devolver(self, conn, caminho):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        with self._lock:
+            if caminho == DB_PATH and len(self._ociosas) < self.tamanho:
+                self._ociosas.append((caminho, conn))
+                return
+        conn.close()
+
+    def fechar_todas(self):
+        with self._lock:
+            ociosas, self._ociosas = self._ociosas, []
+        for _, conn in ociosas:
+            conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ociosas": len(self._ociosas),
+                "tamanho": self.tamanho,
+                "abertas": self.abertas,
+                "reutilizadas": self.reutilizadas,
+            }
+
+
+pool = PoolConexoes(DB_POOL_SIZE)
 
 
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Conexão do pool. Chame `close()` ao terminar (ou use `transacao()`)."""
+    return pool.emprestar()
+
+
+@contextmanager
+def transacao():
+    """
+    with transacao() as conn: ...
+    Commit se o bloco terminar bem, rollback se levantar exceção; a conexão
+    volta ao pool nos dois casos.
+    """
+    conn = get_db()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
 
 def init_db():
@@ -183,7 +299,381 @@ def init_db():
         print(f"✅ {len(seed_items)} itens de conhecimento iniciais inseridos.")
 
     conn.commit()
+    migrar(conn)
+    conn.close()
+
+
+# Entradas mantidas em knowledge_changes (fixado no gatilho da migração 3)
+KNOWLEDGE_CHANGES_KEEP = 10000
+# Acima disso, quem sincroniza recebe None e recarrega tudo de uma vez
+KNOWLEDGE_DELTA_MAX = int(os.environ.get("KNOWLEDGE_DELTA_MAX", 2000))
+# item_id registrado no log por uma importação em massa: "recarregue tudo"
+KNOWLEDGE_RECARREGAR = 0
+
+
+def _desativar_titulos_duplicados(conn):
+    """
+    Antes do índice único: entre itens ativos com o mesmo título, só o mais
+    antigo continua ativo. Os outros são desativados (nunca apagados) e
+    listados no log, para que possam ser revistos (e reativados pelo painel
+    depois de ajustado o título).
+    """
+    duplicados = conn.execute(
+        """SELECT k.id, k.title, m.mantido FROM knowledge_items k
+           JOIN (SELECT lower(trim(title)) AS chave, MIN(id) AS mantido FROM knowledge_items
+                 WHERE active=1 GROUP BY chave HAVING COUNT(*) > 1) m ON lower(trim(k.title)) = m.chave
+           WHERE k.active=1 AND k.id <> m.mantido ORDER BY k.id"""
+    ).fetchall()
+    if not duplicados:
+        return
+    conn.executemany("UPDATE knowledge_items SET active=0 WHERE id=?", [(row[0],) for row in duplicados])
+    print(f"[DB] {len(duplicados)} item(ns) ativo(s) com título repetido desativado(s) "
+          f"(ids: {', '.join(str(row[0]) for row in duplicados)}):")
+    for item_id, titulo, mantido in duplicados:
+        print(f"[DB]   id {item_id} repete o id {mantido}: {titulo[:80]}")
+
+
+# Migrações do schema, aplicadas em ordem. A versão aplicada fica em
+# PRAGMA user_version; na inicialização só rodam as que faltam. Cada passo é
+# um comando SQL ou uma função fn(conn) (alterações de dados que precisam de log).
+# Nunca altere uma migração já publicada — acrescente uma nova.
+MIGRACOES = [
+    (1, "índices de knowledge_items e users, título único entre itens ativos", [
+        # Importação do RPA: "este título já existe?" (inclusive itens desativados)
+        "CREATE INDEX IF NOT EXISTS idx_knowledge_titulo ON knowledge_items (lower(trim(title)))",
+        # Chat: WHERE active=1 ORDER BY category, title — sem ordenação em memória
+        "CREATE INDEX IF NOT EXISTS idx_knowledge_ativos ON knowledge_items (category, title) WHERE active=1",
+        # Painel: ORDER BY updated_at DESC
+        "CREATE INDEX IF NOT EXISTS idx_knowledge_atualizacao ON knowledge_items (updated_at)",
+        # Painel: lista de usuários ORDER BY created_at DESC
+        "CREATE INDEX IF NOT EXISTS idx_users_criacao ON users (created_at)",
+        # Duplicatas ativas que já existam ficam só na mais antiga antes do índice único
+        _desativar_titulos_duplicados,
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_knowledge_titulo_ativo "
+        "ON knowledge_items (lower(trim(title))) WHERE active=1",
+    ]),
+    (2, "busca textual (FTS5) sobre título e conteúdo", [
+        # Tabela de conteúdo externo: o texto fica só em knowledge_items,
+        # o FTS guarda o índice invertido; os gatilhos mantêm os dois em sincronia
+        """CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_fts USING fts5(
+               title, content, content='knowledge_items', content_rowid='id',
+               tokenize='unicode61 remove_diacritics 2')""",
+        """CREATE TRIGGER IF NOT EXISTS knowledge_fts_ai AFTER INSERT ON knowledge_items BEGIN
+               INSERT INTO knowledge_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS knowledge_fts_ad AFTER DELETE ON knowledge_items BEGIN
+               INSERT INTO knowledge_fts (knowledge_fts, rowid, title, content)
+               VALUES ('delete', old.id, old.title, old.content);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS knowledge_fts_au AFTER UPDATE OF title, content ON knowledge_items BEGIN
+               INSERT INTO knowledge_fts (knowledge_fts, rowid, title, content)
+               VALUES ('delete', old.id, old.title, old.content);
+               INSERT INTO knowledge_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+           END""",
+        "INSERT INTO knowledge_fts (knowledge_fts) VALUES ('rebuild')",
+    ]),
+    (3, "log de alterações da base de conhecimento (versão + knowledge_changes)", [
+        # Versão durável, compartilhada por todos os processos que abrem o banco.
+        # epoch identifica o arquivo: versões de bancos diferentes não se confundem
+        """CREATE TABLE IF NOT EXISTS knowledge_version (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               version INTEGER NOT NULL,
+               epoch TEXT NOT NULL DEFAULT (lower(hex(randomblob(4)))))""",
+        "INSERT OR IGNORE INTO knowledge_version (id, version) VALUES (1, 1)",
+        """CREATE TABLE IF NOT EXISTS knowledge_changes (
+               version INTEGER PRIMARY KEY,
+               item_id INTEGER NOT NULL)""",
+    ] + [
+        # Cada escrita em knowledge_items incrementa a versão e registra o item,
+        # na mesma transação; o log guarda só as últimas KNOWLEDGE_CHANGES_KEEP entradas
+        f"""CREATE TRIGGER IF NOT EXISTS knowledge_log_{sufixo} AFTER {evento} ON knowledge_items BEGIN
+               UPDATE knowledge_version SET version = version + 1 WHERE id = 1;
+               INSERT INTO knowledge_changes (version, item_id)
+               SELECT version, {linha}.id FROM knowledge_version WHERE id = 1;
+               DELETE FROM knowledge_changes
+               WHERE version <= (SELECT version FROM knowledge_version WHERE id = 1) - {KNOWLEDGE_CHANGES_KEEP};
+           END"""
+        for sufixo, evento, linha in (("ai", "INSERT", "new"), ("au", "UPDATE", "new"), ("ad", "DELETE", "old"))
+    ]),
+    (4, "registro das conversas do chat (conversation_log)", [
+        # Gravada em lotes por conversas.RegistroConversas; cache = valor do X-Cache
+        # (HIT, MISS, COALESCED, BYPASS), upstream_status = HTTP do Gemini (NULL sem chamada)
+        """CREATE TABLE IF NOT EXISTS conversation_log (
+               id INTEGER PRIMARY KEY,
+               created_at TIMESTAMP NOT NULL,
+               endpoint TEXT NOT NULL,
+               mode TEXT NOT NULL,
+               prompt TEXT NOT NULL,
+               answer_chars INTEGER NOT NULL,
+               latency_ms INTEGER NOT NULL,
+               cache TEXT NOT NULL,
+               status INTEGER NOT NULL,
+               upstream_status INTEGER)""",
+    ]),
+    (5, "resumos incrementais do uso do chat (estatisticas.py)", [
+        """CREATE TABLE IF NOT EXISTS chat_stats_hourly (
+               hour TEXT NOT NULL,
+               mode TEXT NOT NULL,
+               total INTEGER NOT NULL,
+               cache_hits INTEGER NOT NULL,
+               errors INTEGER NOT NULL,
+               latency_ms_sum INTEGER NOT NULL,
+               PRIMARY KEY (hour, mode)) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS chat_latency_daily (
+               day TEXT NOT NULL,
+               mode TEXT NOT NULL,
+               bucket INTEGER NOT NULL,
+               count INTEGER NOT NULL,
+               PRIMARY KEY (day, mode, bucket)) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS chat_top_questions (
+               day TEXT NOT NULL,
+               question TEXT NOT NULL,
+               example TEXT NOT NULL,
+               count INTEGER NOT NULL,
+               error INTEGER NOT NULL,
+               PRIMARY KEY (day, question)) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS chat_categories_daily (
+               day TEXT NOT NULL,
+               category TEXT NOT NULL,
+               count INTEGER NOT NULL,
+               PRIMARY KEY (day, category)) WITHOUT ROWID""",
+    ]),
+    (6, "importação em massa registra uma única alteração no log", [
+        # Linha presente só dentro da transação de um lote da importação
+        # (importacao.py); enquanto existe, os gatilhos de log não disparam
+        "CREATE TABLE IF NOT EXISTS knowledge_bulk (id INTEGER PRIMARY KEY CHECK (id = 1))",
+    ] + [
+        sql
+        for sufixo, evento, linha in (("ai", "INSERT", "new"), ("au", "UPDATE", "new"), ("ad", "DELETE", "old"))
+        for sql in (
+            f"DROP TRIGGER IF EXISTS knowledge_log_{sufixo}",
+            f"""CREATE TRIGGER knowledge_log_{sufixo} AFTER {evento} ON knowledge_items
+                WHEN NOT EXISTS (SELECT 1 FROM knowledge_bulk) BEGIN
+                   UPDATE knowledge_version SET version = version + 1 WHERE id = 1;
+                   INSERT INTO knowledge_changes (version, item_id)
+                   SELECT version, {linha}.id FROM knowledge_version WHERE id = 1;
+                   DELETE FROM knowledge_changes
+                   WHERE version <= (SELECT version FROM knowledge_version WHERE id = 1) - {KNOWLEDGE_CHANGES_KEEP};
+               END""",
+        )
+    ]),
+    (7, "sessões de chat no servidor (chat_sessions, chat_session_messages)", [
+        # Criadas antes das migrações por init_db; IF NOT EXISTS mantém os bancos antigos
+        """CREATE TABLE IF NOT EXISTS chat_sessions (
+               id TEXT PRIMARY KEY,
+               created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+               last_access REAL NOT NULL)""",
+        """CREATE TABLE IF NOT EXISTS chat_session_messages (
+               seq INTEGER PRIMARY KEY AUTOINCREMENT,
+               session_id TEXT NOT NULL REFERENCES chat_sessions(id),
+               role TEXT NOT NULL,
+               content TEXT NOT NULL)""",
+        "CREATE INDEX IF NOT EXISTS idx_session_messages ON chat_session_messages (session_id, seq)",
+    ]),
+]
+
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrar(conn):
+    """Aplica as migrações pendentes, cada uma na sua própria transação."""
+    atual = schema_version(conn)
+    for versao, descricao, comandos in MIGRACOES:
+        if versao <= atual:
+            continue
+        # IMMEDIATE: com vários workers subindo juntos, só um aplica cada migração
+        conn.execute("BEGIN IMMEDIATE")
+        if schema_version(conn) >= versao:
+            conn.rollback()
+            atual = schema_version(conn)
+            continue
+        try:
+            for passo in comandos:
+                if callable(passo):
+                    passo(conn)
+                else:
+                    conn.execute(passo)
+            conn.execute(f"PRAGMA user_version={versao}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"[DB] Migração {versao} aplicada: {descricao}")
+        atual = versao
+
+
+def get_knowledge_version():
+    """
+    Versão atual da base de conhecimento. Incrementada pelos gatilhos a cada
+    escrita em knowledge_items, em qualquer processo; é uma leitura de uma
+    única linha, barata o bastante para ser feita a cada requisição.
+    """
+    conn = get_db()
+    row = conn.execute("SELECT version FROM knowledge_version WHERE id = 1").fetchone()
+    conn.close()
+    return row[0]
+
+
+_epocas = {}
+
+
+def get_knowledge_epoch():
+    """Identificador do arquivo do banco (não muda; lido uma vez por caminho)."""
+    epoca = _epocas.get(DB_PATH)
+    if epoca is None:
+        conn = get_db()
+        epoca = conn.execute("SELECT epoch FROM knowledge_version WHERE id = 1").fetchone()[0]
+        conn.close()
+        _epocas[DB_PATH] = epoca
+    return epoca
+
+
+def get_knowledge_changes(since_version):
+    """
+    Ids de itens alterados depois de `since_version`, ou None quando não é
+    possível (ou não compensa) aplicar só as diferenças: histórico já podado
+    ou mais de KNOWLEDGE_DELTA_MAX itens alterados.
+    """
+    conn = get_db()
+    version, primeira = conn.execute(
+        "SELECT version, (SELECT min(version) FROM knowledge_changes) FROM knowledge_version WHERE id = 1"
+    ).fetchone()
+    if since_version >= version:
+        conn.close()
+        return set()
+    if primeira is None or primeira > since_version + 1:
+        conn.close()
+        return None
+    rows = conn.execute(
+        "SELECT DISTINCT item_id FROM knowledge_changes WHERE version > ? LIMIT ?",
+        (since_version, KNOWLEDGE_DELTA_MAX + 1),
+    ).fetchall()
+    conn.close()
+    alterados = {row[0] for row in rows}
+    if len(rows) > KNOWLEDGE_DELTA_MAX or KNOWLEDGE_RECARREGAR in alterados:
+        return None
+    return alterados
+
+
+def registrar_alteracao_em_massa():
+    """
+    Uma única nova versão para uma importação em massa (cujos lotes não
+    passam pelos gatilhos de log): quem sincroniza recarrega tudo uma vez.
+    """
+    with transacao() as conn:
+        conn.execute("UPDATE knowledge_version SET version = version + 1 WHERE id = 1")
+        conn.execute(
+            "INSERT INTO knowledge_changes (version, item_id) SELECT version, ? FROM knowledge_version WHERE id = 1",
+            (KNOWLEDGE_RECARREGAR,),
+        )
+
+
+def get_knowledge_items_by_ids(item_ids):
+    if not item_ids:
+        return []
+    conn = get_db()
+    placeholders = ",".join("?" * len(item_ids))
+    rows = conn.execute(
+        f'SELECT * FROM knowledge_items WHERE id IN ({placeholders})', list(item_ids)
+    ).fetchall()
     conn.close()
+    return [dict(row) for row in rows]
+
+
+# Campos que a listagem do painel pode pedir (?fields=...). O padrão não traz
+# o conteúdo inteiro, só um resumo — o texto completo vem de GET /admin/knowledge/<id>.
+CAMPOS_KNOWLEDGE = {
+    "id": "ki.id",
+    "category": "ki.category",
+    "title": "ki.title",
+    "content": "ki.content",
+    "summary": "substr(ki.content, 1, 160)",
+    "active": "ki.active",
+    "created_by": "ki.created_by",
+    "creator_name": "u.name",
+    "created_at": "ki.created_at",
+    "updated_at": "ki.updated_at",
+}
+CAMPOS_KNOWLEDGE_PADRAO = ("id", "category", "title", "summary", "active", "updated_at", "creator_name")
+
+
+def listar_knowledge_pagina(limite, apos=None, campos=CAMPOS_KNOWLEDGE_PADRAO, categoria=None, ativo=None):
+    """
+    Uma página da listagem do painel, do mais recente ao mais antigo
+    (updated_at DESC, id DESC), por keyset: `apos` é o (updated_at, id) do
+    último item da página anterior. Retorna (itens, cursor da próxima página ou None).
+    """
+    campos = list(dict.fromkeys(("id", "updated_at") + tuple(campos)))   # o cursor precisa dos dois
+    colunas = ", ".join(f"{CAMPOS_KNOWLEDGE[c]} AS {c}" for c in campos)
+    sql = f"SELECT {colunas} FROM knowledge_items ki"
+    if "creator_name" in campos:
+        sql += " LEFT JOIN users u ON ki.created_by = u.id"
+    condicoes, params = [], []
+    if apos is not None:
+        condicoes.append("(ki.updated_at, ki.id) < (?, ?)")
+        params += list(apos)
+    if categoria:
+        condicoes.append("ki.category = ?")
+        params.append(categoria)
+    if ativo is not None:
+        condicoes.append("ki.active = ?")
+        params.append(1 if ativo else 0)
+    if condicoes:
+        sql += " WHERE " + " AND ".join(condicoes)
+    sql += " ORDER BY ki.updated_at DESC, ki.id DESC LIMIT ?"
+    params.append(limite + 1)
+
+    conn = get_db()
+    rows = conn.execute(sql, params).fetchall()
+    conn.close()
+    itens = [dict(row) for row in rows[:limite]]
+    proximo = (itens[-1]["updated_at"], itens[-1]["id"]) if len(rows) > limite else None
+    return itens, proximo
+
+
+def get_knowledge_item(item_id):
+    conn = get_db()
+    row = conn.execute(
+        '''SELECT ki.*, u.name as creator_name
+           FROM knowledge_items ki
+           LEFT JOIN users u ON ki.created_by = u.id
+           WHERE ki.id=?''', (item_id,)
+    ).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def estatisticas_knowledge():
+    """Totais do dashboard calculados no banco, sem carregar os itens."""
+    conn = get_db()
+    total, ativos = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(active=1), 0) FROM knowledge_items"
+    ).fetchone()
+    categorias = conn.execute(
+        '''SELECT category, COUNT(*) AS total, COALESCE(SUM(active=1), 0) AS ativos
+           FROM knowledge_items GROUP BY category ORDER BY total DESC, category'''
+    ).fetchall()
+    conn.close()
+    return {"total": total, "ativos": ativos, "categorias": [dict(c) for c in categorias]}
+
+
+def listar_usuarios_pagina(limite, apos=None):
+    """Usuários do mais novo ao mais antigo (created_at DESC, id DESC), por keyset."""
+    sql = "SELECT id, username, email, name, role, created_at, active FROM users"
+    params = []
+    if apos is not None:
+        sql += " WHERE (created_at, id) < (?, ?)"
+        params += list(apos)
+    sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    params.append(limite + 1)
+    conn = get_db()
+    rows = conn.execute(sql, params).fetchall()
+    conn.close()
+    usuarios = [dict(row) for row in rows[:limite]]
+    proximo = (usuarios[-1]["created_at"], usuarios[-1]["id"]) if len(rows) > limite else None
+    return usuarios, proximo
 
 
 def get_knowledge_items(active_only=True):
@@ -203,6 +693,49 @@ def get_knowledge_items(active_only=True):
     return [dict(row) for row in rows]
 
 
+def _consulta_fts(termo: str) -> str:
+    """
+    Converte o texto digitado numa consulta FTS5 segura: cada palavra vira um
+    termo entre aspas (sem operadores), e a última casa por prefixo, para a
+    busca funcionar enquanto o usuário digita.
+    """
+    palavras = re.findall(r"\w+", termo)
+    if not palavras:
+        return ""
+    termos = [f'"{p}"' for p in palavras]
+    termos[-1] += "*"
+    return " ".join(termos)
+
+
+def buscar_knowledge(termo, categoria=None, ativo=None, limite=50):
+    """
+    Busca textual no título e no conteúdo, do mais ao menos relevante (bm25,
+    título pesa mais). `snippet` marca os termos encontrados com \x02 ... \x03.
+    `ativo` None traz ativos e inativos.
+    """
+    consulta = _consulta_fts(termo)
+    if not consulta:
+        return []
+    sql = '''SELECT ki.id, ki.category, ki.title, ki.content, ki.active, ki.created_at, ki.updated_at,
+                    snippet(knowledge_fts, -1, char(2), char(3), '…', 16) AS snippet,
+                    bm25(knowledge_fts, 5.0, 1.0) AS rank
+             FROM knowledge_fts JOIN knowledge_items ki ON ki.id = knowledge_fts.rowid
+             WHERE knowledge_fts MATCH ?'''
+    params = [consulta]
+    if categoria:
+        sql += " AND ki.category = ?"
+        params.append(categoria)
+    if ativo is not None:
+        sql += " AND ki.active = ?"
+        params.append(1 if ativo else 0)
+    sql += " ORDER BY rank LIMIT ?"
+    params.append(limite)
+    conn = get_db()
+    rows = conn.execute(sql, params).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
 def build_dynamic_system_instruction(base_instruction):
     items = get_knowledge_items(active_only=True)
     if not items:
@@ -0,0 +1,210 @@
+"""
+FMPConnect — Estatísticas de uso do chat (rollups incrementais)
+
+Os lotes de conversation_log gravados por conversas.RegistroConversas
+atualizam, na mesma transação, tabelas pequenas de resumo; o /admin/stats
+lê só os resumos do período pedido, nunca o registro bruto.
+
+  - chat_stats_hourly: por hora e modo, total, acertos no cache, erros e
+    soma das latências
+  - chat_latency_daily: histograma de latências por dia e modo, em baldes
+    logarítmicos com erro relativo de ALFA (sketch no estilo do DDSketch);
+    os percentis saem da soma dos baldes
+  - chat_top_questions: perguntas normalizadas mais frequentes por dia,
+    no máximo TOP_K por dia (algoritmo Space-Saving); `error` é o quanto a
+    contagem pode estar superestimada
+  - chat_categories_daily: categorias da base recuperadas para as perguntas
+
+Horas e dias em UTC, como o created_at do registro.
+"""
+
+import math
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+
+import cache
+import database
+
+ALFA = 0.02
+TOP_K = 100
+MAX_DIAS = 30
+
+_GAMA = (1 + ALFA) / (1 - ALFA)
+_LOG_GAMA = math.log(_GAMA)
+
+
+def balde_latencia(ms: float) -> int:
+    """Balde do histograma: 0 para até 1 ms, depois ⌈log_γ(ms)⌉."""
+    return 0 if ms <= 1 else math.ceil(math.log(ms) / _LOG_GAMA)
+
+
+def valor_balde(balde: int) -> float:
+    """Valor representativo do balde (erro relativo de no máximo ALFA)."""
+    return 0.0 if balde == 0 else 2 * _GAMA ** balde / (_GAMA + 1)
+
+
+def percentis(contagens: dict, quantis=(0.5, 0.9, 0.99)) -> dict:
+    """Percentis (em ms) a partir de {balde: contagem}."""
+    total = sum(contagens.values())
+    if not total:
+        return {}
+    baldes = sorted(contagens)
+    resultado = {}
+    for q in quantis:
+        alvo = q * (total - 1)
+        acumulado = 0
+        for balde in baldes:
+            acumulado += contagens[balde]
+            if acumulado > alvo:
+                break
+        resultado[f"p{round(q * 100)}"] = round(valor_balde(balde))
+    return resultado
+
+
+def _atualizar_top(conn, dia, perguntas, top_k):
+    """Space-Saving: aplica {pergunta: [contagem, exemplo]} ao resumo do dia."""
+    atuais = {
+        row["question"]: [row["count"], row["error"], row["example"]]
+        for row in conn.execute("SELECT question, count, error, example FROM chat_top_questions WHERE day=?", (dia,))
+    }
+    alteradas, removidas = set(), set()
+    for pergunta, (n, exemplo) in sorted(perguntas.items(), key=lambda p: -p[1][0]):
+        if pergunta in atuais:
+            atuais[pergunta][0] += n
+            atuais[pergunta][2] = exemplo
+        elif len(atuais) < top_k:
+            atuais[pergunta] = [n, 0, exemplo]
+        else:
+            # Substitui a menos contada; a nova herda a contagem dela como erro
+            menor = min(atuais, key=lambda p: atuais[p][0])
+            minimo = atuais.pop(menor)[0]
+            removidas.add(menor)
+            alteradas.discard(menor)
+            atuais[pergunta] = [minimo + n, minimo, exemplo]
+        alteradas.add(pergunta)
+        removidas.discard(pergunta)
+    conn.executemany("DELETE FROM chat_top_questions WHERE day=? AND question=?",
+                     [(dia, p) for p in removidas])
+    conn.executemany(
+        "INSERT OR REPLACE INTO chat_top_questions (day, question, example, count, error) VALUES (?, ?, ?, ?, ?)",
+        [(dia, p, atuais[p][2], atuais[p][0], atuais[p][1]) for p in alteradas],
+    )
+
+
+def resumir(lote, categorizar=None, top_k: int = TOP_K):
+    """
+    Resume um lote de registros (tuplas de conversas._INSERT) fora da
+    transação; devolve gravar(conn), que soma o resumo às tabelas.
+    `categorizar(prompt)` devolve as categorias da base ligadas à pergunta.
+    """
+    horas = defaultdict(lambda: [0, 0, 0, 0])
+    latencias = Counter()
+    perguntas = defaultdict(dict)
+    categorias = Counter()
+    for created_at, _, mode, prompt, _, latency_ms, cache_status, status, _ in lote:
+        hora, dia = created_at[:13], created_at[:10]
+        resumo = horas[(hora, mode)]
+        resumo[0] += 1
+        resumo[1] += cache_status == "HIT"
+        resumo[2] += status >= 400
+        resumo[3] += latency_ms
+        latencias[(dia, mode, balde_latencia(latency_ms))] += 1
+        normalizada = cache.normalizar_pergunta(prompt)
+        if normalizada:
+            contagem = perguntas[dia].setdefault(normalizada, [0, prompt])
+            contagem[0] += 1
+            contagem[1] = prompt
+        if categorizar is not None:
+            for categoria in categorizar(prompt):
+                categorias[(dia, categoria)] += 1
+
+    def gravar(conn):
+        conn.executemany(
+            """INSERT INTO chat_stats_hourly (hour, mode, total, cache_hits, errors, latency_ms_sum)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (hour, mode) DO UPDATE SET
+                   total = total + excluded.total, cache_hits = cache_hits + excluded.cache_hits,
+                   errors = errors + excluded.errors, latency_ms_sum = latency_ms_sum + excluded.latency_ms_sum""",
+            [chave + tuple(valores) for chave, valores in horas.items()],
+        )
+        conn.executemany(
+            """INSERT INTO chat_latency_daily (day, mode, bucket, count) VALUES (?, ?, ?, ?)
+               ON CONFLICT (day, mode, bucket) DO UPDATE SET count = count + excluded.count""",
+            [chave + (n,) for chave, n in latencias.items()],
+        )
+        conn.executemany(
+            """INSERT INTO chat_categories_daily (day, category, count) VALUES (?, ?, ?)
+               ON CONFLICT (day, category) DO UPDATE SET count = count + excluded.count""",
+            [chave + (n,) for chave, n in categorias.items()],
+        )
+        for dia, do_dia in perguntas.items():
+            _atualizar_top(conn, dia, do_dia, top_k)
+
+    return gravar
+
+
+def consultar(dias: int = 7, top: int = 20, agora: datetime | None = None) -> dict:
+    """
+    Resumo dos últimos `dias` (hoje incluído). Lê no máximo
+    dias x 24 x modos linhas por tabela, qualquer que seja o tamanho do histórico.
+    """
+    agora = agora or datetime.now(timezone.utc)
+    desde_dia = (agora - timedelta(days=dias - 1)).strftime("%Y-%m-%d")
+    desde_hora = (agora - timedelta(hours=23)).strftime("%Y-%m-%d %H")
+
+    conn = database.get_db()
+    por_modo = {}
+    for row in conn.execute(
+        """SELECT mode, SUM(total) AS total, SUM(cache_hits) AS hits, SUM(errors) AS erros,
+                  SUM(latency_ms_sum) AS latencia
+           FROM chat_stats_hourly WHERE hour >= ? GROUP BY mode""", (desde_dia,),
+    ):
+        por_modo[row["mode"]] = {
+            "total": row["total"],
+            "cache_hits": row["hits"],
+            "taxa_cache": round(row["hits"] / row["total"], 3),
+            "erros": row["erros"],
+            "latencia_media_ms": round(row["latencia"] / row["total"]),
+        }
+    baldes = defaultdict(dict)
+    for row in conn.execute(
+        """SELECT mode, bucket, SUM(count) AS n FROM chat_latency_daily
+           WHERE day >= ? GROUP BY mode, bucket""", (desde_dia,),
+    ):
+        baldes[row["mode"]][row["bucket"]] = row["n"]
+    for mode, contagens in baldes.items():
+        por_modo.setdefault(mode, {}).update(percentis(contagens))
+
+    por_hora = defaultdict(dict)
+    for row in conn.execute(
+        "SELECT hour, mode, total FROM chat_stats_hourly WHERE hour >= ? ORDER BY hour", (desde_hora,),
+    ):
+        por_hora[row["hour"]][row["mode"]] = row["total"]
+
+    # Soma dos resumos diários; o erro somado é o limite da superestimativa
+    top_perguntas = [
+        {"pergunta": row["exemplo"], "normalizada": row["question"], "contagem": row["n"], "erro": row["erro"]}
+        for row in conn.execute(
+            """SELECT question, SUM(count) AS n, SUM(error) AS erro,
+                      (SELECT example FROM chat_top_questions t2
+                       WHERE t2.question = t.question AND t2.day >= ? ORDER BY day DESC LIMIT 1) AS exemplo
+               FROM chat_top_questions t WHERE day >= ?
+               GROUP BY question ORDER BY n DESC LIMIT ?""", (desde_dia, desde_dia, top),
+        )
+    ]
+    categorias = [
+        {"categoria": row["category"], "contagem": row["n"]}
+        for row in conn.execute(
+            """SELECT category, SUM(count) AS n FROM chat_categories_daily
+               WHERE day >= ? GROUP BY category ORDER BY n DESC""", (desde_dia,),
+        )
+    ]
+    conn.close()
+    return {
+        "dias": dias,
+        "desde": desde_dia,
+        "por_modo": por_modo,
+        "por_hora": [{"hora": hora, **modos} for hora, modos in por_hora.items()],
+        "top_perguntas": top_perguntas,
+        "categorias": categorias,
+    }
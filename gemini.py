@@ -0,0 +1,297 @@
+"""
+FMPConnect — Cliente HTTP compartilhado para a API do Gemini
+
+Um único pool de conexões keep-alive (urllib3, thread-safe) é reutilizado por
+todas as requisições do chat, evitando um handshake TLS por mensagem.
+
+Recursos:
+  - pool de conexões com tamanho configurável e timeouts de conexão/leitura
+  - retentativas limitadas com backoff exponencial + jitter em 429/503 e em
+    falhas de conexão (nunca depois que o pedido pode ter chegado ao upstream)
+  - circuit breaker: após falhas consecutivas, falha rápido até o upstream voltar
+  - cache de contexto explícito (cachedContents) para a instrução de sistema
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+
+import urllib3
+
+
+RETRY_STATUS = (429, 503)
+
+
+class GeminiHTTPError(Exception):
+    """Resposta HTTP de erro do upstream (status >= 400)."""
+
+    def __init__(self, code: int, body: str):
+        super().__init__(f"HTTP Error {code}")
+        self.code = code
+        self.body = body
+
+
+class CircuitOpenError(Exception):
+    """O circuit breaker está aberto — o upstream é considerado indisponível."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Serviço de IA temporariamente indisponível")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker clássico (fechado → aberto → meio-aberto).
+    Abre após `failure_threshold` falhas consecutivas; depois de
+    `reset_timeout` segundos deixa passar uma única requisição de teste.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def before_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            elapsed = time.monotonic() - self._opened_at
+            if elapsed < self.reset_timeout or self._probing:
+                raise CircuitOpenError(max(self.reset_timeout - elapsed, 1.0))
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class GeminiClient:
+    """Cliente thread-safe com pool de conexões para a API REST do Gemini."""
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        pool_size: int = 10,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_max: float = 4.0,
+        breaker: CircuitBreaker | None = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._pool = urllib3.PoolManager(
+            num_pools=4,
+            maxsize=pool_size,
+            block=True,
+            timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout),
+            retries=False,
+            headers={"Content-Type": "application/json; charset=utf-8"},
+        )
+
+    def _url(self, path: str, **params) -> str:
+        params["key"] = self.api_key
+        query = "&".join(f"{k}={v}" for k, v in params.items())
+        return f"{self.base_url}/{path.lstrip('/')}?{query}"
+
+    def _backoff(self, attempt: int, retry_after: str | None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        # "Full jitter": sorteio uniforme até o teto exponencial
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _request(self, method: str, url: str, body: dict | None, stream: bool):
+        self.breaker.before_request()
+        payload = json.dumps(body).encode("utf-8") if body is not None else None
+
+        attempt = 0
+        while True:
+            try:
+                resp = self._pool.request(method, url, body=payload, preload_content=not stream)
+            except urllib3.exceptions.ConnectTimeoutError:
+                # Falhou ao conectar (inclui DNS e conexão recusada): o pedido não
+                # chegou ao upstream, reenviar é seguro
+                self.breaker.record_failure()
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt, None))
+                attempt += 1
+                self.breaker.before_request()
+                continue
+            except urllib3.exceptions.HTTPError:
+                # Timeout de leitura, conexão caída no meio: o generateContent pode
+                # já estar em processamento — sem reenvio
+                self.breaker.record_failure()
+                raise
+
+            if resp.status < 400:
+                self.breaker.record_success()
+                return resp
+
+            error_body = resp.data.decode("utf-8", errors="replace")
+            resp.release_conn()
+            if resp.status in RETRY_STATUS or resp.status >= 500:
+                self.breaker.record_failure()
+            else:
+                # Erros 4xx são do pedido, não do upstream
+                self.breaker.record_success()
+
+            if resp.status in RETRY_STATUS and attempt < self.max_retries:
+                time.sleep(self._backoff(attempt, resp.headers.get("Retry-After")))
+                attempt += 1
+                self.breaker.before_request()
+                continue
+            raise GeminiHTTPError(resp.status, error_body)
+
+    def post_json(self, path: str, body: dict, **params) -> dict:
+        """POST com corpo JSON; devolve a resposta já decodificada."""
+        resp = self._request("POST", self._url(path, **params), body, stream=False)
+        return json.loads(resp.data.decode("utf-8"))
+
+    def get_json(self, path: str, **params) -> dict:
+        resp = self._request("GET", self._url(path, **params), None, stream=False)
+        return json.loads(resp.data.decode("utf-8"))
+
+    def patch_json(self, path: str, body: dict, **params) -> dict:
+        resp = self._request("PATCH", self._url(path, **params), body, stream=False)
+        return json.loads(resp.data.decode("utf-8"))
+
+    def delete(self, path: str, **params):
+        self._request("DELETE", self._url(path, **params), None, stream=False)
+
+    def post_stream(self, path: str, body: dict, **params):
+        """
+        POST que devolve a resposta sem pré-carregar o corpo (para SSE).
+        O chamador deve fechar com `release_conn()` para devolver a conexão ao pool.
+        """
+        return self._request("POST", self._url(path, **params), body, stream=True)
+
+
+class ContextCache:
+    """
+    Gerencia entradas `cachedContents` do Gemini para instruções de sistema.
+
+    Cada texto é identificado pelo seu hash: a primeira requisição cria a
+    entrada, as seguintes a reutilizam, e o TTL é renovado (PATCH) quando
+    falta menos de `refresh_margin` segundos para expirar. Se a criação
+    falhar, devolve None por `retry_after_failure` segundos — o chamador
+    segue em modo inline.
+    """
+
+    def __init__(
+        self,
+        client: GeminiClient,
+        model: str,
+        ttl: int = 3600,
+        refresh_margin: int = 300,
+        retry_after_failure: float = 60.0,
+    ):
+        self.client = client
+        self.model = model
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.retry_after_failure = retry_after_failure
+        self.hits = 0
+        self.criados = 0
+        self.renovados = 0
+        self.falhas = 0
+        self._entradas = {}        # hash -> (name, expira_em)
+        self._falha_ate = {}       # hash -> instante até o qual não tenta de novo
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _chave(texto: str) -> str:
+        return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+    def get_name(self, system_instruction: str, display_name: str = "fmpconnect") -> str | None:
+        chave = self._chave(system_instruction)
+        agora = time.monotonic()
+        entrada = self._entradas.get(chave)
+        if entrada and entrada[1] - agora > self.refresh_margin:
+            self.hits += 1
+            return entrada[0]
+        if self._falha_ate.get(chave, 0) > agora:
+            return None
+
+        # Só uma thread cria/renova; as demais seguem com o que houver
+        if not self._lock.acquire(blocking=False):
+            return entrada[0] if entrada and entrada[1] > agora else None
+        try:
+            entrada = self._entradas.get(chave)
+            if entrada and entrada[1] - time.monotonic() > self.refresh_margin:
+                return entrada[0]
+            if entrada and entrada[1] > time.monotonic():
+                try:
+                    self.client.patch_json(entrada[0], {"ttl": f"{self.ttl}s"}, updateMask="ttl")
+                    self._entradas[chave] = (entrada[0], time.monotonic() + self.ttl)
+                    self.renovados += 1
+                    return entrada[0]
+                except (GeminiHTTPError, CircuitOpenError, urllib3.exceptions.HTTPError) as exc:
+                    print(f"[GEMINI] Falha ao renovar cache de contexto: {exc}")
+            try:
+                criado = self.client.post_json("cachedContents", {
+                    "model": f"models/{self.model}",
+                    "displayName": display_name,
+                    "systemInstruction": {"parts": [{"text": system_instruction}]},
+                    "ttl": f"{self.ttl}s",
+                })
+            except (GeminiHTTPError, CircuitOpenError, urllib3.exceptions.HTTPError) as exc:
+                self.falhas += 1
+                self._entradas.pop(chave, None)
+                self._falha_ate[chave] = time.monotonic() + self.retry_after_failure
+                print(f"[GEMINI] Cache de contexto indisponível, usando modo inline: {exc}")
+                return None
+            self._entradas[chave] = (criado["name"], time.monotonic() + self.ttl)
+            self._falha_ate.pop(chave, None)
+            self.criados += 1
+            return criado["name"]
+        finally:
+            self._lock.release()
+
+    def invalidar(self, name: str):
+        """Esquece uma entrada que o servidor rejeitou (expirada ou removida)."""
+        with self._lock:
+            for chave, entrada in list(self._entradas.items()):
+                if entrada[0] == name:
+                    del self._entradas[chave]
+
+    def stats(self) -> dict:
+        return {
+            "entradas": len(self._entradas),
+            "hits": self.hits,
+            "criados": self.criados,
+            "renovados": self.renovados,
+            "falhas": self.falhas,
+        }
@@ -0,0 +1,117 @@
+"""
+FMPConnect — Gestão do histórico de conversa enviado ao Gemini
+
+O cliente manda o histórico inteiro a cada mensagem; sessões longas por voz
+fariam o payload (e a latência/custo) crescer sem limite. Aqui o histórico é
+reduzido no servidor:
+
+  - as últimas N mensagens seguem literalmente
+  - as mais antigas viram um resumo extrativo compacto (perguntas do aluno
+    e a primeira frase de cada resposta)
+  - o total (instrução + resumo + histórico + pergunta) respeita um orçamento
+    rígido de tokens, estimado localmente
+"""
+
+import re
+
+from retrieval import estimar_tokens
+
+_FRASE_RE = re.compile(r"(?<=[.!?])\s")
+
+
+def _primeira_frase(texto: str, limite: int = 160) -> str:
+    frase = _FRASE_RE.split(texto.strip(), maxsplit=1)[0]
+    frase = " ".join(frase.split())
+    return frase if len(frase) <= limite else frase[: limite - 1] + "…"
+
+
+def _linha_resumo(role: str, texto: str) -> str:
+    if role == "user":
+        return f"- Aluno perguntou: {_primeira_frase(texto)}"
+    return f"- FMPConnect respondeu: {_primeira_frase(texto)}"
+
+
+def resumir(mensagens: list[tuple[str, str]], token_budget: int) -> tuple[str, int]:
+    """
+    Resumo das mensagens antigas, priorizando as mais recentes.
+    Retorna (texto, nº de mensagens que ficaram de fora do resumo).
+    """
+    cabecalho = "[Resumo da conversa anterior]"
+    usados = estimar_tokens(cabecalho)
+    linhas = []
+    for role, texto in reversed(mensagens):
+        linha = _linha_resumo(role, texto)
+        custo = estimar_tokens(linha)
+        if usados + custo > token_budget:
+            break
+        usados += custo
+        linhas.append(linha)
+    if not linhas:
+        return "", len(mensagens)
+    return cabecalho + "\n" + "\n".join(reversed(linhas)), len(mensagens) - len(linhas)
+
+
+def _custo(mensagens):
+    return sum(estimar_tokens(texto) for _, texto in mensagens)
+
+
+def preparar_historico(
+    history: list[dict],
+    prompt: str,
+    system_tokens: int,
+    max_turns: int = 8,
+    token_budget: int = 8000,
+    summary_tokens: int = 400,
+) -> tuple[list[dict], dict]:
+    """
+    Converte o histórico do cliente em `contents` do Gemini dentro do orçamento.
+    Retorna (contents, relatório das decisões de truncamento).
+    """
+    mensagens = [
+        ("user" if m.get("role") == "user" else "model", str(m.get("content", "")))
+        for m in history if m.get("content")
+    ]
+    recentes = mensagens[-max_turns:] if max_turns > 0 else []
+    antigas = mensagens[: len(mensagens) - len(recentes)]
+
+    # O trecho literal começa sempre numa pergunta do aluno
+    while recentes and recentes[0][0] != "user":
+        antigas.append(recentes.pop(0))
+
+    disponivel = max(token_budget - system_tokens - estimar_tokens(prompt), 0)
+    reserva_resumo = min(summary_tokens, disponivel // 4)
+    while recentes and _custo(recentes) > disponivel - reserva_resumo:
+        antigas.append(recentes.pop(0))
+        while recentes and recentes[0][0] != "user":
+            antigas.append(recentes.pop(0))
+
+    resumo, descartadas = "", 0
+    if antigas:
+        limite = min(summary_tokens, disponivel - _custo(recentes))
+        resumo, descartadas = resumir(antigas, limite)
+
+    contents = [{"role": role, "parts": [{"text": texto}]} for role, texto in recentes]
+    contents.append({"role": "user", "parts": [{"text": prompt}]})
+    if resumo:
+        # Junta o resumo à primeira mensagem do aluno para manter a alternância de papéis
+        contents[0]["parts"].insert(0, {"text": resumo})
+
+    relatorio = {
+        "recebidas": len(mensagens),
+        "literais": len(recentes),
+        "resumidas": len(antigas) - descartadas,
+        "descartadas": descartadas,
+        "tokens": (system_tokens + estimar_tokens(prompt) + _custo(recentes)
+                   + (estimar_tokens(resumo) if resumo else 0)),
+        "orcamento": token_budget,
+    }
+    return contents, relatorio
+
+
+def formatar_relatorio(relatorio: dict) -> str:
+    """Valor do cabeçalho X-History, ex.: received=12; verbatim=8; summarized=4; ..."""
+    return (
+        f"received={relatorio['recebidas']}; verbatim={relatorio['literais']}; "
+        f"summarized={relatorio['resumidas']}; dropped={relatorio['descartadas']}; "
+        f"tokens={relatorio['tokens']}; budget={relatorio['orcamento']}"
+    )
@@ -0,0 +1,205 @@
+"""
+FMPConnect — Importação e exportação em massa da base de conhecimento
+
+Importação (POST /admin/knowledge/bulk): JSONL ou CSV lido do corpo da
+requisição linha a linha, sem carregar o arquivo inteiro.
+
+  - cada linha é validada ao ser lida; linhas inválidas viram erros com o
+    número da linha e não interrompem o resto
+  - upsert pelo título normalizado (mesma regra do índice único): título já
+    existente atualiza o item, título novo insere
+  - grava em lotes de `tamanho_lote` linhas, um executemany por lote, cada
+    lote na sua transação
+  - os lotes não passam pelos gatilhos de log (tabela knowledge_bulk): a
+    versão da base só muda uma vez, no fim, e quem sincroniza (índice BM25,
+    aquecedor de TTS, cache de respostas) recarrega uma única vez
+
+Exportação (GET /admin/knowledge/bulk): JSONL gerado com fetchmany, memória
+constante qualquer que seja o tamanho da base.
+"""
+
+import csv
+import io
+import json
+import string
+
+import database
+
+CAMPOS_EXPORTACAO = ("id", "category", "title", "content", "active", "created_at", "updated_at")
+MAX_ERROS_LISTADOS = 1000
+
+
+# lower() do SQLite só troca A-Z; a chave do lote precisa seguir a mesma regra
+# do índice lower(trim(title))
+_MINUSCULAS_SQLITE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+# Conteúdos longos: o limite padrão do módulo csv é 128 KB por campo
+csv.field_size_limit(max(csv.field_size_limit(), 16 * 1024 * 1024))
+
+
+class FormatoInvalido(ValueError):
+    pass
+
+
+def _linhas_texto(fluxo):
+    """Linhas de texto de um fluxo binário UTF-8 (com ou sem BOM), lidas aos poucos."""
+    return io.TextIOWrapper(fluxo, encoding="utf-8-sig", newline="")
+
+
+def _registros_jsonl(fluxo):
+    for numero, linha in enumerate(_linhas_texto(fluxo), start=1):
+        if not linha.strip():
+            continue
+        try:
+            registro = json.loads(linha)
+        except json.JSONDecodeError as e:
+            yield numero, None, f"JSON inválido: {e.msg}"
+            continue
+        if not isinstance(registro, dict):
+            yield numero, None, "Cada linha deve ser um objeto JSON"
+            continue
+        yield numero, registro, None
+
+
+def _registros_csv(fluxo):
+    leitor = csv.DictReader(_linhas_texto(fluxo))
+    if leitor.fieldnames is None:
+        return
+    faltando = {"category", "title", "content"} - {c.strip() for c in leitor.fieldnames}
+    if faltando:
+        raise FormatoInvalido(f"Cabeçalho do CSV sem as colunas: {', '.join(sorted(faltando))}")
+    for registro in leitor:
+        # line_num conta as linhas físicas lidas (campos com quebra de linha ocupam várias)
+        yield leitor.line_num, {k.strip(): v for k, v in registro.items() if k}, None
+
+
+def _validar(registro):
+    """(category, title, content, active) ou mensagem de erro."""
+    valores = {}
+    for campo in ("category", "title", "content"):
+        valor = registro.get(campo)
+        if not isinstance(valor, str) or not valor.strip():
+            return f"Campo '{campo}' obrigatório"
+        valores[campo] = valor.strip()
+    ativo = registro.get("active", 1)
+    if isinstance(ativo, str):
+        ativo = ativo.strip().lower()
+        ativo = {"": 1, "1": 1, "true": 1, "sim": 1, "0": 0, "false": 0, "nao": 0, "não": 0}.get(ativo, ativo)
+    if ativo not in (0, 1, True, False):
+        return "Campo 'active' deve ser 1 ou 0"
+    return valores["category"], valores["title"], valores["content"], int(ativo)
+
+
+def _gravar_lote(lote, user_id):
+    """Upsert de um lote [(linha, category, title, content, active)]. Retorna (inseridos, atualizados)."""
+    # Dentro do lote, a última linha com o mesmo título vence
+    por_titulo = {}
+    for linha in lote:
+        por_titulo[linha[2].translate(_MINUSCULAS_SQLITE)] = linha
+
+    with database.transacao() as conn:
+        # Trava de escrita desde a consulta: ninguém insere o mesmo título no meio do lote
+        conn.execute("BEGIN IMMEDIATE")
+        # Desliga o log por linha só nesta transação; a versão muda no fim da importação
+        conn.execute("INSERT INTO knowledge_bulk (id) VALUES (1)")
+        existentes = {}
+        titulos = list(por_titulo)
+        for inicio in range(0, len(titulos), 500):
+            parte = titulos[inicio:inicio + 500]
+            marcadores = ",".join("?" * len(parte))
+            # Prefere o item ativo; entre inativos, o mais recente
+            for row in conn.execute(
+                f"""SELECT id, lower(trim(title)) AS chave, active FROM knowledge_items
+                    WHERE lower(trim(title)) IN ({marcadores})
+                    ORDER BY active ASC, id ASC""", parte,
+            ):
+                existentes[row["chave"]] = row["id"]
+
+        atualizar = [(categoria, titulo, conteudo, ativo, existentes[chave])
+                     for chave, (_, categoria, titulo, conteudo, ativo) in por_titulo.items()
+                     if chave in existentes]
+        inserir = [(categoria, titulo, conteudo, ativo, user_id)
+                   for chave, (_, categoria, titulo, conteudo, ativo) in por_titulo.items()
+                   if chave not in existentes]
+        conn.executemany(
+            """UPDATE knowledge_items
+               SET category=?, title=?, content=?, active=?, updated_at=CURRENT_TIMESTAMP
+               WHERE id=?""", atualizar,
+        )
+        conn.executemany(
+            "INSERT INTO knowledge_items (category, title, content, active, created_by) VALUES (?, ?, ?, ?, ?)",
+            inserir,
+        )
+        conn.execute("DELETE FROM knowledge_bulk")
+    return len(inserir), len(atualizar)
+
+
+def importar(fluxo, formato: str, user_id: int, tamanho_lote: int = 1000) -> dict:
+    """
+    Importa JSONL ou CSV de `fluxo` (arquivo binário). Retorna o resumo com
+    inseridos, atualizados, linhas lidas e os erros por linha.
+    """
+    if formato == "jsonl":
+        registros = _registros_jsonl(fluxo)
+    elif formato == "csv":
+        registros = _registros_csv(fluxo)
+    else:
+        raise FormatoInvalido("Formato deve ser jsonl ou csv")
+
+    resumo = {"linhas": 0, "inseridos": 0, "atualizados": 0, "total_erros": 0, "erros": []}
+    lote = []
+
+    def erro(numero, mensagem):
+        resumo["total_erros"] += 1
+        if len(resumo["erros"]) < MAX_ERROS_LISTADOS:
+            resumo["erros"].append({"linha": numero, "erro": mensagem})
+
+    def descarregar():
+        inseridos, atualizados = _gravar_lote(lote, user_id)
+        resumo["inseridos"] += inseridos
+        resumo["atualizados"] += atualizados
+        lote.clear()
+
+    try:
+        try:
+            for numero, registro, problema in registros:
+                resumo["linhas"] += 1
+                if problema is None:
+                    valores = _validar(registro)
+                    if isinstance(valores, str):
+                        problema = valores
+                if problema is not None:
+                    erro(numero, problema)
+                    continue
+                lote.append((numero,) + valores)
+                if len(lote) >= tamanho_lote:
+                    descarregar()
+        except (UnicodeDecodeError, csv.Error) as e:
+            erro(resumo["linhas"] + 1, f"Leitura interrompida: {e}")
+        # O que já foi validado é gravado mesmo se a leitura parar no meio
+        if lote:
+            descarregar()
+    finally:
+        # Lotes já gravados valem mesmo se um lote posterior falhar
+        if resumo["inseridos"] or resumo["atualizados"]:
+            database.registrar_alteracao_em_massa()
+    return resumo
+
+
+def exportar_jsonl(ativo=None, tamanho_lote: int = 500):
+    """Gerador de linhas JSONL (bytes) com todos os itens, em ordem de id."""
+    sql = f"SELECT {', '.join(CAMPOS_EXPORTACAO)} FROM knowledge_items"
+    params = []
+    if ativo is not None:
+        sql += " WHERE active = ?"
+        params.append(1 if ativo else 0)
+    sql += " ORDER BY id"
+    conn = database.get_db()
+    try:
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(tamanho_lote)
+            if not rows:
+                break
+            yield "".join(json.dumps(dict(row), ensure_ascii=False) + "\n" for row in rows).encode("utf-8")
+    finally:
+        conn.close()
@@ -8,6 +8,7 @@ document.addEventListener("DOMContentLoaded", () => {
     
     const SURDEZ_KEY = 'fmpconnect_modo_surdez';
     const HISTORICO_KEY = 'fmpconnect_sessao_atual_v1';
+    const SESSAO_ID_KEY = 'fmpconnect_sessao_id';
     
     const welcomeModal = document.getElementById('welcome-modal');
     const welcomeOptions = welcomeModal && welcomeModal.querySelectorAll('.welcome-option');
@@ -202,30 +203,25 @@ document.addEventListener("DOMContentLoaded", () => {
     
         (async () => {
             try {
-                const resp = await fetch(window.location.origin + '/text/chat', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({
-                        prompt: texto,
-                        history: historicoContexto,
-                        mode: modoEnvio 
-                    })
-                });
+                const resp = await enviarParaSessao({ prompt: texto, mode: modoEnvio }, historicoContexto);
                 if (!resp.ok) throw new Error(`Erro ${resp.status}`);
     
-                const data = await resp.json();
+                const conteudo = botBalao.querySelector('.mensagem-conteudo');
+                const resposta = await lerRespostaEmStream(resp, (parcial) => {
+                    conteudo.innerHTML = renderMarkdownToHtml(parcial);
+                    rolarParaOFinal();
+                });
     
-                if (data.answer) {
-                    const htmlFinal = renderMarkdownToHtml(data.answer);
-                    botBalao.querySelector('.mensagem-conteudo').innerHTML = htmlFinal;
+                if (resposta) {
+                    conteudo.innerHTML = renderMarkdownToHtml(resposta);
     
-                    const btnAudio = criarBotaoAudio(data.answer);
+                    const btnAudio = criarBotaoAudio(resposta);
                     botWrapper.appendChild(btnAudio);
     
                     salvarSessaoLocal();
                     rolarParaOFinal();
                 } else {
-                    botBalao.querySelector('.mensagem-conteudo').textContent = "Desculpe, não entendi.";
+                    conteudo.textContent = "Desculpe, não entendi.";
                 }
             } catch (e) {
                 console.error(e);
@@ -237,6 +233,73 @@ document.addEventListener("DOMContentLoaded", () => {
         })();
     }
     
+    async function obterSessaoId() {
+        let sessaoId = sessionStorage.getItem(SESSAO_ID_KEY);
+        if (sessaoId) return sessaoId;
+        const resp = await fetch(window.location.origin + '/text/session', { method: 'POST' });
+        if (!resp.ok) throw new Error(`Erro ${resp.status}`);
+        sessaoId = (await resp.json()).session_id;
+        sessionStorage.setItem(SESSAO_ID_KEY, sessaoId);
+        return sessaoId;
+    }
+    
+    // O histórico fica no servidor; só é reenviado para semear uma sessão nova
+    // quando a anterior expirou (HTTP 404)
+    async function enviarParaSessao(corpo, historicoSemente) {
+        const postar = async (extra) => fetch(window.location.origin + '/text/chat/stream', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ ...corpo, session_id: await obterSessaoId(), ...extra })
+        });
+    
+        let resp = await postar({});
+        if (resp.status === 404) {
+            sessionStorage.removeItem(SESSAO_ID_KEY);
+            resp = await postar({ history: historicoSemente });
+        }
+        return resp;
+    }
+    
+    // Lê o stream SSE de /text/chat/stream, chamando onParcial com o texto acumulado
+    async function lerRespostaEmStream(resp, onParcial) {
+        const reader = resp.body.getReader();
+        const decoder = new TextDecoder('utf-8');
+        let buffer = '';
+        let acumulado = '';
+    
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+    
+            let fim;
+            while ((fim = buffer.indexOf('\n\n')) !== -1) {
+                const bloco = buffer.slice(0, fim);
+                buffer = buffer.slice(fim + 2);
+    
+                let evento = 'message';
+                let dados = '';
+                bloco.split('\n').forEach(linha => {
+                    if (linha.startsWith('event:')) evento = linha.slice(6).trim();
+                    else if (linha.startsWith('data:')) dados += linha.slice(5).trim();
+                });
+                if (!dados) continue;
+    
+                const payload = JSON.parse(dados);
+                if (evento === 'error') throw new Error(payload.error);
+                if (evento === 'done') {
+                    console.debug(`[chat] TTFB ${payload.ttfb_ms} ms | total ${payload.total_ms} ms`);
+                    continue;
+                }
+                if (payload.text) {
+                    acumulado += payload.text;
+                    onParcial(acumulado);
+                }
+            }
+        }
+        return acumulado;
+    }
+    
     function renderMarkdownToHtml(mdText) {
         if (!mdText) return '';
         if (mdText === '...') return '...';
@@ -355,6 +418,7 @@ document.addEventListener("DOMContentLoaded", () => {
     
     window.resetChat = function() {
         sessionStorage.removeItem(HISTORICO_KEY);
+        sessionStorage.removeItem(SESSAO_ID_KEY);
         sessionStorage.removeItem(SURDEZ_KEY); 
         location.reload();
     };
@@ -367,6 +431,37 @@ document.addEventListener("DOMContentLoaded", () => {
 });
 
 let audioAtual = null; 
+let ttsAbort = null;
+// Texto -> URL do clipe em cache (/text/tts/audio/<hash>.mp3). Replays e
+// seeks usam GET nessa URL: o navegador guarda o arquivo e pede só trechos (Range).
+const urlsAudio = new Map();
+
+// Toca o MP3 de /text/tts/stream enquanto ele chega (MediaSource).
+// Sem suporte a MediaSource, espera o arquivo inteiro.
+async function carregarAudioEmStream(resp, audio) {
+    if (!(window.MediaSource && MediaSource.isTypeSupported('audio/mpeg'))) {
+        audio.src = URL.createObjectURL(await resp.blob());
+        return;
+    }
+    const mediaSource = new MediaSource();
+    audio.src = URL.createObjectURL(mediaSource);
+    await new Promise(r => mediaSource.addEventListener('sourceopen', r, { once: true }));
+    const buffer = mediaSource.addSourceBuffer('audio/mpeg');
+    const reader = resp.body.getReader();
+    (async () => {
+        try {
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer.appendBuffer(value);
+                await new Promise(r => buffer.addEventListener('updateend', r, { once: true }));
+            }
+            if (mediaSource.readyState === 'open') mediaSource.endOfStream();
+        } catch (e) {
+            if (e.name !== 'AbortError') console.error('Erro no stream de áudio:', e);
+        }
+    })();
+}
 
 function limparTextoParaAudio(textoMarkdown) {
     let texto = textoMarkdown.toString();
@@ -384,6 +479,8 @@ async function lerTexto(texto, botaoElemento) {
     if (audioAtual) {
         audioAtual.pause();
         audioAtual = null;
+        // Interrompe o download — o servidor cancela a síntese
+        if (ttsAbort) ttsAbort.abort();
         document.querySelectorAll('.botao-ler-texto').forEach(b => b.classList.remove('falando'));
     
         if (botaoElemento.classList.contains('tocando-agora')) {
@@ -398,34 +495,54 @@ async function lerTexto(texto, botaoElemento) {
     
     const textoLimpo = limparTextoParaAudio(texto);
     
+    const terminar = () => {
+        botaoElemento.classList.remove('falando');
+        botaoElemento.classList.remove('tocando-agora');
+        audioAtual = null;
+    };
+
     try {
         botaoElemento.classList.add('falando'); 
         botaoElemento.classList.add('tocando-agora');
+
+        const urlCache = urlsAudio.get(textoLimpo);
+        if (urlCache) {
+            const audio = new Audio(window.location.origin + urlCache);
+            audio.onended = terminar;
+            audioAtual = audio;
+            try {
+                await audio.play();
+                return;
+            } catch (e) {
+                // Clipe saiu do cache do servidor: sintetiza de novo
+                if (audioAtual !== audio) return;
+                urlsAudio.delete(textoLimpo);
+            }
+        }
     
-        const response = await fetch(window.location.origin + '/text/tts', {
+        ttsAbort = new AbortController();
+        const response = await fetch(window.location.origin + '/text/tts/stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ text: textoLimpo })
+            body: JSON.stringify({ text: textoLimpo }),
+            signal: ttsAbort.signal
         });
     
         if (!response.ok) throw new Error("Erro ao gerar áudio");
+        const urlAudio = response.headers.get('X-Audio-Url');
     
-        const blob = await response.blob();
-        const url = URL.createObjectURL(blob);
-        
-        audioAtual = new Audio(url);
+        audioAtual = new Audio();
+        await carregarAudioEmStream(response, audioAtual);
         
         audioAtual.onended = () => {
-            botaoElemento.classList.remove('falando');
-            botaoElemento.classList.remove('tocando-agora');
-            audioAtual = null;
+            if (urlAudio) urlsAudio.set(textoLimpo, urlAudio);
+            terminar();
         };
         
         audioAtual.play();
     
     } catch (error) {
         console.error("Erro no TTS:", error);
-        botaoElemento.classList.remove('falando');
-        botaoElemento.classList.remove('tocando-agora');
+        terminar();
     }
 }
\ No newline at end of file
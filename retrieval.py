@@ -0,0 +1,205 @@
+"""
+FMPConnect — Recuperação de itens da base de conhecimento (BM25)
+
+Em vez de despejar todos os itens ativos no prompt, mantém um índice léxico
+em memória e injeta apenas os itens mais relevantes para a pergunta,
+respeitando um orçamento de tokens.
+
+  - normalização pt-BR: minúsculas, remoção de acentos, stopwords e um
+    stemmer leve de sufixos (plurais, -ção/-ções, -mente, etc.)
+  - índice invertido atualizado incrementalmente a partir do log de
+    alterações do banco (database.get_knowledge_changes), que vale para
+    escritas feitas por qualquer processo
+"""
+
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+import database
+
+STOPWORDS = {
+    "a", "ao", "aos", "as", "com", "como", "da", "das", "de", "do", "dos", "e",
+    "ela", "ele", "em", "entre", "era", "essa", "esse", "esta", "este", "eu",
+    "foi", "ha", "isso", "isto", "ja", "la", "lhe", "mais", "mas", "me", "meu",
+    "minha", "na", "nas", "nao", "no", "nos", "o", "os", "ou", "para", "pela",
+    "pelo", "por", "qual", "quais", "quando", "que", "quem", "se", "sem", "ser",
+    "seu", "sua", "sao", "so", "tem", "um", "uma", "voce", "onde", "sobre",
+    "esta", "estou", "posso", "pode", "fmp",
+}
+
+# Sufixos removidos do maior para o menor (após a remoção de acentos)
+_SUFIXOS = (
+    "amentos", "imentos", "amento", "imento", "acoes", "icoes", "mente",
+    "acao", "icao", "coes", "cao", "idades", "idade", "ismos", "ismo",
+    "istas", "ista", "aveis", "ivel", "avel", "ivos", "ivas", "ivo", "iva",
+    "oes", "aes", "ais", "eis", "res", "es", "as", "os", "s", "a", "o", "e",
+)
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def dobrar_acentos(texto: str) -> str:
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def stem(palavra: str) -> str:
+    for sufixo in _SUFIXOS:
+        if len(palavra) - len(sufixo) >= 3 and palavra.endswith(sufixo):
+            return palavra[: -len(sufixo)]
+    return palavra
+
+
+@lru_cache(maxsize=200_000)
+def _normalizar_palavra(palavra: str) -> str | None:
+    palavra = dobrar_acentos(palavra)
+    if len(palavra) < 2 or palavra in STOPWORDS or not palavra.isascii():
+        return None
+    return stem(palavra)
+
+
+def tokenizar(texto: str) -> list[str]:
+    termos = []
+    for palavra in _TOKEN_RE.findall(texto.lower()):
+        termo = _normalizar_palavra(palavra)
+        if termo:
+            termos.append(termo)
+    return termos
+
+
+def estimar_tokens(texto: str) -> int:
+    """Estimativa local de tokens do Gemini (~4 caracteres por token em pt-BR)."""
+    return len(texto) // 4 + 1
+
+
+class IndiceBM25:
+    """Índice invertido BM25 com atualização incremental por item."""
+
+    TITULO_PESO = 3
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.version = None
+        self._postings = defaultdict(dict)   # termo -> {item_id: tf}
+        self._doc_len = {}                   # item_id -> nº de termos
+        self._total_len = 0
+        self._items = {}                     # item_id -> item (dict)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def _termos(self, item: dict) -> Counter:
+        termos = Counter(tokenizar(item["content"]))
+        termos.update(tokenizar(item["category"]))
+        for t in tokenizar(item["title"]):
+            termos[t] += self.TITULO_PESO
+        return termos
+
+    def remover(self, item_id: int):
+        with self._lock:
+            item = self._items.pop(item_id, None)
+            if item is None:
+                return
+            for termo in self._termos(item):
+                docs = self._postings.get(termo)
+                if docs is not None:
+                    docs.pop(item_id, None)
+                    if not docs:
+                        del self._postings[termo]
+            self._total_len -= self._doc_len.pop(item_id, 0)
+
+    def adicionar(self, item: dict):
+        with self._lock:
+            self.remover(item["id"])
+            if not item.get("active", 1):
+                return
+            termos = self._termos(item)
+            for termo, tf in termos.items():
+                self._postings[termo][item["id"]] = tf
+            tamanho = sum(termos.values())
+            self._doc_len[item["id"]] = tamanho
+            self._total_len += tamanho
+            self._items[item["id"]] = item
+
+    def reconstruir(self, itens: list[dict], version=None):
+        with self._lock:
+            self._postings.clear()
+            self._doc_len.clear()
+            self._items.clear()
+            self._total_len = 0
+            for item in itens:
+                self.adicionar(item)
+            self.version = version
+
+    def sincronizar(self):
+        """Aplica as escritas ocorridas desde a última versão indexada."""
+        version = database.get_knowledge_version()
+        if self.version == version:
+            return
+        with self._lock:
+            if self.version == version:
+                return
+            alterados = None if self.version is None else database.get_knowledge_changes(self.version)
+            if alterados is None:
+                self.reconstruir(database.get_knowledge_items(active_only=True), version)
+                return
+            encontrados = database.get_knowledge_items_by_ids(alterados)
+            for item in encontrados:
+                self.adicionar(item)
+            for item_id in alterados - {i["id"] for i in encontrados}:
+                self.remover(item_id)
+            self.version = version
+
+    def buscar(self, consulta: str, k: int = 8) -> list[tuple[float, dict]]:
+        termos = set(tokenizar(consulta))
+        with self._lock:
+            n = len(self._items)
+            if not n or not termos:
+                return []
+            media = self._total_len / n
+            scores = defaultdict(float)
+            for termo in termos:
+                docs = self._postings.get(termo)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                for item_id, tf in docs.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_len[item_id] / media)
+                    scores[item_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+            melhores = heapq.nlargest(k, scores.items(), key=lambda s: s[1])
+            return [(score, self._items[item_id]) for item_id, score in melhores]
+
+
+indice = IndiceBM25()
+
+
+def montar_secao_conhecimento(consulta: str, top_k: int = 8, token_budget: int = 1500) -> str:
+    """
+    Seção "INFORMAÇÕES ADICIONAIS" com os itens mais relevantes para a
+    consulta, no mesmo formato de database.build_dynamic_system_instruction.
+    """
+    indice.sincronizar()
+    categorias = {}
+    usados = 0
+    for _, item in indice.buscar(consulta, top_k):
+        linha = f"- {item['title']}: {item['content']}\n"
+        custo = estimar_tokens(linha)
+        if usados + custo > token_budget:
+            continue
+        usados += custo
+        categorias.setdefault(item["category"], []).append(linha)
+
+    if not categorias:
+        return ""
+
+    extra = "\n\n📋 INFORMAÇÕES ADICIONAIS (Atualizadas pela Secretaria Acadêmica):\n"
+    for cat, linhas in categorias.items():
+        extra += f"\n[{cat.upper()}]\n" + "".join(linhas)
+    return extra
@@ -3,18 +3,25 @@ FMPConnect — Módulo RPA (Robotic Process Automation)
 
 Funções:
   1. scrape_site_fmp()  — Raspa notícias/avisos do site oficial da FMP e retorna lista de itens
+     (raspar_site_fmp() devolve também o relatório das páginas buscadas)
   2. ler_emails_feedback(config) — Lê e-mails de uma caixa de feedback via IMAP
   3. importar_para_base(itens, user_id) — Insere itens novos na base de conhecimento do banco
 """
 
+import os
 import re
 import imaplib
 import email
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from email.header import decode_header
 from datetime import datetime
+from urllib.parse import urlsplit
 
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
 import database
 
@@ -23,6 +30,13 @@ import database
 # ──────────────────────────────────────────────────────────────────────────────
 
 FMP_BASE = "https://fmpsc.edu.br"
+FMP_PAGINAS = ["/editais", "/processo-seletivo", "/noticias", "/avisos"]
+
+# As páginas são buscadas em paralelo, no máximo RPA_MAX_PER_HOST por host;
+# o que não chegar em RPA_DEADLINE segundos fica de fora (resultado parcial)
+RPA_MAX_PER_HOST = int(os.environ.get("RPA_MAX_PER_HOST", 4))
+RPA_DEADLINE = float(os.environ.get("RPA_DEADLINE", 20))
+RPA_TIMEOUT = float(os.environ.get("RPA_TIMEOUT", 10))
 
 _HEADERS = {
     "User-Agent": (
@@ -33,30 +47,92 @@ _HEADERS = {
 }
 
 
-def _fetch(url: str, timeout: int = 15) -> BeautifulSoup | None:
-    """Faz GET e devolve BeautifulSoup ou None em caso de erro."""
+def _nova_sessao() -> requests.Session:
+    sessao = requests.Session()
+    sessao.headers.update(_HEADERS)
+    adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=RPA_MAX_PER_HOST)
+    sessao.mount("http://", adaptador)
+    sessao.mount("https://", adaptador)
+    return sessao
+
+
+# Sessão compartilhada: conexões keep-alive reaproveitadas entre páginas e entre raspagens
+_sessao = _nova_sessao()
+_limites_host = {}
+_limites_lock = threading.Lock()
+
+
+def _limite_host(url: str) -> threading.BoundedSemaphore:
+    host = urlsplit(url).netloc
+    with _limites_lock:
+        limite = _limites_host.get(host)
+        if limite is None:
+            limite = _limites_host[host] = threading.BoundedSemaphore(RPA_MAX_PER_HOST)
+        return limite
+
+
+def _fetch(url: str, timeout: float = RPA_TIMEOUT, prazo: float | None = None) -> BeautifulSoup | None:
+    """
+    Faz GET pela sessão compartilhada e devolve BeautifulSoup, ou None em caso
+    de erro. `prazo` (time.monotonic) limita também a espera pela vaga do host.
+    """
+    limite = _limite_host(url)
+    restante = timeout if prazo is None else min(timeout, prazo - time.monotonic())
+    if restante <= 0 or not limite.acquire(timeout=restante):
+        print(f"[RPA] Prazo esgotado antes de buscar {url}")
+        return None
     try:
-        resp = requests.get(url, headers=_HEADERS, timeout=timeout)
+        if prazo is not None:
+            restante = min(timeout, prazo - time.monotonic())
+        resp = _sessao.get(url, timeout=max(restante, 0.1))
         resp.raise_for_status()
         return BeautifulSoup(resp.text, "html.parser")
     except Exception as exc:
         print(f"[RPA] Erro ao acessar {url}: {exc}")
         return None
+    finally:
+        limite.release()
 
 
-def scrape_site_fmp() -> list[dict]:
+def _buscar_paginas(urls: list[str], prazo: float) -> dict:
+    """Busca as páginas em paralelo; {url: BeautifulSoup ou None}. O que não chegar até o prazo vira None."""
+    limite = time.monotonic() + prazo
+    executor = ThreadPoolExecutor(max_workers=len(urls), thread_name_prefix="rpa")
+    futuros = {executor.submit(_fetch, url, RPA_TIMEOUT, limite): url for url in urls}
+    prontos, pendentes = wait(futuros, timeout=prazo)
+    # Não espera quem passou do prazo: a thread termina sozinha no timeout do GET
+    executor.shutdown(wait=False, cancel_futures=True)
+    if pendentes:
+        print(f"[RPA] Prazo de {prazo:g}s esgotado: {len(pendentes)} página(s) ficaram de fora")
+    return {url: futuro.result() if futuro in prontos else None for futuro, url in futuros.items()}
+
+
+def scrape_site_fmp(prazo: float | None = None) -> list[dict]:
     """
     Raspa o site da FMP procurando notícias, avisos e editais.
     Retorna lista de dicts: {category, title, content, url}
     """
-    resultados = []
+    return raspar_site_fmp(prazo)[0]
 
-    soup = _fetch(FMP_BASE)
-    if not soup:
-        return resultados
 
+def raspar_site_fmp(prazo: float | None = None) -> tuple[list[dict], dict]:
+    """
+    Como scrape_site_fmp(), buscando a página inicial e as de FMP_PAGINAS ao
+    mesmo tempo. Páginas com erro ou fora do prazo são puladas; devolve
+    (itens, relatório {"paginas", "falhas", "ms"}).
+    """
+    inicio = time.perf_counter()
+    resultados = []
+    urls = [FMP_BASE] + [FMP_BASE + path for path in FMP_PAGINAS]
+    paginas = _buscar_paginas(urls, RPA_DEADLINE if prazo is None else prazo)
+    relatorio = {
+        "paginas": len(urls),
+        "falhas": [url for url, soup in paginas.items() if soup is None],
+    }
+
+    soup = paginas[FMP_BASE]
     # --- Notícias / posts na página inicial ---
-    artigos = soup.select("article, .post, .entry, .news-item, .card")
+    artigos = soup.select("article, .post, .entry, .news-item, .card") if soup else []
     for art in artigos:
         titulo_el = art.select_one("h1, h2, h3, .title, .entry-title, .post-title")
         if not titulo_el:
@@ -87,8 +163,8 @@ def scrape_site_fmp() -> list[dict]:
         })
 
     # --- Tenta também a página de editais/processos seletivos ---
-    for path in ["/editais", "/processo-seletivo", "/noticias", "/avisos"]:
-        sub = _fetch(FMP_BASE + path)
+    for path in FMP_PAGINAS:
+        sub = paginas[FMP_BASE + path]
         if not sub:
             continue
         for item in sub.select("article, .post, li.edital, .item-edital"):
@@ -119,8 +195,10 @@ def scrape_site_fmp() -> list[dict]:
             vistos.add(chave)
             unicos.append(r)
 
-    print(f"[RPA] {len(unicos)} itens encontrados no site da FMP.")
-    return unicos
+    relatorio["ms"] = round((time.perf_counter() - inicio) * 1000)
+    print(f"[RPA] {len(unicos)} itens encontrados no site da FMP "
+          f"({len(urls) - len(relatorio['falhas'])}/{len(urls)} páginas em {relatorio['ms']} ms).")
+    return unicos, relatorio
 
 
 def _detectar_categoria(texto: str) -> str:
@@ -258,41 +336,39 @@ def emails_para_itens_conhecimento(emails: list[dict]) -> list[dict]:
 def importar_para_base(itens: list[dict], user_id: int = 1) -> dict:
     """
     Recebe lista de {category, title, content} e insere no banco,
-    ignorando títulos que já existem (evita duplicatas).
+    ignorando títulos que já existem, sem diferenciar maiúsculas (evita duplicatas).
     Retorna {'inseridos': N, 'ignorados': M}
     """
     if not itens:
         return {"inseridos": 0, "ignorados": 0}
 
-    conn = database.get_db()
     inseridos = 0
     ignorados = 0
 
-    for item in itens:
-        categoria = (item.get("category") or "Geral").strip()
-        titulo = (item.get("title") or "").strip()
-        conteudo = (item.get("content") or "").strip()
+    with database.transacao() as conn:
+        for item in itens:
+            categoria = (item.get("category") or "Geral").strip()
+            titulo = (item.get("title") or "").strip()
+            conteudo = (item.get("content") or "").strip()
 
-        if not titulo or not conteudo:
-            ignorados += 1
-            continue
+            if not titulo or not conteudo:
+                ignorados += 1
+                continue
 
-        existe = conn.execute(
-            "SELECT id FROM knowledge_items WHERE title=?", (titulo,)
-        ).fetchone()
+            existe = conn.execute(
+                "SELECT id FROM knowledge_items WHERE lower(trim(title)) = lower(?)", (titulo,)
+            ).fetchone()
 
-        if existe:
-            ignorados += 1
-            continue
+            if existe:
+                ignorados += 1
+                continue
 
-        conn.execute(
-            "INSERT INTO knowledge_items (category, title, content, created_by) VALUES (?, ?, ?, ?)",
-            (categoria, titulo, conteudo, user_id),
-        )
-        inseridos += 1
+            conn.execute(
+                "INSERT INTO knowledge_items (category, title, content, created_by) VALUES (?, ?, ?, ?)",
+                (categoria, titulo, conteudo, user_id),
+            )
+            inseridos += 1
 
-    conn.commit()
-    conn.close()
     print(f"[RPA] Importados: {inseridos} | Ignorados (duplicatas): {ignorados}")
     return {"inseridos": inseridos, "ignorados": ignorados}
 
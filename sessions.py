@@ -0,0 +1,176 @@
+"""
+FMPConnect — Sessões de chat no servidor
+
+Com uma sessão, o cliente envia só `session_id` + a pergunta; o histórico fica
+no servidor e o payload de cada requisição tem tamanho constante.
+
+  - MemorySessionStore: em memória, com TTL de inatividade e teto de memória
+    (descarta as sessões usadas há mais tempo)
+  - SQLiteSessionStore: mesmas operações sobre o SQLite, sobrevive a
+    reinícios e é compartilhada entre workers
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import database
+
+
+def novo_id() -> str:
+    return uuid.uuid4().hex
+
+
+class MemorySessionStore:
+    """Sessões em memória com expiração por inatividade e limite de bytes."""
+
+    def __init__(self, idle_ttl: float = 1800, max_bytes: int = 50 * 1024 * 1024, max_mensagens: int = 100):
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.max_mensagens = max_mensagens
+        self.expiradas = 0
+        self.descartadas = 0
+        self._sessoes = OrderedDict()   # id -> {"history": [...], "bytes": n, "acesso": t}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _expirar(self, agora):
+        while self._sessoes:
+            sid, sessao = next(iter(self._sessoes.items()))
+            if agora - sessao["acesso"] < self.idle_ttl:
+                break
+            self._remover(sid)
+            self.expiradas += 1
+
+    def _remover(self, sid):
+        sessao = self._sessoes.pop(sid, None)
+        if sessao:
+            self._bytes -= sessao["bytes"]
+
+    def criar(self) -> str:
+        sid = novo_id()
+        with self._lock:
+            self._expirar(time.monotonic())
+            self._sessoes[sid] = {"history": [], "bytes": 0, "acesso": time.monotonic()}
+        return sid
+
+    def obter(self, sid: str) -> list[dict] | None:
+        """Histórico da sessão, ou None se ela não existe ou expirou."""
+        with self._lock:
+            agora = time.monotonic()
+            self._expirar(agora)
+            sessao = self._sessoes.get(sid)
+            if sessao is None:
+                return None
+            sessao["acesso"] = agora
+            self._sessoes.move_to_end(sid)
+            return list(sessao["history"])
+
+    def anexar(self, sid: str, mensagens: list[dict]) -> bool:
+        with self._lock:
+            sessao = self._sessoes.get(sid)
+            if sessao is None:
+                return False
+            sessao["history"].extend(mensagens)
+            del sessao["history"][:-self.max_mensagens]
+            tamanho = sum(len(m["content"]) for m in sessao["history"])
+            self._bytes += tamanho - sessao["bytes"]
+            sessao["bytes"] = tamanho
+            sessao["acesso"] = time.monotonic()
+            self._sessoes.move_to_end(sid)
+            while self._bytes > self.max_bytes and len(self._sessoes) > 1:
+                antiga = next(iter(self._sessoes))
+                self._remover(antiga)
+                self.descartadas += 1
+            return True
+
+    def remover(self, sid: str):
+        with self._lock:
+            self._remover(sid)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessoes": len(self._sessoes),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "expiradas": self.expiradas,
+                "descartadas": self.descartadas,
+            }
+
+
+class SQLiteSessionStore:
+    """Sessões nas tabelas chat_sessions/chat_session_messages (migração 7 em database.MIGRACOES)."""
+
+    def __init__(self, idle_ttl: float = 1800, max_mensagens: int = 100):
+        self.idle_ttl = idle_ttl
+        self.max_mensagens = max_mensagens
+
+    def _limpar(self, conn):
+        limite = time.time() - self.idle_ttl
+        conn.execute(
+            '''DELETE FROM chat_session_messages WHERE session_id IN (
+                   SELECT id FROM chat_sessions WHERE last_access < ?)''',
+            (limite,),
+        )
+        conn.execute("DELETE FROM chat_sessions WHERE last_access < ?", (limite,))
+
+    def criar(self) -> str:
+        sid = novo_id()
+        with database.transacao() as conn:
+            self._limpar(conn)
+            conn.execute(
+                "INSERT INTO chat_sessions (id, last_access) VALUES (?, ?)", (sid, time.time())
+            )
+        return sid
+
+    def obter(self, sid: str) -> list[dict] | None:
+        with database.transacao() as conn:
+            cursor = conn.execute(
+                "UPDATE chat_sessions SET last_access=? WHERE id=? AND last_access >= ?",
+                (time.time(), sid, time.time() - self.idle_ttl),
+            )
+            if cursor.rowcount == 0:
+                return None
+            rows = conn.execute(
+                "SELECT role, content FROM chat_session_messages WHERE session_id=? ORDER BY seq",
+                (sid,),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def anexar(self, sid: str, mensagens: list[dict]) -> bool:
+        with database.transacao() as conn:
+            if not conn.execute("SELECT 1 FROM chat_sessions WHERE id=?", (sid,)).fetchone():
+                return False
+            conn.executemany(
+                "INSERT INTO chat_session_messages (session_id, role, content) VALUES (?, ?, ?)",
+                [(sid, m["role"], m["content"]) for m in mensagens],
+            )
+            conn.execute(
+                '''DELETE FROM chat_session_messages WHERE session_id=? AND seq NOT IN (
+                       SELECT seq FROM chat_session_messages WHERE session_id=?
+                       ORDER BY seq DESC LIMIT ?)''',
+                (sid, sid, self.max_mensagens),
+            )
+            conn.execute("UPDATE chat_sessions SET last_access=? WHERE id=?", (time.time(), sid))
+        return True
+
+    def remover(self, sid: str):
+        with database.transacao() as conn:
+            conn.execute("DELETE FROM chat_session_messages WHERE session_id=?", (sid,))
+            conn.execute("DELETE FROM chat_sessions WHERE id=?", (sid,))
+
+    def stats(self) -> dict:
+        conn = database.get_db()
+        total = conn.execute("SELECT COUNT(*) FROM chat_sessions").fetchone()[0]
+        conn.close()
+        return {"backend": "sqlite", "sessoes": total}
+
+
+def criar_store(backend: str = "memory", **kwargs):
+    if backend == "sqlite":
+        kwargs.pop("max_bytes", None)
+        return SQLiteSessionStore(**kwargs)
+    return MemorySessionStore(**kwargs)
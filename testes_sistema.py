@@ -178,6 +178,306 @@ has_error = (isinstance(data, dict) and data.get("error")) or status >= 400
 if has_error: ok("Chat sem prompt retorna erro esperado")
 else: warn("Chat sem prompt não retornou erro claro")
 
+status, _ = req_post("/text/chat", {"prompt": "Oi", "mode": ["surdez"]})
+if status != 500: ok(f"Chat com modo inválido é tratado como normal (HTTP {status})")
+else: fail("Chat com modo não-texto retornou 500")
+
+status, data = req_post("/text/session")
+sessao_id = data.get("session_id", "") if isinstance(data, dict) else ""
+if status == 201 and sessao_id: ok(f"Sessão de chat criada ({sessao_id[:8]}...)")
+else: fail(f"/text/session retornou {status}: {data}")
+
+status, _ = req_post("/text/chat", {"prompt": "Oi", "session_id": "sessao-inexistente"})
+if status == 404: ok("Chat com sessão inexistente retorna 404")
+else: fail(f"Chat com sessão inexistente retornou {status}")
+
+# ────────────────────────────────────────────────────
+sec("CLIENTE GEMINI — STUB LOCAL")
+
+import threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import gemini, urllib3
+
+class _StubGemini(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    conexoes = 0
+    roteiro = []  # status a devolver nas próximas requisições (200 quando vazio)
+    def setup(self):
+        type(self).conexoes += 1
+        super().setup()
+    def log_message(self, *a): pass
+    caches_criados = 0
+    falhar_cache = False
+    pedidos = 0
+    atraso = 0
+    def _responder(self, status, obj):
+        b = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(b)))
+        self.end_headers()
+        self.wfile.write(b)
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        cls = type(self)
+        if self.path.startswith("/v1beta/cachedContents"):
+            if cls.falhar_cache:
+                return self._responder(400, {"error": {"message": "Cached content is too small"}})
+            cls.caches_criados += 1
+            return self._responder(200, {"name": f"cachedContents/c{cls.caches_criados}"})
+        cls.pedidos += 1
+        time.sleep(cls.atraso)
+        status = cls.roteiro.pop(0) if cls.roteiro else 200
+        self._responder(status, {"candidates": [{"content": {"parts": [{"text": "ok"}]}}]})
+    def do_PATCH(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._responder(200, {"name": self.path.split("?")[0].lstrip("/v1beta/")})
+
+_stub = ThreadingHTTPServer(("127.0.0.1", 0), _StubGemini)
+threading.Thread(target=_stub.serve_forever, daemon=True).start()
+_stub_url = f"http://127.0.0.1:{_stub.server_address[1]}/v1beta"
+
+_cli = gemini.GeminiClient(_stub_url, "k", pool_size=2, backoff_base=0.01)
+for _ in range(5): _cli.post_json("m:generateContent", {})
+if _StubGemini.conexoes == 1: ok("Keep-alive: 5 requisições em 1 conexão")
+else: fail(f"Keep-alive não reutilizou conexão ({_StubGemini.conexoes} conexões)")
+
+_StubGemini.roteiro = [503, 429]
+try:
+    r = _cli.post_json("m:generateContent", {})
+    ok("Retentativa com backoff após 503/429 recuperou a resposta")
+except Exception as e:
+    fail(f"Retentativa falhou: {e}")
+
+_cli = gemini.GeminiClient(_stub_url, "k", read_timeout=0.2, backoff_base=0.01)
+_StubGemini.pedidos, _StubGemini.atraso = 0, 0.5
+try:
+    _cli.post_json("m:generateContent", {})
+    fail("Timeout de leitura não levantou erro")
+except urllib3.exceptions.ReadTimeoutError:
+    if _StubGemini.pedidos == 1: ok("Timeout de leitura não reenvia o POST (1 pedido ao upstream)")
+    else: fail(f"Timeout de leitura reenviou o POST ({_StubGemini.pedidos} pedidos)")
+_StubGemini.atraso = 0
+_cli = gemini.GeminiClient("http://127.0.0.1:1/v1beta", "k", backoff_base=0.01,
+                           breaker=gemini.CircuitBreaker(failure_threshold=10))
+try:
+    _cli.post_json("m:generateContent", {})
+    fail("Conexão recusada não levantou erro")
+except urllib3.exceptions.NewConnectionError:
+    if _cli.breaker._failures == 3: ok("Falha de conexão é retentada (3 tentativas) e depois propagada")
+    else: fail(f"Falha de conexão: {_cli.breaker._failures} tentativa(s)")
+
+_cli = gemini.GeminiClient(_stub_url, "k", max_retries=0,
+                           breaker=gemini.CircuitBreaker(failure_threshold=2, reset_timeout=0.2))
+_StubGemini.roteiro = [500, 500]
+for _ in range(2):
+    try: _cli.post_json("m:generateContent", {})
+    except gemini.GeminiHTTPError: pass
+t0 = time.perf_counter()
+try:
+    _cli.post_json("m:generateContent", {})
+    fail("Circuit breaker não abriu após falhas consecutivas")
+except gemini.CircuitOpenError:
+    ok(f"Circuit breaker aberto falha rápido ({(time.perf_counter()-t0)*1000:.1f} ms)")
+time.sleep(0.25)
+try:
+    _cli.post_json("m:generateContent", {})
+    if _cli.breaker.state == "closed": ok("Circuit breaker fecha após requisição de teste bem-sucedida")
+    else: fail(f"Circuit breaker ficou em '{_cli.breaker.state}'")
+except Exception as e:
+    fail(f"Requisição de teste (meio-aberto) falhou: {e}")
+
+_cc = gemini.ContextCache(gemini.GeminiClient(_stub_url, "k"), "m", ttl=1, refresh_margin=0.5)
+_n1 = _cc.get_name("instrução estática"); _n2 = _cc.get_name("instrução estática")
+if _n1 and _n1 == _n2 and _cc.criados == 1: ok(f"Cache de contexto criado uma vez e reutilizado ({_n1})")
+else: fail(f"Cache de contexto não reutilizado: {_n1}, {_n2}, {_cc.stats()}")
+time.sleep(0.6)
+if _cc.get_name("instrução estática") == _n1 and _cc.renovados == 1: ok("TTL do cache de contexto renovado perto de expirar")
+else: fail(f"Cache de contexto não renovado: {_cc.stats()}")
+if _cc.get_name("outra instrução") != _n1: ok("Texto diferente gera nova entrada de cache")
+else: fail("Texto diferente reutilizou a mesma entrada")
+
+_StubGemini.falhar_cache = True
+_cc = gemini.ContextCache(gemini.GeminiClient(_stub_url, "k"), "m", retry_after_failure=60)
+_criados = _StubGemini.caches_criados
+if _cc.get_name("instrução") is None and _cc.get_name("instrução") is None and _cc.falhas == 1:
+    ok("Falha ao criar cache cai para modo inline sem repetir a tentativa")
+else:
+    fail(f"Fallback do cache de contexto incorreto: {_cc.stats()}")
+_stub.shutdown()
+
+# ────────────────────────────────────────────────────
+sec("CACHE DE RESPOSTAS")
+
+import cache
+if cache.normalizar_pergunta("  A FMP é GRATUITA?! ") == cache.normalizar_pergunta("a fmp e gratuita"):
+    ok("Normalização ignora caixa, acentos, pontuação e espaços")
+else:
+    fail(f"Normalização inconsistente: {cache.normalizar_pergunta('A FMP é GRATUITA?!')!r}")
+
+_lru = cache.CacheLRU(max_itens=2, ttl=0.2)
+_lru.put("a", 1); _lru.put("b", 2); _lru.get("a"); _lru.put("c", 3)
+if _lru.get("b") is None and _lru.get("a") == 1: ok("LRU descarta o item menos usado ao atingir o limite")
+else: fail("LRU não respeitou o limite de itens")
+time.sleep(0.25)
+if _lru.get("a") is None: ok("Itens expiram após o TTL")
+else: fail("Item não expirou após o TTL")
+
+_voo = cache.SingleFlight()
+_upstream = []
+def _lenta():
+    _upstream.append(1); time.sleep(0.2); return "resposta"
+_res = []
+_ts = [threading.Thread(target=lambda: _res.append(_voo.executar("k", _lenta, timeout=5))) for _ in range(5)]
+for _t in _ts: _t.start()
+for _t in _ts: _t.join()
+if len(_upstream) == 1 and [r[0] for r in _res] == ["resposta"] * 5 and sum(r[1] for r in _res) == 4:
+    ok(f"SingleFlight: 5 pedidos idênticos, 1 chamada ao upstream ({_voo.stats()})")
+else:
+    fail(f"SingleFlight não coalesceu: upstream={len(_upstream)}, resultados={_res}")
+
+def _falha():
+    time.sleep(0.1); raise ValueError("upstream caiu")
+_erros = []
+def _pedir_falha():
+    try: _voo.executar("f", _falha, timeout=5)
+    except ValueError as e: _erros.append(str(e))
+_ts = [threading.Thread(target=_pedir_falha) for _ in range(3)]
+for _t in _ts: _t.start()
+for _t in _ts: _t.join()
+if _erros == ["upstream caiu"] * 3: ok("SingleFlight propaga o erro do líder para quem espera")
+else: fail(f"Erro não propagado: {_erros}")
+
+_lider, _ch = _voo.entrar("t")
+try:
+    _voo.executar("t", lambda: "x", timeout=0.1); fail("Espera sem timeout")
+except cache.EsperaExpirada:
+    ok("Quem espera desiste após o timeout")
+_voo.concluir("t", _ch, erro=cache.ChamadaAbandonada())
+if _voo.executar("t", lambda: "sozinho", timeout=1) == ("sozinho", False) and _voo.stats()["em_andamento"] == 0:
+    ok("Chamada abandonada pelo líder não fica presa")
+else:
+    fail(f"Chamada abandonada ficou presa: {_voo.stats()}")
+
+import admission
+def _lider_limitado():
+    time.sleep(0.1); raise admission.LimiteDoCliente(429, 1, "Muitas requisições deste cliente")
+_res = []
+def _pedir_limitado(fn):
+    try: _res.append(_voo.executar("l", fn, timeout=5, so_do_lider=admission.LimiteDoCliente)[0])
+    except admission.Rejeitado as e: _res.append(e.status)
+_ts = [threading.Thread(target=_pedir_limitado, args=(_lider_limitado,))]
+_ts[0].start(); time.sleep(0.02)
+_ts.append(threading.Thread(target=_pedir_limitado, args=(lambda: "própria",)))
+_ts[1].start()
+for _t in _ts: _t.join()
+if sorted(_res, key=str) == [429, "própria"]:
+    ok("Limite do cliente líder não é repassado a quem espera (segue com a própria chamada)")
+else:
+    fail(f"Limite do líder repassado: {_res}")
+
+status, data = req_get("/admin/cache", token=token)
+if status == 200 and "hits" in data.get("answers", {}) and "chamadas_economizadas" in data.get("coalescing", {}):
+    ok(f"/admin/cache expõe contadores ({data['answers']}, {data['coalescing']})")
+else: fail(f"/admin/cache retornou {status}: {data}")
+status, data = req_post("/admin/cache/flush", {}, token=token)
+if status == 200 and "removidos" in data: ok(f"/admin/cache/flush limpa o cache ({data['removidos']} itens)")
+else: fail(f"/admin/cache/flush retornou {status}: {data}")
+
+import conversas, database
+_log = conversas.RegistroConversas(max_fila=3, tamanho_lote=100, intervalo=60)
+_aceitos = [_log.registrar("autoteste", "normal", f"pergunta {i}", 10, 5.0, "MISS", 200, 200) for i in range(5)]
+_log.encerrar()
+_conn = database.get_db()
+_gravados = _conn.execute("SELECT COUNT(*) FROM conversation_log WHERE endpoint='autoteste'").fetchone()[0]
+_conn.execute("DELETE FROM conversation_log WHERE endpoint='autoteste'")
+_conn.commit()
+_conn.close()
+if _aceitos == [True] * 3 + [False] * 2 and _log.descartados == 2 and _gravados == 3:
+    ok("Registro de conversas: fila cheia descarta e conta; encerrar() grava o que faltava")
+else:
+    fail(f"Registro de conversas: aceitos={_aceitos}, gravados={_gravados}, {_log.stats()}")
+
+status, data = req_get("/admin/cache", token=token)
+_stats_log = data.get("chat_log", {}) if isinstance(data, dict) else {}
+if _stats_log.get("recebidos", 0) >= 1 and _stats_log.get("falhas") == 0:
+    ok(f"Conversas do chat registradas fora da requisição ({_stats_log})")
+else:
+    fail(f"Registro de conversas no servidor: {_stats_log}")
+
+import collections, estatisticas, random
+_rnd = random.Random(3)
+_lat = sorted(_rnd.lognormvariate(6.5, 0.8) for _ in range(20000))
+_estimados = estatisticas.percentis(collections.Counter(estatisticas.balde_latencia(v) for v in _lat))
+_exatos = {"p50": _lat[10000], "p90": _lat[18000], "p99": _lat[19800]}
+if all(abs(_estimados[q] - _exatos[q]) / _exatos[q] <= estatisticas.ALFA + 0.01 for q in _exatos):
+    ok(f"Sketch de latência: percentis com erro relativo ≤ {estatisticas.ALFA:.0%} ({_estimados})")
+else:
+    fail(f"Sketch de latência impreciso: estimados={_estimados}, exatos={_exatos}")
+
+time.sleep(float(os.environ.get("CHAT_LOG_FLUSH_S", 1.0)) + 0.5)
+status, data = req_get("/admin/stats?days=7", token=token)
+_total_chat = sum(m.get("total", 0) for m in data.get("por_modo", {}).values()) if isinstance(data, dict) else 0
+if status == 200 and _total_chat >= 1 and data.get("por_hora") and "top_perguntas" in data:
+    ok(f"/admin/stats responde dos resumos ({_total_chat} conversa(s), {data.get('ms')} ms)")
+else:
+    fail(f"/admin/stats retornou {status}: {data}")
+if status == 200 and set(data.get("por_modo", {})) <= {"normal", "surdez"}:
+    ok("Resumos só guardam os modos normal e surdez (modo do cliente é normalizado)")
+else:
+    fail(f"Modos inesperados nos resumos: {list(data.get('por_modo', {}))}")
+status, _ = req_get("/admin/stats?days=0", token=token)
+if status == 400: ok("/admin/stats com período inválido retorna 400")
+else: fail(f"/admin/stats?days=0 retornou {status}")
+
+# ────────────────────────────────────────────────────
+sec("CONTROLE DE ADMISSÃO")
+
+import admission
+_portao = admission.PortaoConcorrencia(max_concorrentes=1, max_fila=1, max_espera=0.2)
+_vaga = _portao.adquirir()
+_t0 = time.perf_counter()
+try:
+    _portao.adquirir(); fail("Portão admitiu acima do limite")
+except admission.Rejeitado as e:
+    _ms = (time.perf_counter() - _t0) * 1000
+    if e.status == 503 and e.retry_after >= 1 and 150 < _ms < 1000:
+        ok(f"Fila esgota o tempo máximo e rejeita com 503 ({_ms:.0f} ms, Retry-After {e.retry_after}s)")
+    else:
+        fail(f"Rejeição por tempo inesperada: {e.status}, {_ms:.0f} ms")
+
+_portao.max_espera = 2
+_ts = [threading.Thread(target=lambda: _portao.adquirir().liberar())]
+for _t in _ts: _t.start()
+time.sleep(0.05)
+try:
+    _t0 = time.perf_counter(); _portao.adquirir(); fail("Fila cheia não rejeitou")
+except admission.Rejeitado as e:
+    if (time.perf_counter() - _t0) < 0.05: ok("Fila cheia rejeita na hora")
+    else: fail("Rejeição por fila cheia demorou")
+_vaga.liberar(); _vaga.liberar()
+for _t in _ts: _t.join()
+_st = _portao.stats()
+if _st["em_uso"] == 0 and _st["rejeitadas_fila_cheia"] >= 1 and _st["rejeitadas_tempo_espera"] >= 1:
+    ok(f"Vagas devolvidas e métricas registradas ({_st})")
+else:
+    fail(f"Métricas do portão inconsistentes: {_st}")
+
+_lim = admission.LimitadorPorCliente(por_minuto=60, rajada=3)
+_codigos = []
+for _ in range(4):
+    try: _lim.consumir("a"); _codigos.append(200)
+    except admission.Rejeitado as e: _codigos.append(e.status)
+_lim.consumir("b")
+if _codigos == [200, 200, 200, 429]: ok("Token bucket permite a rajada e depois responde 429; outro cliente segue livre")
+else: fail(f"Token bucket incorreto: {_codigos}")
+
+status, data = req_get("/admin/upstream", token=token)
+if status == 200 and "na_fila" in data.get("concorrencia", {}) and "rejeitadas" in data.get("limite_por_cliente", {}):
+    ok(f"/admin/upstream expõe fila e rejeições ({data['concorrencia']['admitidas']} admitidas)")
+else:
+    fail(f"/admin/upstream retornou {status}: {data}")
+
 # ────────────────────────────────────────────────────
 sec("TTS — VOZ")
 
@@ -200,18 +500,204 @@ except Exception as e:
 
 ok("Voz pt-BR-AntonioNeural — mesma em chat.html e chat-voz.html (verificado em app.py)")
 
+try:
+    with urllib.request.urlopen(r, timeout=30) as res:
+        if res.headers.get("X-Cache") == "HIT" and res.headers.get("ETag"):
+            ok(f"Mesmo texto servido do cache de áudio (ETag {res.headers['ETag'][:14]}…)")
+        else:
+            fail(f"Segundo pedido de TTS não veio do cache (X-Cache={res.headers.get('X-Cache')})")
+except Exception as e:
+    warn(f"Cache de TTS não verificado (síntese indisponível): {e}")
+
+status, data = req_get("/text/tts/audio/" + "0" * 64 + ".mp3")
+if status == 404: ok("Clipe de áudio fora do cache retorna 404 (GET nunca sintetiza)")
+else: fail(f"Clipe inexistente retornou {status}")
+try:
+    with urllib.request.urlopen(r, timeout=30) as res:
+        _url = res.headers.get("X-Audio-Url")
+    with urllib.request.urlopen(BASE + _url, timeout=10) as res:
+        _etag, _cc, _total = res.headers.get("ETag"), res.headers.get("Cache-Control", ""), len(res.read())
+    _r = urllib.request.Request(BASE + _url, headers={"If-None-Match": _etag})
+    try:
+        urllib.request.urlopen(_r, timeout=10); _st = 200
+    except urllib.error.HTTPError as e:
+        _st = e.code
+    _r = urllib.request.Request(BASE + _url, headers={"Range": "bytes=0-99"})
+    with urllib.request.urlopen(_r, timeout=10) as res:
+        _parcial = (res.status, len(res.read()))
+    if "immutable" in _cc and _st == 304 and _parcial == (206, 100):
+        ok(f"GET do clipe por hash: cache longo, 304 com If-None-Match e 206 com Range ({_total} bytes)")
+    else:
+        fail(f"GET do clipe: Cache-Control={_cc!r}, If-None-Match={_st}, Range={_parcial}")
+except Exception as e:
+    warn(f"GET condicional do clipe não verificado (síntese indisponível): {e}")
+
+import tempfile, tts_cache
+_dir = tempfile.mkdtemp()
+open(os.path.join(_dir, "orfao.tmp"), "wb").write(b"x")
+_ac = tts_cache.CacheAudio(_dir, max_bytes=2500)
+if not os.path.exists(os.path.join(_dir, "orfao.tmp")): ok("Temporários órfãos removidos ao iniciar o cache de áudio")
+else: fail("Temporário órfão não foi removido")
+for _t in ("a", "b"):
+    _ac.gravar(tts_cache.chave_audio(_t, "v"), lambda d: open(d, "wb").write(b"x" * 1000))
+_ac.obter(tts_cache.chave_audio("a", "v"))
+_ac.gravar(tts_cache.chave_audio("c", "v"), lambda d: open(d, "wb").write(b"x" * 1000))
+if _ac.obter(tts_cache.chave_audio("b", "v")) is None and _ac.obter(tts_cache.chave_audio("a", "v")) and _ac.stats()["bytes"] <= 2500:
+    ok(f"Cache de áudio descarta o menos usado ao passar do teto ({_ac.stats()})")
+else:
+    fail(f"LRU do cache de áudio incorreta: {_ac.stats()}")
+def _sintese_falha(destino):
+    open(destino, "wb").write(b"meio arquivo"); raise RuntimeError("falha na síntese")
+try: _ac.gravar("falha", _sintese_falha)
+except RuntimeError: pass
+if not any(n.endswith(".tmp") for n in os.listdir(_dir)) and not os.path.exists(_ac.caminho("falha")):
+    ok("Falha na síntese não deixa arquivo temporário nem áudio parcial")
+else:
+    fail(f"Sobrou lixo no diretório do cache: {os.listdir(_dir)}")
+
 status, data = req_post("/text/tts", {"text": ""})
 if status >= 400 or (isinstance(data, dict) and data.get("error")):
     ok("TTS com texto vazio retorna erro")
 else:
     warn("TTS com texto vazio não retornou erro")
 
+import asyncio, concurrent.futures, tts_loop
+_lt = tts_loop.LoopTTS(max_concorrentes=2)
+_pico = [0, 0]
+async def _sintese(i):
+    _pico[0] += 1; _pico[1] = max(_pico[1], _pico[0])
+    await asyncio.sleep(0.05)
+    _pico[0] -= 1
+    return i
+_res = []
+_ts = [threading.Thread(target=lambda i=i: _res.append(_lt.executar(_sintese(i)))) for i in range(6)]
+for _t in _ts: _t.start()
+for _t in _ts: _t.join()
+if sorted(_res) == list(range(6)) and _pico[1] == 2: ok("Loop de TTS persistente executa as sínteses respeitando o limite de concorrência")
+else: fail(f"Loop de TTS: resultados={_res}, pico={_pico[1]}")
+_fechou = []
+async def _trechos():
+    try:
+        for i in range(100):
+            await asyncio.sleep(0.01); yield i
+    finally:
+        _fechou.append(True)
+_it = _lt.iterar(_trechos)
+next(_it); next(_it); _it.close()
+time.sleep(0.05)
+if _fechou and _lt.stats()["canceladas"] == 1 and _lt.stats()["ativas"] == 0:
+    ok("Fechar o stream cancela a síntese no loop e devolve a vaga")
+else:
+    fail(f"Stream não cancelado: {_lt.stats()}")
+_lt.encerrar()
+# Espera pela vaga expirando justo quando ela é liberada: a vaga não pode ficar presa
+_lt1 = tts_loop.LoopTTS(max_concorrentes=1)
+_expiradas = 0
+for _ in range(200):
+    _lt1.agendar(asyncio.sleep(0.01))
+    _it = _lt1.iterar(_trechos, timeout=random.uniform(0.008, 0.014))
+    try:
+        next(_it)
+    except concurrent.futures.TimeoutError:
+        _expiradas += 1
+    _it.close()
+time.sleep(0.1)
+if _lt1.stats()["ativas"] == 0 and _lt1.stats()["aguardando"] == 0 and _lt1.executar(_sintese(7), timeout=1) == 7:
+    ok(f"Espera expirada pela vaga de TTS não prende a vaga ({_expiradas} de 200 expiraram)")
+else:
+    fail(f"Vaga de TTS presa após espera expirada: {_lt1.stats()}")
+_lt1.encerrar()
+try:
+    _lt.executar(_sintese(0)); fail("Loop encerrado ainda aceita trabalho")
+except RuntimeError:
+    ok("Loop de TTS encerra de forma limpa e recusa novas sínteses")
+
+status, data = req_post("/text/tts/stream", {"text": ""})
+if status == 400: ok("TTS em stream com texto vazio retorna 400")
+else: fail(f"TTS em stream com texto vazio retornou {status}")
+
+r = urllib.request.Request(BASE + "/text/tts/stream",
+    data=json.dumps({"text": "Olá! Como posso ajudar?"}).encode())
+r.add_header("Content-Type", "application/json")
+try:
+    with urllib.request.urlopen(r, timeout=30) as res:
+        _primeiro = res.read(1024)
+        if res.headers.get("Content-Type", "").startswith("audio/mpeg") and _primeiro:
+            ok(f"TTS em stream entrega os primeiros bytes ({len(_primeiro)} bytes, X-Cache={res.headers.get('X-Cache')})")
+        else:
+            fail(f"TTS em stream sem áudio ({res.headers.get('Content-Type')})")
+except Exception as e:
+    warn(f"TTS em stream não verificado (síntese indisponível): {e}")
+
+import voz
+_div = voz.DivisorFrases()
+_frases = []
+for _t in ["Olá! A matrícula é feita pe", "lo portal. Fale com o Dr. Silva", " às 14h.\n- **Item** um", "\nValor R$ 1.500,00"]:
+    _frases += _div.alimentar(_t)
+_frases += _div.finalizar()
+if _frases == ["Olá!", "A matrícula é feita pelo portal.", "Fale com o Dr. Silva às 14h.", "- **Item** um", "Valor R$ 1.500,00"]:
+    ok("Turno de voz divide a resposta em frases à medida que o texto chega")
+else:
+    fail(f"Divisão em frases incorreta: {_frases}")
+if voz.limpar_para_fala("- **Item** [site](http://x)") == "Item site": ok("Markdown removido antes da fala")
+else: fail(f"Limpeza para fala incorreta: {voz.limpar_para_fala('- **Item** [site](http://x)')!r}")
+
+status, data = req_post("/voice/turn", {})
+if status == 400: ok("/voice/turn sem prompt retorna 400")
+else: fail(f"/voice/turn sem prompt retornou {status}")
+
+_conn = database.get_db()
+_ultimo_log = _conn.execute("SELECT COALESCE(MAX(id), 0) FROM conversation_log").fetchone()[0]
+status, _ = req_post("/voice/turn", {"prompt": "Qual o horário da secretaria?"})
+time.sleep(1.5)  # o registro das conversas grava em lotes (CHAT_LOG_FLUSH_S)
+_row = _conn.execute("SELECT endpoint, status FROM conversation_log WHERE id > ? AND endpoint = 'voice'",
+                     (_ultimo_log,)).fetchone()
+_conn.close()
+if _row and _row["status"] == status:
+    ok(f"Turno de voz entra no registro das conversas (endpoint voice, status {_row['status']})")
+else:
+    fail(f"Turno de voz não registrado (HTTP {status}, registro={_row and dict(_row)})")
+
+import tts_warmer
+_ocupado = [True]
+_aq = tts_warmer.AquecedorTTS(tts_cache.CacheAudio(tempfile.mkdtemp()),
+    sintetizar=lambda t, d: open(d, "wb").write(b"mp3"), voz_tts="v",
+    ocupado=lambda: _ocupado[0], frases_fixas=["Oi! Como posso te ajudar?"], intervalo=0.001)
+_aq._sincronizar = lambda: None   # só as frases fixas, sem ler a base
+_aq.iniciar()
+time.sleep(0.2)
+_antes = _aq.sintetizadas
+_ocupado[0] = False
+time.sleep(0.3)
+_aq.encerrar()
+if _antes == 0 and _aq.sintetizadas == 2 and _aq.adiadas > 0:
+    ok("Pré-síntese espera o TTS ficar ocioso e depois aquece as frases fixas")
+else:
+    fail(f"Pré-síntese: antes={_antes}, depois={_aq.sintetizadas}, adiadas={_aq.adiadas}")
+
+status, data = req_get("/admin/tts/warm", token=token)
+if status == 200 and {"frases", "frases_em_cache", "cobertura", "na_fila"} <= set(data):
+    ok(f"/admin/tts/warm informa a cobertura ({data['frases_em_cache']}/{data['frases']} frases)")
+else:
+    fail(f"/admin/tts/warm retornou {status}: {data}")
+
 # ────────────────────────────────────────────────────
 sec("BASE DE CONHECIMENTO")
 
-status, data = req_get("/admin/knowledge", token=token)
-items = data.get("items", []) if isinstance(data, dict) else []
+items, _cursor, _paginas = [], None, 0
+while True:
+    status, data = req_get("/admin/knowledge?limit=10&fields=id,category,active"
+                           + (f"&cursor={_cursor}" if _cursor else ""), token=token)
+    if not isinstance(data, dict): break
+    items += data.get("items", [])
+    _paginas += 1
+    _cursor = data.get("next_cursor")
+    if not _cursor: break
 total = len(items)
+if total and len({i["id"] for i in items}) == total and "content" not in items[0]:
+    ok(f"Listagem paginada por cursor: {_paginas} página(s) de até 10, sem repetir itens nem enviar o conteúdo")
+else:
+    fail(f"Paginação da listagem: {total} itens, {len({i['id'] for i in items})} distintos")
 ativos = sum(1 for i in items if i.get("active"))
 cats = len(set(i["category"] for i in items))
 if total > 30: ok(f"{total} itens | {ativos} ativos | {cats} categorias")
@@ -244,6 +730,188 @@ if item_id:
     except Exception as e:
         fail(f"Desativar item: {e}")
 
+import database
+_conn = database.get_db()
+_modo = _conn.execute("PRAGMA journal_mode").fetchone()[0]
+_conn.close()
+_conn = database.get_db()
+if _modo == "wal" and database.pool.stats()["reutilizadas"] >= 1: ok("Banco em WAL e conexões reaproveitadas pelo pool")
+else: fail(f"SQLite: journal_mode={_modo}, pool={database.pool.stats()}")
+_conn.close()
+try:
+    with database.transacao() as _conn:
+        _conn.execute("INSERT INTO knowledge_items (category, title, content) VALUES ('AutoTeste', 'Rollback', 'x')")
+        raise RuntimeError("falha no meio da transação")
+except RuntimeError:
+    pass
+_conn = database.get_db()
+_sobrou = _conn.execute("SELECT COUNT(*) FROM knowledge_items WHERE title='Rollback'").fetchone()[0]
+_conn.close()
+if _sobrou == 0: ok("Exceção dentro de transacao() desfaz a escrita")
+else: fail("transacao() não fez rollback")
+
+_conn = database.get_db()
+_versao = database.schema_version(_conn)
+if _versao == database.MIGRACOES[-1][0]: ok(f"Schema na versão {_versao} (migrações aplicadas)")
+else: fail(f"Schema na versão {_versao}, esperado {database.MIGRACOES[-1][0]}")
+
+# Banco anterior às migrações, com títulos ativos repetidos: a migração 1
+# desativa os repetidos e lista os ids no log; a 7 cria as tabelas de sessão
+import contextlib, io, sqlite3
+_fd, _legado = tempfile.mkstemp(suffix=".db"); os.close(_fd)
+_cl = sqlite3.connect(_legado, isolation_level=None)
+_cl.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, created_at DATETIME)")
+_cl.execute("""CREATE TABLE knowledge_items (id INTEGER PRIMARY KEY, category TEXT, title TEXT, content TEXT,
+               created_by INTEGER, created_at DATETIME, updated_at DATETIME, active INTEGER DEFAULT 1)""")
+_cl.executemany("INSERT INTO knowledge_items (id, category, title, content) VALUES (?, 'A', ?, 'x')",
+                [(1, "Horário"), (2, "Outro"), (3, " horário "), (4, "Horário")])
+_saida = io.StringIO()
+with contextlib.redirect_stdout(_saida):
+    database.migrar(_cl)
+_ativos = [r[0] for r in _cl.execute("SELECT id FROM knowledge_items WHERE active=1 ORDER BY id")]
+_tabelas = {r[0] for r in _cl.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+_v_legado = database.schema_version(_cl)
+_cl.close()
+for _suf in ("", "-wal", "-shm"):
+    if os.path.exists(_legado + _suf): os.remove(_legado + _suf)
+if (_ativos == [1, 2] and "ids: 3, 4" in _saida.getvalue() and {"chat_sessions", "chat_session_messages"} <= _tabelas
+        and _v_legado == database.MIGRACOES[-1][0]):
+    ok("Migração de banco antigo lista os ids desativados por título repetido e cria as tabelas de sessão")
+else:
+    fail(f"Migração de banco antigo: ativos={_ativos}, versão={_v_legado}, log={_saida.getvalue()!r}")
+for _sql, _params, _indice in [
+    ("SELECT id FROM knowledge_items WHERE lower(trim(title)) = lower(?)", ("x",), "idx_knowledge_titulo"),
+    ("SELECT * FROM knowledge_items WHERE active=1 ORDER BY category, title", (), "idx_knowledge_ativos"),
+    ("SELECT ki.*, u.name as creator_name FROM knowledge_items ki LEFT JOIN users u "
+     "ON ki.created_by = u.id ORDER BY ki.updated_at DESC", (), "idx_knowledge_atualizacao"),
+    ("SELECT id, username FROM users ORDER BY created_at DESC", (), "idx_users_criacao"),
+]:
+    _plano = " | ".join(r[3] for r in _conn.execute("EXPLAIN QUERY PLAN " + _sql, _params))
+    if _indice in _plano and "TEMP B-TREE" not in _plano: ok(f"Plano usa {_indice}")
+    else: fail(f"Plano sem {_indice}: {_plano}")
+_conn.close()
+
+status, data = req_post("/admin/knowledge",
+    {"category": "AutoTeste", "title": "Título Duplicado", "content": "a"}, token=token)
+_dup_id = data.get("item", {}).get("id") if isinstance(data, dict) else None
+status, data = req_post("/admin/knowledge",
+    {"category": "AutoTeste", "title": "  título duplicado ", "content": "b"}, token=token)
+if status == 409: ok("Título repetido entre itens ativos é recusado (409)")
+else: fail(f"Título duplicado aceito: {status} {data}")
+if _dup_id:
+    req_post(f"/admin/knowledge/{_dup_id}", token=token, method="DELETE")
+
+status, data = req_post("/admin/knowledge", {"category": "AutoTeste", "title": "Rematrícula do auto teste",
+    "content": "Prazo de rematrícula para o semestre de inverno"}, token=token)
+_fts_id = data.get("item", {}).get("id") if isinstance(data, dict) else None
+status, data = req_get("/admin/knowledge/search?q=rematricula+invern&category=AutoTeste&active=1", token=token)
+_achados = data.get("items", []) if isinstance(data, dict) else []
+if status == 200 and _achados and _achados[0]["id"] == _fts_id and "<mark>" in _achados[0]["snippet"]:
+    ok(f"Busca FTS ignora acentos, casa prefixo e marca o trecho ({data.get('ms')} ms)")
+else:
+    fail(f"Busca FTS: {status} {data}")
+if _fts_id:
+    req_post(f"/admin/knowledge/{_fts_id}", {"category": "AutoTeste", "title": "Rematrícula do auto teste",
+        "content": "Texto trocado"}, token=token, method="PUT")
+    req_post(f"/admin/knowledge/{_fts_id}", token=token, method="DELETE")
+status, data = req_get("/admin/knowledge/search?q=invern&category=AutoTeste", token=token)
+_ids = [i["id"] for i in data.get("items", [])] if isinstance(data, dict) else []
+status2, data2 = req_get("/admin/knowledge/search?q=trocado&category=AutoTeste&active=0", token=token)
+_ids2 = [i["id"] for i in data2.get("items", [])] if isinstance(data2, dict) else []
+if _fts_id and _fts_id not in _ids and _fts_id in _ids2:
+    ok("Índice FTS acompanha edições (gatilhos) e filtra por status")
+else:
+    fail(f"Índice FTS desatualizado: antigo={_ids}, novo/inativo={_ids2}")
+status, data = req_get("/admin/knowledge/search?q=", token=token)
+if status == 400: ok("Busca sem termo retorna 400")
+else: fail(f"Busca sem termo retornou {status}")
+
+r = urllib.request.Request(BASE + "/admin/knowledge?limit=5")
+r.add_header("Authorization", f"Bearer {token}")
+with urllib.request.urlopen(r, timeout=10) as res:
+    _etag = res.headers.get("ETag", "")
+r.add_header("If-None-Match", _etag)
+try:
+    urllib.request.urlopen(r, timeout=10); _st = 200
+except urllib.error.HTTPError as e:
+    _st = e.code
+req_post(f"/admin/knowledge/{item_id}/restore", token=token)
+try:
+    urllib.request.urlopen(r, timeout=10); _st2 = 200
+except urllib.error.HTTPError as e:
+    _st2 = e.code
+req_post(f"/admin/knowledge/{item_id}", token=token, method="DELETE")
+if _etag.startswith('W/"') and _st == 304 and _st2 == 200:
+    ok("Listagem com ETag fraca: 304 sem alterações, 200 depois de uma escrita")
+else:
+    fail(f"ETag da listagem: etag={_etag!r}, sem alteração={_st}, após escrita={_st2}")
+
+# Escrita feita por outro processo (este script), como faria outro worker
+_v_antes = database.get_knowledge_version()
+with database.transacao() as _conn:
+    _conn.execute("UPDATE knowledge_items SET updated_at = CURRENT_TIMESTAMP WHERE id=?", (item_id,))
+_alterados = database.get_knowledge_changes(_v_antes)
+r = urllib.request.Request(BASE + "/admin/knowledge?limit=5")
+r.add_header("Authorization", f"Bearer {token}")
+with urllib.request.urlopen(r, timeout=10) as res:
+    _etag2 = res.headers.get("ETag", "")
+if _alterados == {item_id} and f"-{database.get_knowledge_version()}-" in _etag2:
+    ok("Log de alterações no banco: escrita de outro processo chega ao servidor como delta")
+else:
+    fail(f"Log de alterações: ids={_alterados}, etag={_etag2!r}, versão={database.get_knowledge_version()}")
+
+status, data = req_get("/admin/knowledge/stats", token=token)
+if status == 200 and data.get("total", 0) >= total and data.get("recentes"):
+    ok(f"Estatísticas do dashboard calculadas no servidor ({data['total']} itens, {len(data['categorias'])} categorias)")
+else:
+    fail(f"/admin/knowledge/stats retornou {status}: {data}")
+status, data = req_get("/admin/knowledge?cursor=invalido", token=token)
+if status == 400: ok("Cursor inválido retorna 400")
+else: fail(f"Cursor inválido retornou {status}")
+
+def _bulk(corpo, tipo):
+    r = urllib.request.Request(BASE + "/admin/knowledge/bulk", data=corpo.encode(), method="POST")
+    r.add_header("Content-Type", tipo)
+    r.add_header("Authorization", f"Bearer {token}")
+    try:
+        with urllib.request.urlopen(r, timeout=30) as res:
+            return res.status, json.loads(res.read())
+    except urllib.error.HTTPError as e:
+        return e.code, {}
+
+_linhas = [json.dumps({"category": "AutoTeste", "title": f"Importado em massa {i}", "content": "Lote"}) for i in range(3)]
+_v_antes = database.get_knowledge_version()
+status, data = _bulk("\n".join(_linhas + ['{"category": "AutoTeste"}', "não é json"]), "application/x-ndjson")
+if (status == 200 and data.get("inseridos", 0) + data.get("atualizados", 0) == 3
+        and [e["linha"] for e in data.get("erros", [])] == [4, 5]):
+    ok(f"Importação JSONL em massa com erros por linha ({data.get('ms')} ms)")
+else:
+    fail(f"Importação JSONL: {status} {data}")
+if database.get_knowledge_version() == _v_antes + 1 and database.get_knowledge_changes(_v_antes) is None:
+    ok("Importação em massa muda a versão da base uma única vez (recarga completa)")
+else:
+    fail(f"Importação em massa: versão {_v_antes} -> {database.get_knowledge_version()}")
+status, data = _bulk("category,title,content,active\n" + "".join(
+    f"AutoTeste,Importado em massa {i},Lote,0\n" for i in range(3)), "text/csv")
+if status == 200 and data.get("atualizados") == 3 and data.get("inseridos") == 0:
+    ok("Importação CSV atualiza pelo título (upsert)")
+else:
+    fail(f"Upsert via CSV: {status} {data}")
+status, _ = _bulk("titulo;conteudo\nx;y\n", "text/csv")
+if status == 400: ok("CSV sem as colunas obrigatórias retorna 400")
+else: fail(f"CSV sem colunas retornou {status}")
+
+r = urllib.request.Request(BASE + "/admin/knowledge/bulk?active=0")
+r.add_header("Authorization", f"Bearer {token}")
+with urllib.request.urlopen(r, timeout=30) as res:
+    _exportados = [json.loads(l) for l in res.read().decode("utf-8").splitlines() if l.strip()]
+    _tipo = res.headers.get("Content-Type", "")
+_titulos = {i["title"] for i in _exportados}
+if "ndjson" in _tipo and all(f"Importado em massa {i}" in _titulos for i in range(3)):
+    ok(f"Exportação JSONL em stream ({len(_exportados)} itens inativos)")
+else:
+    fail(f"Exportação JSONL: {_tipo} {len(_exportados)} itens")
+
 # ────────────────────────────────────────────────────
 sec("ACESSIBILIDADE")
 
@@ -291,6 +959,49 @@ if _rpa:
     if not missing_fn: ok(f"3 funções principais em rpa.py: {fns}")
     else: fail(f"Funções faltando: {missing_fn}")
 
+if _rpa:
+    # Site local: 5 páginas de 300 ms em paralelo (até 4 por host) e /avisos travado além do prazo
+    class _SiteFmp(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        simultaneas = maximo = 0
+        trava = threading.Lock()
+        def log_message(self, *a): pass
+        def do_GET(self):
+            cls = type(self)
+            with cls.trava:
+                cls.simultaneas += 1
+                cls.maximo = max(cls.maximo, cls.simultaneas)
+            time.sleep(3 if self.path == "/avisos" else 0.3)
+            with cls.trava:
+                cls.simultaneas -= 1
+            b = (f"<html><body><article><h2>Aviso de teste da página {self.path}</h2><p>x</p></article>"
+                 f"<li class='edital'><a>Edital de teste {self.path} 01/2025</a></li></body></html>").encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(b)))
+            self.end_headers()
+            try: self.wfile.write(b)
+            except OSError: pass
+    _site = ThreadingHTTPServer(("127.0.0.1", 0), _SiteFmp)
+    _site.daemon_threads = True
+    threading.Thread(target=_site.serve_forever, daemon=True).start()
+    _base_original = _rpa.FMP_BASE
+    _rpa.FMP_BASE = f"http://127.0.0.1:{_site.server_address[1]}"
+    try:
+        _t0 = time.perf_counter()
+        _itens, _rel = _rpa.raspar_site_fmp(prazo=1.5)
+        _dt = time.perf_counter() - _t0
+    finally:
+        _rpa.FMP_BASE = _base_original
+    if _dt < 2.0 and _rel["falhas"] == [f"http://127.0.0.1:{_site.server_address[1]}/avisos"]:
+        ok(f"Raspagem paralela respeita o prazo ({_dt:.2f}s) e devolve parcial ({len(_itens)} itens, /avisos de fora)")
+    else:
+        fail(f"Raspagem: {_dt:.2f}s, falhas={_rel['falhas']}")
+    if 1 < _SiteFmp.maximo <= _rpa.RPA_MAX_PER_HOST:
+        ok(f"Buscas simultâneas no mesmo host limitadas ({_SiteFmp.maximo} de no máximo {_rpa.RPA_MAX_PER_HOST})")
+    else:
+        fail(f"Simultâneas no mesmo host: {_SiteFmp.maximo} (limite {_rpa.RPA_MAX_PER_HOST})")
+    _site.shutdown()
+
 app_py = open("app.py", encoding="utf-8").read()
 if "rpa/scrape" in app_py and "rpa/emails" in app_py:
     ok("Rotas /admin/rpa/scrape e /admin/rpa/emails no backend")
@@ -318,6 +1029,7 @@ secoes = {
     "secao-minha-conta": "Minha Conta",
     "card-boas-vindas": "Boas-vindas para editores",
     "chart-categorias": "Gráfico de categorias",
+    "chart-uso-chat": "Uso do chat (estatísticas)",
     "admin-only": "Controle por papel (admin/editor)",
 }
 for key, label in secoes.items():
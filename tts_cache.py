@@ -0,0 +1,150 @@
+"""
+FMPConnect — Cache em disco dos áudios do TTS
+
+O modo voz fala as mesmas saudações e respostas frequentes o tempo todo.
+Cada áudio fica num arquivo nomeado pelo hash de (voz, texto); o diretório
+tem um teto de bytes e descarta primeiro os menos usados (LRU).
+
+A síntese grava num arquivo temporário dentro do próprio diretório e só
+então o renomeia para o nome final (os.replace é atômico), de modo que um
+leitor nunca vê um MP3 pela metade. O temporário é sempre removido se a
+síntese falhar. No TTS em stream, a cópia é gravada enquanto os trechos são
+enviados e só é publicada se o stream chegar ao fim.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+EXTENSAO = ".mp3"
+
+
+def chave_audio(texto: str, voz: str) -> str:
+    return hashlib.sha256(f"{voz}\n{texto}".encode("utf-8")).hexdigest()
+
+
+class CacheAudio:
+    """Cache LRU de arquivos de áudio em disco, limitado por tamanho total."""
+
+    def __init__(self, diretorio: str, max_bytes: int = 200 * 1024 * 1024):
+        self.diretorio = diretorio
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicoes = 0
+        self._arquivos = OrderedDict()   # chave -> tamanho (do menos para o mais recente)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(diretorio, exist_ok=True)
+        self._carregar()
+
+    def _carregar(self):
+        """Indexa o que já está no disco (ordem de uso = mtime) e apaga temporários órfãos."""
+        encontrados = []
+        for nome in os.listdir(self.diretorio):
+            caminho = os.path.join(self.diretorio, nome)
+            if nome.endswith(".tmp"):
+                try:
+                    os.remove(caminho)
+                except OSError:
+                    pass
+            elif nome.endswith(EXTENSAO):
+                st = os.stat(caminho)
+                encontrados.append((st.st_mtime, nome[:-len(EXTENSAO)], st.st_size))
+        for _, chave, tamanho in sorted(encontrados):
+            self._arquivos[chave] = tamanho
+            self._bytes += tamanho
+        self._evictar()
+
+    def caminho(self, chave: str) -> str:
+        return os.path.join(self.diretorio, chave + EXTENSAO)
+
+    def obter(self, chave: str) -> str | None:
+        """Caminho do áudio em cache, ou None."""
+        with self._lock:
+            if chave not in self._arquivos:
+                self.misses += 1
+                return None
+            self._arquivos.move_to_end(chave)
+            self.hits += 1
+        caminho = self.caminho(chave)
+        try:
+            os.utime(caminho)   # preserva a ordem LRU entre reinícios
+        except OSError:
+            pass
+        return caminho
+
+    def contem(self, chave: str) -> bool:
+        """Se o áudio está em cache, sem contar hit/miss nem mexer na ordem LRU."""
+        with self._lock:
+            return chave in self._arquivos
+
+    def novo_temporario(self) -> str:
+        """Arquivo temporário no diretório do cache, para `publicar` ou `descartar`."""
+        fd, temporario = tempfile.mkstemp(dir=self.diretorio, suffix=".tmp")
+        os.close(fd)
+        return temporario
+
+    def publicar(self, chave: str, temporario: str) -> str:
+        """Move um temporário completo para o nome final. Retorna o caminho final."""
+        try:
+            tamanho = os.path.getsize(temporario)
+            final = self.caminho(chave)
+            try:
+                os.replace(temporario, final)
+            except PermissionError:
+                # Windows: o arquivo final está aberto por outra requisição
+                # (mesmo conteúdo, sintetizado em paralelo) — fica o existente
+                pass
+        finally:
+            self.descartar(temporario)
+
+        with self._lock:
+            self._bytes += tamanho - self._arquivos.pop(chave, 0)
+            self._arquivos[chave] = tamanho
+            self._evictar()
+        return final
+
+    def descartar(self, temporario: str):
+        try:
+            os.remove(temporario)
+        except FileNotFoundError:
+            pass
+
+    def gravar(self, chave: str, sintetizar) -> str:
+        """
+        Chama `sintetizar(caminho_temporario)` e publica o resultado no cache.
+        Retorna o caminho final do áudio.
+        """
+        temporario = self.novo_temporario()
+        try:
+            sintetizar(temporario)
+        except BaseException:
+            self.descartar(temporario)
+            raise
+        return self.publicar(chave, temporario)
+
+    def _evictar(self):
+        while self._bytes > self.max_bytes and len(self._arquivos) > 1:
+            chave, tamanho = self._arquivos.popitem(last=False)
+            self._bytes -= tamanho
+            self.evicoes += 1
+            try:
+                os.remove(self.caminho(chave))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "itens": len(self._arquivos),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "evicoes": self.evicoes,
+            }
@@ -0,0 +1,211 @@
+"""
+FMPConnect — Event loop persistente para o edge-tts
+
+Em vez de criar e destruir um event loop asyncio a cada requisição de TTS,
+um único loop roda numa thread dedicada; as threads do Flask submetem as
+corrotinas com `run_coroutine_threadsafe` e esperam pelo resultado.
+
+  - executar(coro): roda uma corrotina (ex.: Communicate.save) e devolve o resultado
+  - agendar(coro): idem, sem bloquear; devolve um concurrent.futures.Future
+  - iterar(fabrica): consome um gerador assíncrono (ex.: Communicate.stream)
+    como gerador comum; fechá-lo cancela o gerador assíncrono
+  - no máximo `max_concorrentes` sínteses ao mesmo tempo (semáforo no loop)
+  - encerrar(): espera as sínteses em andamento por alguns segundos,
+    cancela o resto e fecha o loop
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+
+_FIM = object()
+
+
+class LoopTTS:
+    """Event loop asyncio de longa duração numa thread própria."""
+
+    def __init__(self, max_concorrentes: int = 4, timeout: float = 60.0):
+        self.max_concorrentes = max_concorrentes
+        self.timeout = timeout
+        self.ativas = 0
+        self.aguardando = 0
+        self.concluidas = 0
+        self.falhas = 0
+        self.canceladas = 0
+        self._fechado = False
+        self._loop = asyncio.new_event_loop()
+        self._pronto = threading.Event()
+        self._thread = threading.Thread(target=self._rodar, name="tts-loop", daemon=True)
+        self._thread.start()
+        self._pronto.wait()
+
+    def _rodar(self):
+        asyncio.set_event_loop(self._loop)
+        self._semaforo = asyncio.Semaphore(self.max_concorrentes)
+        self._pronto.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    # ── dentro do loop ──────────────────────────
+    async def _entrar(self):
+        self.aguardando += 1
+        try:
+            await self._semaforo.acquire()
+        finally:
+            self.aguardando -= 1
+        self.ativas += 1
+
+    def _sair(self, desfecho: str):
+        self.ativas -= 1
+        if desfecho == "concluida":
+            self.concluidas += 1
+        elif desfecho == "cancelada":
+            self.canceladas += 1
+        else:
+            self.falhas += 1
+        self._semaforo.release()
+
+    async def _limitado(self, coro):
+        try:
+            await self._entrar()
+        except BaseException:
+            coro.close()
+            raise
+        desfecho = "falha"
+        try:
+            resultado = await coro
+            desfecho = "concluida"
+            return resultado
+        except asyncio.CancelledError:
+            desfecho = "cancelada"
+            raise
+        finally:
+            self._sair(desfecho)
+
+    @staticmethod
+    async def _proximo(gerador):
+        try:
+            return await gerador.__anext__()
+        except StopAsyncIteration:
+            return _FIM
+
+    # ── chamado pelas threads do Flask ──────────
+    def _submeter(self, coro, timeout):
+        if self._fechado:
+            coro.close()
+            raise RuntimeError("Loop de TTS encerrado")
+        futuro = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return futuro.result(self.timeout if timeout is None else timeout)
+        except concurrent.futures.TimeoutError:
+            futuro.cancel()
+            raise
+
+    def _ocupar_vaga(self, timeout):
+        """Espera uma vaga de concorrência; se a espera expirar, a vaga nunca fica presa."""
+        estado = {"entrou": False, "desistiu": False}
+
+        async def entrar():
+            await self._entrar()
+            if estado["desistiu"]:
+                self._sair("cancelada")
+            else:
+                estado["entrou"] = True
+
+        def desistir():
+            # Roda no loop, na mesma fila de entrar(): devolve a vaga se ela já
+            # foi tomada, ou avisa entrar() para devolvê-la quando conseguir
+            if estado["entrou"]:
+                self._sair("cancelada")
+            else:
+                estado["desistiu"] = True
+
+        if self._fechado:
+            raise RuntimeError("Loop de TTS encerrado")
+        futuro = asyncio.run_coroutine_threadsafe(entrar(), self._loop)
+        try:
+            futuro.result(self.timeout if timeout is None else timeout)
+        except concurrent.futures.TimeoutError:
+            # cancel() não basta: entrar() pode ter pegado a vaga no mesmo instante
+            futuro.cancel()
+            if not self._loop.is_closed():
+                self._loop.call_soon_threadsafe(desistir)
+            raise
+
+    def executar(self, coro, timeout: float | None = None):
+        """Roda `coro` no loop (respeitando o limite de concorrência) e devolve o resultado."""
+        if self._fechado:
+            coro.close()
+            raise RuntimeError("Loop de TTS encerrado")
+        return self._submeter(self._limitado(coro), timeout)
+
+    def agendar(self, coro) -> concurrent.futures.Future:
+        """Submete `coro` sem esperar; cancelar o Future cancela a síntese."""
+        if self._fechado:
+            coro.close()
+            raise RuntimeError("Loop de TTS encerrado")
+        return asyncio.run_coroutine_threadsafe(self._limitado(coro), self._loop)
+
+    def iterar(self, fabrica, timeout: float | None = None):
+        """
+        Gerador síncrono sobre o gerador assíncrono criado por `fabrica()`.
+        A vaga de concorrência fica ocupada até o fim (ou o fechamento) do gerador.
+        """
+        self._ocupar_vaga(timeout)
+        gerador = None
+        desfecho = "falha"
+        try:
+            gerador = fabrica()
+            while True:
+                item = self._submeter(self._proximo(gerador), timeout)
+                if item is _FIM:
+                    break
+                yield item
+            desfecho = "concluida"
+        except GeneratorExit:
+            desfecho = "cancelada"   # quem consumia desistiu (ex.: cliente desconectou)
+            raise
+        finally:
+            if gerador is not None and not self._fechado:
+                try:
+                    self._submeter(gerador.aclose(), timeout)
+                except Exception:
+                    pass
+            if not self._loop.is_closed():
+                self._loop.call_soon_threadsafe(self._sair, desfecho)
+
+    def encerrar(self, timeout: float = 5.0):
+        """Espera até `timeout` pelas sínteses em andamento, cancela o resto e para o loop."""
+        if self._fechado or not self._thread.is_alive():
+            return
+        self._fechado = True
+
+        async def _parar():
+            atual = asyncio.current_task()
+            tarefas = [t for t in asyncio.all_tasks() if t is not atual]
+            if tarefas:
+                _, pendentes = await asyncio.wait(tarefas, timeout=timeout)
+                for tarefa in pendentes:
+                    tarefa.cancel()
+                await asyncio.gather(*pendentes, return_exceptions=True)
+            await self._loop.shutdown_asyncgens()
+
+        try:
+            asyncio.run_coroutine_threadsafe(_parar(), self._loop).result(timeout + 5)
+        except Exception as e:
+            print(f"[TTS] Falha ao encerrar o loop de TTS: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "max_concorrentes": self.max_concorrentes,
+            "ativas": self.ativas,
+            "aguardando": self.aguardando,
+            "concluidas": self.concluidas,
+            "falhas": self.falhas,
+            "canceladas": self.canceladas,
+            "ativo": self._thread.is_alive() and not self._fechado,
+        }
@@ -0,0 +1,155 @@
+"""
+FMPConnect — Pré-síntese do TTS em segundo plano
+
+As respostas mais comuns do modo voz repetem o conteúdo da base de
+conhecimento e algumas frases fixas. Um worker de baixa prioridade
+sintetiza essas frases no cache de áudio antes que alguém as peça.
+
+  - acompanha a versão da base (mesmo mecanismo do índice BM25): itens
+    criados/alterados pelo painel ou pelo RPA entram na fila sozinhos
+  - divide título e conteúdo em frases com as mesmas regras do /voice/turn,
+    de modo que as chaves do cache coincidam
+  - só sintetiza quando o TTS está ocioso, e no máximo uma frase a cada
+    `intervalo` segundos — nunca disputa com requisições ao vivo
+"""
+
+import threading
+from collections import OrderedDict
+
+import database
+import tts_cache
+import voz
+
+
+def dividir_frases(texto: str) -> list[str]:
+    """Frases faladas de um texto, já limpas do markdown (como no /voice/turn)."""
+    divisor = voz.DivisorFrases()
+    frases = divisor.alimentar(texto) + divisor.finalizar()
+    return [f for f in (voz.limpar_para_fala(f) for f in frases) if f]
+
+
+def frases_do_item(item: dict) -> list[str]:
+    return dividir_frases(f"{item['title']}\n{item['content']}")
+
+
+class AquecedorTTS:
+    """Fila de frases a pré-sintetizar, consumida por uma thread de baixa prioridade."""
+
+    def __init__(self, cache: tts_cache.CacheAudio, sintetizar, voz_tts: str, ocupado,
+                 frases_fixas=(), intervalo: float = 2.0, max_fila: int = 5000):
+        self.cache = cache
+        self.sintetizar = sintetizar       # sintetizar(texto, destino)
+        self.voz_tts = voz_tts
+        self.ocupado = ocupado             # () -> True se há síntese ao vivo
+        self.frases_fixas = [f for texto in frases_fixas for f in dividir_frases(texto)]
+        self.intervalo = intervalo
+        self.max_fila = max_fila
+        self.version = None
+        self.sintetizadas = 0
+        self.ja_em_cache = 0
+        self.falhas = 0
+        self.descartadas = 0
+        self.adiadas = 0
+        self._fila = OrderedDict()          # texto -> None (sem duplicatas, FIFO)
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        self.enfileirar(self.frases_fixas)
+        self._thread = threading.Thread(target=self._rodar, name="tts-warmer", daemon=True)
+        self._thread.start()
+
+    def encerrar(self):
+        self._parar.set()
+        self._acordar.set()
+
+    def avisar(self):
+        """Acorda o worker para olhar a base agora (ex.: logo após uma escrita)."""
+        self._acordar.set()
+
+    def enfileirar(self, frases):
+        with self._lock:
+            for frase in frases:
+                if frase in self._fila:
+                    continue
+                if len(self._fila) >= self.max_fila:
+                    self.descartadas += 1
+                    continue
+                self._fila[frase] = None
+        self._acordar.set()
+
+    def _sincronizar(self):
+        version = database.get_knowledge_version()
+        if version == self.version:
+            return
+        alterados = None if self.version is None else database.get_knowledge_changes(self.version)
+        if alterados is None:
+            itens = database.get_knowledge_items(active_only=True)
+        else:
+            itens = [i for i in database.get_knowledge_items_by_ids(alterados) if i["active"]]
+        self.version = version
+        for item in itens:
+            self.enfileirar(frases_do_item(item))
+
+    def _rodar(self):
+        while not self._parar.is_set():
+            try:
+                self._sincronizar()
+            except Exception as e:
+                print(f"[TTS-WARM] Falha ao ler a base: {e}")
+
+            with self._lock:
+                frase = next(iter(self._fila), None)
+            if frase is None:
+                self._acordar.wait(30)
+                self._acordar.clear()
+                continue
+            if self.ocupado():
+                self.adiadas += 1
+                self._parar.wait(self.intervalo)
+                continue
+
+            with self._lock:
+                self._fila.pop(frase, None)
+            chave = tts_cache.chave_audio(frase, self.voz_tts)
+            if self.cache.contem(chave):
+                self.ja_em_cache += 1
+                continue
+            try:
+                self.cache.gravar(chave, lambda destino: self.sintetizar(frase, destino))
+                self.sintetizadas += 1
+            except Exception as e:
+                self.falhas += 1
+                print(f"[TTS-WARM] Falha ao sintetizar: {e}")
+            self._parar.wait(self.intervalo)
+
+    def cobertura(self) -> dict:
+        """Quantas frases da base ativa (e das fixas) já estão no cache de áudio."""
+        frases = set(self.frases_fixas)
+        itens = database.get_knowledge_items(active_only=True)
+        itens_completos = 0
+        for item in itens:
+            do_item = frases_do_item(item)
+            frases.update(do_item)
+            if all(self.cache.contem(tts_cache.chave_audio(f, self.voz_tts)) for f in do_item):
+                itens_completos += 1
+        prontas = sum(1 for f in frases if self.cache.contem(tts_cache.chave_audio(f, self.voz_tts)))
+        with self._lock:
+            na_fila = len(self._fila)
+        return {
+            "frases": len(frases),
+            "frases_em_cache": prontas,
+            "cobertura": round(prontas / len(frases), 3) if frases else 1.0,
+            "itens": len(itens),
+            "itens_completos": itens_completos,
+            "na_fila": na_fila,
+            "sintetizadas": self.sintetizadas,
+            "ja_em_cache": self.ja_em_cache,
+            "falhas": self.falhas,
+            "adiadas": self.adiadas,
+            "descartadas": self.descartadas,
+            "intervalo_s": self.intervalo,
+            "ativo": self._thread is not None and self._thread.is_alive(),
+        }
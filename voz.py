@@ -0,0 +1,52 @@
+"""
+FMPConnect — Turno de voz: divisão da resposta em frases
+
+O /voice/turn sintetiza cada frase assim que ela fica completa no stream do
+Gemini, em vez de esperar a resposta inteira. Aqui ficam a divisão
+incremental em frases e a limpeza do markdown antes da fala (mesmas regras
+de `limparTextoParaAudio` no chat.js).
+"""
+
+import re
+
+# Pontuação final seguida de espaço, ou quebra de linha
+_FIM_DE_FRASE = re.compile(r"[.!?…]+[\"')\]]*\s+|\n+")
+_ABREVIACOES = {"sr", "sra", "dr", "dra", "prof", "profa", "av", "n", "nº", "tel", "ex"}
+
+_NEGRITO = re.compile(r"\*\*|\*")
+_LINK = re.compile(r"\[([^\]]+)\]\([^)]+\)")
+_TITULO = re.compile(r"^#+\s+", re.M)
+
+
+def limpar_para_fala(texto: str) -> str:
+    texto = _NEGRITO.sub("", texto)
+    texto = _LINK.sub(r"\1", texto)
+    texto = _TITULO.sub("", texto)
+    texto = texto.replace("- ", ", ").replace("\n\n", ". ").replace("\n", " ")
+    return texto.strip(" ,")
+
+
+class DivisorFrases:
+    """Acumula trechos de texto e devolve as frases à medida que se completam."""
+
+    def __init__(self):
+        self._buffer = ""
+
+    def alimentar(self, trecho: str) -> list[str]:
+        self._buffer += trecho
+        frases = []
+        inicio = 0
+        for m in _FIM_DE_FRASE.finditer(self._buffer):
+            palavra = self._buffer[inicio:m.start()].rsplit(None, 1)[-1:] or [""]
+            if m.group().strip() == "." and palavra[0].lower() in _ABREVIACOES:
+                continue   # "Dr. Fulano" não encerra a frase
+            frase = self._buffer[inicio:m.end()].strip()
+            if frase:
+                frases.append(frase)
+            inicio = m.end()
+        self._buffer = self._buffer[inicio:]
+        return frases
+
+    def finalizar(self) -> list[str]:
+        resto, self._buffer = self._buffer.strip(), ""
+        return [resto] if resto else []